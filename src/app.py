@@ -1,14 +1,10 @@
 import dash
+import flask
 from dash import dcc, html, Input, Output, State
-import pandas as pd
-import joblib
-import threading
-from src.realtime.packet_capture import start_live_capture, live_results
+from src import batch_api, explain, metrics, model_registry, online_learning
+from src.realtime.packet_capture import start_capture, capture_status, live_feed
 
-# Load saved objects once
-scaler = joblib.load('models/scaler.joblib')
-encoder = joblib.load('models/encoder.joblib')
-model = joblib.load('models/model.joblib')
+# Model artifacts are loaded lazily, once per process, through src.model_registry
 
 CHECK_ICON = '✅'
 WARNING_ICON = '⚠️'
@@ -31,6 +27,23 @@ FEATURE_NAMES = [
 
 app = dash.Dash(__name__)
 
+@app.server.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape target: stage latencies, throughput, queue depth, cache and model load stats
+    return flask.Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.server.route('/live/stream')
+def live_stream():
+    # Server-sent events: a downsampled snapshot for the chosen window, then one shared tick per second
+    window = flask.request.args.get('window', 300, type=int)
+    return flask.Response(live_feed.stream(window), mimetype='text/event-stream',
+                          headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# POST /api/score: JSON / NDJSON / CSV batches for other systems (see src.batch_api)
+batch_api.register_routes(app.server)
+# POST /api/feedback (labelled records for online learning), GET /api/drift (see src.online_learning)
+online_learning.register_routes(app.server)
+
 app.layout = html.Div([
     html.H2("NITD Real-Time Intrusion Detection",
             style={'color': dark_green_text, 'font-family': 'Courier New, monospace', 'text-align': 'center', 'margin-bottom': '25px'}),
@@ -157,7 +170,7 @@ app.layout = html.Div([
         'color': '#003366',
         'font-weight': 'bold'
     }),
-    html.Div(id="live-capture-output", style={
+    html.Div("Waiting for packets or capturing not started.", id="live-capture-output", style={
         'margin-top': '8px',
         'font-family': 'Courier New, monospace',
         'font-size': '15px',
@@ -165,7 +178,16 @@ app.layout = html.Div([
         'white-space': 'pre'
     }),
 
-    dcc.Interval(id='live-poll-interval', interval=1000, n_intervals=0),  # Every 1s
+    dcc.RadioItems(
+        id='live-window',
+        options=[{'label': ' 5 min ', 'value': 300}, {'label': ' 1 hour ', 'value': 3600}],
+        value=300,
+        inline=True,
+        style={'margin-top': '12px', 'font-family': 'Courier New, monospace', 'color': dark_green_text}
+    ),
+    # Filled from the /live/stream event source in the browser, not by server callbacks
+    dcc.Graph(id='live-rate-graph', config={'displayModeBar': False}, style={'height': '260px'}),
+    html.Div(id='live-stream-status', style={'display': 'none'}),
 
     html.Div(id='matrix-rain', style={
         'position': 'fixed', 'top': 0, 'left': 0, 'width': '100%', 'height': '100%', 
@@ -215,12 +237,8 @@ def handle_buttons(detect_clicks, clear_clicks, input_value):
                 error_msg = f"⚠️ Error: Expected {len(FEATURE_NAMES)} features but got {len(input_values)}."
                 return dash.no_update, error_msg, {'color': '#FF3333'}, '', {'display': 'none'}, '', {'display': 'none'}
 
-            raw_df = pd.DataFrame([input_values], columns=FEATURE_NAMES)
-            cat_cols = ['protocol_type', 'service', 'flag']
-            raw_df[cat_cols] = encoder.transform(raw_df[cat_cols])
-            numeric_cols = [col for col in raw_df.columns if col not in cat_cols + ['difficulty']]
-            raw_df[numeric_cols] = scaler.transform(raw_df[numeric_cols])
-            pred = model.predict(raw_df)
+            # Flat-array forest behind the shared prediction cache: repeated inputs skip the model
+            pred = model_registry.get_prediction_cache().predict([input_values])
 
             if pred[0] == 'normal':
                 pred_style = {
@@ -240,7 +258,10 @@ def handle_buttons(detect_clicks, clear_clicks, input_value):
                     'text-shadow': '0 0 10px #FF0000'
                 }
                 icon = WARNING_ICON
-                anomaly_reason = "Anomaly detected: Network behavior deviates from normal patterns."
+                # Path contributions: which input values pushed the forest towards this label
+                explanation = explain.explain_records([input_values], pred)[0]
+                anomaly_reason = (f"Anomaly detected ({pred[0]}, p={explanation['probability']:.2f}): "
+                                  f"{explain.describe(explanation, input_values)}")
                 anomaly_style = {'color': '#FF3333', 'marginTop': '10px', 'font-family': 'Courier New, monospace', 'font-weight': 'bold', 'display': 'block'}
 
             breakdown_lines = [f"{name}: {value}" for name, value in zip(FEATURE_NAMES, input_values)]
@@ -267,30 +288,96 @@ def handle_buttons(detect_clicks, clear_clicks, input_value):
             return dash.no_update, error_msg, {'color': '#FF3333', 'font-family': 'Courier New, monospace'}, '', {'display': 'none'}, '', {'display': 'none'}
     return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
-capture_thread = None
 @app.callback(
     [Output("live-capture-status", "children")],
     [Input("live-capture-btn", "n_clicks")]
 )
 def launch_live_capture(n_clicks):
-    global capture_thread
     if n_clicks:
-        if not capture_thread:
-            capture_thread = threading.Thread(target=start_live_capture, daemon=True)
-            capture_thread.start()
+        if not capture_status()['running']:
+            # The capture session sniffs on its own thread; this callback returns immediately
+            start_capture()
             return ["Live network capture started."]
         else:
             return ["Live capture is already running."]
     return [""]
 
-@app.callback(
-    Output("live-capture-output", "children"),
-    [Input("live-poll-interval", "n_intervals")]
+LIVE_LINES = 15
+
+# Each tab holds one EventSource on /live/stream (reopened when the window changes) and
+# applies the shared per-second ticks itself: result lines and rate chart are updated
+# with set_props, so the server does no per-tab work beyond writing the event.
+app.clientside_callback(
+    """
+    function(windowSeconds) {
+        const maxLines = %d;
+        const colors = {normal: '#009900', intrusion: '#FF3333', error: '#FFA500'};
+        if (window.liveSource) {
+            window.liveSource.close();
+        }
+        const source = new EventSource('/live/stream?window=' + windowSeconds);
+        window.liveSource = source;
+        let series = null;
+        let lines = [];
+
+        function render() {
+            const traces = ['normal', 'intrusion', 'error'].map(function(group) {
+                return {x: series.t, y: series[group], name: group, type: 'scatter', mode: 'lines',
+                        line: {color: colors[group], width: 1.5}};
+            });
+            dash_clientside.set_props('live-rate-graph', {figure: {data: traces, layout: {
+                paper_bgcolor: '#0f0f0f', plot_bgcolor: '#0f0f0f', font: {color: '#009900'},
+                margin: {l: 40, r: 10, t: 10, b: 30}, yaxis: {title: 'per second', rangemode: 'tozero'},
+                xaxis: {type: 'date'}, legend: {orientation: 'h'}
+            }}});
+            if (lines.length) {
+                dash_clientside.set_props('live-capture-output', {children: lines.join('\\n')});
+            }
+        }
+
+        function addLines(newLines) {
+            lines = lines.concat(newLines).slice(-maxLines);
+        }
+
+        source.addEventListener('snapshot', function(e) {
+            const data = JSON.parse(e.data);
+            series = data.series;
+            lines = [];
+            addLines(data.lines);
+            render();
+        });
+
+        source.addEventListener('tick', function(e) {
+            if (!series) {
+                return;
+            }
+            const data = JSON.parse(e.data);
+            // Fold the one-second counts into the server's bucket width
+            const width = series.bucket * 1000;
+            const start = data.t - (data.t %% width);
+            const last = series.t.length - 1;
+            if (last < 0 || series.t[last] !== start) {
+                series.t.push(start);
+                ['normal', 'intrusion', 'error'].forEach(function(g) { series[g].push(0); });
+            }
+            const i = series.t.length - 1;
+            ['normal', 'intrusion', 'error'].forEach(function(g) {
+                series[g][i] += data.counts[g] / series.bucket;
+            });
+            const since = data.t - series.window * 1000;
+            while (series.t.length && series.t[0] <= since) {
+                series.t.shift();
+                ['normal', 'intrusion', 'error'].forEach(function(g) { series[g].shift(); });
+            }
+            addLines(data.lines);
+            render();
+        });
+        return 'streaming';
+    }
+    """ % LIVE_LINES,
+    Output('live-stream-status', 'children'),
+    Input('live-window', 'value')
 )
-def update_live_output(n):
-    if live_results:
-        return html.Pre("\n".join(live_results[-15:]), style={"color": "#FFA500"})
-    return "Waiting for packets or capturing not started."
 
 app.clientside_callback(
     """
@@ -0,0 +1,315 @@
+"""
+HTTP batch scoring on the Flask server underneath the Dash app.
+
+    POST /api/score            body: JSON, NDJSON or CSV records (by Content-Type)
+
+A record is a list of the 41 raw feature values in feature_cols order (the same
+order as app.FEATURE_NAMES), or an object keyed by those names. CSV bodies are
+one record per line, with an optional header line. JSON bodies are a list of
+records or {"records": [...]}. CSV lines may carry the NSL-KDD label and
+difficulty columns after the features (as in data/KDDTest+.txt); they are ignored.
+
+Invalid records are reported per row and do not fail the request; a body that
+cannot be parsed at all, or that is over MAX_BODY_BYTES / MAX_RECORDS, is
+rejected with 400 / 413 before anything is scored, and one with no valid record
+at all with 422. Valid rows are scored in
+chunks of CHUNK_ROWS by a small thread pool shared by all requests, so a large
+batch never runs on the thread serving Dash callbacks, and results are streamed
+back chunk by chunk in the request's format (JSON bodies get a JSON document):
+
+    {"row": 0, "prediction": "normal"}
+    {"row": 1, "error": "expected 41 fields, got 40"}
+
+Parse time and record counts are sent as headers (X-Records, X-Invalid-Records,
+X-Parse-Ms, Server-Timing). JSON and NDJSON responses end with a summary that
+adds the scoring time, which is only known after the headers are gone.
+At most MAX_CONCURRENT requests score at once; more get 503 with Retry-After.
+
+    curl -s -H 'Content-Type: text/csv' --data-binary @data/KDDTest+.txt localhost:8050/api/score
+"""
+import csv
+import io
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src import metrics, model_registry
+from src.prediction_cache import predict_unique
+from src.preprocessing import categorical_cols, feature_cols
+
+MAX_BODY_BYTES = 64 * 2 ** 20
+MAX_RECORDS = 200000
+CHUNK_ROWS = 4096
+WORKERS = 2
+MAX_CONCURRENT = 4
+# Field counts of CSV lines with trailing label (and difficulty) columns
+LABELLED_FIELDS = (len(feature_cols) + 1, len(feature_cols) + 2)
+
+FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+    'text/plain': 'csv',
+}
+MIMETYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+_categorical_idx = [feature_cols.index(col) for col in categorical_cols]
+_numeric_idx = [i for i in range(len(feature_cols)) if i not in _categorical_idx]
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+
+class BatchError(Exception):
+    """A request that is rejected as a whole; carries the HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(WORKERS, thread_name_prefix="batch-score")
+        return _pool
+
+
+def parse_records(body, fmt, drop_labels=True):
+    """
+    Raw records from a request body: lists of values or dicts keyed by feature name.
+    drop_labels=False keeps the label columns of NSL-KDD CSV lines (for feedback).
+    """
+    text = body.decode('utf-8')
+    if fmt == 'json':
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('records')
+        if not isinstance(data, list):
+            raise BatchError('expected a JSON list of records or {"records": [...]}')
+        return data
+    if fmt == 'ndjson':
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    rows = [row for row in csv.reader(io.StringIO(text)) if row]
+    if rows and [field.strip() for field in rows[0][:len(feature_cols)]] == feature_cols:
+        rows = rows[1:]
+    # NSL-KDD files end each line with the label and the difficulty level
+    if not drop_labels:
+        return rows
+    return [row[:len(feature_cols)] if len(row) in LABELLED_FIELDS else row for row in rows]
+
+
+def _as_values(record):
+    if isinstance(record, dict):
+        missing = [name for name in feature_cols if name not in record]
+        if missing:
+            raise ValueError(f"missing fields: {', '.join(missing[:5])}")
+        extra = [name for name in record if name not in feature_cols]
+        if extra:
+            raise ValueError(f"unknown fields: {', '.join(map(str, extra[:5]))}")
+        return [record[name] for name in feature_cols]
+    if not isinstance(record, (list, tuple)):
+        raise ValueError("record must be a list of values or an object keyed by feature name")
+    if len(record) != len(feature_cols):
+        raise ValueError(f"expected {len(feature_cols)} fields, got {len(record)}")
+    return record
+
+
+def validate_record(record):
+    """(numeric values, categorical values) of one record; raises ValueError naming the bad field."""
+    values = _as_values(record)
+    numeric = []
+    for i in _numeric_idx:
+        value = values[i]
+        try:
+            number = float(value.strip() if isinstance(value, str) else value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{feature_cols[i]}: not a number: {value!r}") from None
+        if not math.isfinite(number):
+            raise ValueError(f"{feature_cols[i]}: not finite: {value!r}")
+        numeric.append(number)
+    categorical = []
+    for i in _categorical_idx:
+        value = values[i]
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{feature_cols[i]}: expected a non-empty string")
+        categorical.append(value.strip())
+    return numeric, categorical
+
+
+def _validate_rows(records):
+    rows, numeric, categorical, errors = [], [], [], []
+    for row, record in records:
+        try:
+            num, cat = validate_record(record)
+        except ValueError as e:
+            errors.append((row, str(e)))
+            continue
+        rows.append(row)
+        numeric.append(num)
+        categorical.append(cat)
+    numeric = np.array(numeric, dtype=np.float64).reshape(len(rows), len(_numeric_idx))
+    categoricals = [[cat[pos] for cat in categorical] for pos in range(len(_categorical_idx))]
+    return rows, numeric, categoricals, errors
+
+
+def _validate_block(start, block):
+    # Whole-block conversion; any failure sends the block through the per-row checks
+    if not all(isinstance(record, (list, tuple)) and len(record) == len(feature_cols) for record in block):
+        return None
+    raw = np.array(block, dtype=object)
+    try:
+        numeric = raw[:, _numeric_idx].astype(np.float64)
+    except (TypeError, ValueError):
+        return None
+    if not np.isfinite(numeric).all():
+        return None
+    categoricals = []
+    for i in _categorical_idx:
+        column = raw[:, i]
+        if not all(isinstance(value, str) and value and value == value.strip() for value in column):
+            return None
+        categoricals.append(list(column))
+    return list(range(start, start + len(block))), numeric, categoricals, []
+
+
+def validate(records):
+    """
+    Split records into the valid ones, as (row numbers, numeric array, categorical
+    columns), and [(row, error)] for the rest. Blocks of well-formed list records
+    are converted with one NumPy cast; only blocks with a bad row are checked row by row.
+    """
+    parts = []
+    for start in range(0, len(records), CHUNK_ROWS):
+        block = records[start:start + CHUNK_ROWS]
+        part = _validate_block(start, block)
+        parts.append(part if part is not None else _validate_rows(enumerate(block, start)))
+    if not parts:
+        parts.append(_validate_rows([]))
+    rows = [row for part in parts for row in part[0]]
+    numeric = np.concatenate([part[1] for part in parts])
+    categoricals = [[value for part in parts for value in part[2][pos]] for pos in range(len(_categorical_idx))]
+    errors = [error for part in parts for error in part[3]]
+    return rows, numeric, categoricals, errors
+
+
+def score_chunk(numeric, categoricals):
+    """Predicted labels for one chunk of validated rows (runs on the pool)."""
+    start = time.perf_counter()
+    X = model_registry.get_preprocessor().transform_columns(numeric, categoricals)
+    preprocessed = time.perf_counter()
+    predictions, _ = predict_unique(model_registry.get_serving_model().predict, X)
+    metrics.stage('preprocess').observe(preprocessed - start)
+    metrics.stage('predict').observe(time.perf_counter() - preprocessed)
+    model_registry.get_drift_monitor().update(X)
+    return predictions
+
+
+def _encode(fmt, results, first):
+    if fmt == 'csv':
+        out = io.StringIO()
+        writer = csv.writer(out)
+        if first:
+            writer.writerow(['row', 'prediction', 'error'])
+        for result in results:
+            writer.writerow([result['row'], result.get('prediction', ''), result.get('error', '')])
+        return out.getvalue()
+    lines = [json.dumps(result) for result in results]
+    if fmt == 'ndjson':
+        return ''.join(line + '\n' for line in lines)
+    return ('' if first else ',') + ','.join(lines) if lines else ''
+
+
+def stream_results(fmt, rows, numeric, categoricals, errors, summary):
+    """Score the valid rows chunk by chunk on the pool and yield the encoded results in row order."""
+    pool = get_pool()
+    start = time.perf_counter()
+    bounds = [(i, min(i + CHUNK_ROWS, len(rows))) for i in range(0, len(rows), CHUNK_ROWS)]
+    pending = [pool.submit(score_chunk, numeric[a:b], [col[a:b] for col in categoricals])
+               for a, b in bounds[:2]]
+    if fmt == 'json':
+        yield '{"results":['
+    first = True
+    error_pos = 0
+    for n, (a, b) in enumerate(bounds):
+        predictions = pending.pop(0).result()
+        if n + 2 < len(bounds):
+            # Keep one chunk queued behind the one being written
+            c, d = bounds[n + 2]
+            pending.append(pool.submit(score_chunk, numeric[c:d], [col[c:d] for col in categoricals]))
+        results = []
+        for row, prediction in zip(rows[a:b], predictions):
+            while error_pos < len(errors) and errors[error_pos][0] < row:
+                results.append({'row': errors[error_pos][0], 'error': errors[error_pos][1]})
+                error_pos += 1
+            results.append({'row': row, 'prediction': str(prediction)})
+        yield _encode(fmt, results, first)
+        first = False
+    yield _encode(fmt, [{'row': row, 'error': error} for row, error in errors[error_pos:]], first)
+    summary['score_ms'] = round(1000 * (time.perf_counter() - start), 3)
+    if fmt == 'json':
+        yield '],"summary":' + json.dumps(summary) + '}'
+    elif fmt == 'ndjson':
+        yield json.dumps({'summary': summary}) + '\n'
+
+
+def register_routes(server):
+    """Add the batch scoring endpoint to a Flask server (app.server)."""
+    import flask
+
+    def error_response(message, status, headers=None):
+        return flask.Response(json.dumps({'error': message}), status=status,
+                              mimetype='application/json', headers=headers)
+
+    @server.route('/api/score', methods=['POST'])
+    def score_batch():
+        request = flask.request
+        fmt = FORMATS.get(request.mimetype)
+        if fmt is None:
+            return error_response(f"unsupported Content-Type {request.mimetype!r}; "
+                                  f"use one of {', '.join(FORMATS)}", 415)
+        if request.content_length is not None and request.content_length > MAX_BODY_BYTES:
+            return error_response(f"body larger than {MAX_BODY_BYTES} bytes", 413)
+        if not _slots.acquire(blocking=False):
+            return error_response("too many batch requests in progress", 503, {'Retry-After': '1'})
+        try:
+            start = time.perf_counter()
+            # Bounded read: chunked uploads carry no Content-Length to check up front
+            body = request.stream.read(MAX_BODY_BYTES + 1)
+            if len(body) > MAX_BODY_BYTES:
+                raise BatchError(f"body larger than {MAX_BODY_BYTES} bytes", 413)
+            try:
+                records = parse_records(body, fmt)
+            except (UnicodeDecodeError, ValueError) as e:
+                raise BatchError(f"could not parse {fmt} body: {e}") from None
+            if len(records) > MAX_RECORDS:
+                raise BatchError(f"more than {MAX_RECORDS} records", 413)
+            rows, numeric, categoricals, errors = validate(records)
+            if not records:
+                raise BatchError("no records in the body", 422)
+            if not rows:
+                raise BatchError(f"no valid records ({len(errors)} invalid; row {errors[0][0]}: {errors[0][1]})", 422)
+            parse_ms = round(1000 * (time.perf_counter() - start), 3)
+        except BatchError as e:
+            _slots.release()
+            return error_response(str(e), e.status)
+        except Exception:
+            _slots.release()
+            raise
+
+        summary = {'records': len(records), 'scored': len(rows), 'invalid': len(errors), 'parse_ms': parse_ms}
+        response = flask.Response(stream_results(fmt, rows, numeric, categoricals, errors, summary),
+                                  mimetype=MIMETYPES[fmt], headers={
+                                      'X-Records': str(len(records)),
+                                      'X-Invalid-Records': str(len(errors)),
+                                      'X-Parse-Ms': str(parse_ms),
+                                      'Server-Timing': f'parse;dur={parse_ms}',
+                                  })
+        # Also runs when the client disconnects before the stream is consumed
+        response.call_on_close(_slots.release)
+        return response
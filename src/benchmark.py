@@ -0,0 +1,413 @@
+"""
+Offline benchmark suite for the detector's hot paths.
+
+Every case runs in a fresh interpreter, so its peak memory (ru_maxrss) and any
+lazy loading are measured in isolation and one case cannot warm the caches of the
+next. Inputs are rows of data/KDDTest+.txt and synthetic TCP/UDP traffic built
+from raw bytes, so no capture privileges or network access are needed.
+
+    python -m src.benchmark run -o benchmarks/baseline.json           # record a baseline
+    python -m src.benchmark run -o current.json --compare benchmarks/baseline.json --tolerance 0.15
+    python -m src.benchmark compare benchmarks/baseline.json current.json
+
+Each case reports per-operation latency percentiles (p50/p90/p99, microseconds),
+throughput in items per second and peak resident memory. compare flags a case
+as a regression when its p50 latency grows, or its throughput drops, by more
+than the tolerance, or its peak memory grows by more than the memory tolerance.
+A case that crashes, or one in the baseline that the current run lacks, is a
+regression too; the exit status is 1 if anything regressed.
+"""
+import argparse
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+
+KDD_PATH = 'data/KDDTest+.txt'
+SYNTHETIC_FLOWS = 2000
+
+
+def peak_rss_bytes():
+    """Peak resident size of this process or of any child it waited for."""
+    import resource
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentiles(samples, items_per_sample=1):
+    """Latency percentiles per item (microseconds) and throughput for a list of sample durations."""
+    per_item = np.asarray(samples, dtype=np.float64) / items_per_sample
+    total = float(np.sum(samples))
+    return {
+        'samples': len(samples),
+        'p50_us': float(np.percentile(per_item, 50)) * 1e6,
+        'p90_us': float(np.percentile(per_item, 90)) * 1e6,
+        'p99_us': float(np.percentile(per_item, 99)) * 1e6,
+        'mean_us': float(np.mean(per_item)) * 1e6,
+        'items_per_s': len(samples) * items_per_sample / total if total else 0.0,
+    }
+
+
+def timed(fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def kdd_records(n=None):
+    import pandas as pd
+    from src.preprocessing import columns, column_dtypes, feature_cols
+    df = pd.read_csv(KDD_PATH, names=columns, dtype=column_dtypes, nrows=n)
+    return df[feature_cols].values
+
+
+def synthetic_frames(n_flows=SYNTHETIC_FLOWS, seed=7):
+    """
+    Raw Ethernet/IPv4 frames for a reproducible traffic mix: TCP connections
+    (handshake, request/response, FIN teardown), half-open SYN probes and UDP
+    request/reply pairs. Returns a list of (ts, frame bytes).
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    ts = 1_700_000_000.0
+
+    def frame(proto, src, dst, sport, dport, payload, flags=0):
+        if proto == 6:
+            l4 = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 5 << 4, flags, 65535, 0, 0)
+        else:
+            l4 = struct.pack('!HHHH', sport, dport, 8 + payload, 0)
+        ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(l4) + payload, 0, 0, 64, proto, 0,
+                         bytes(src), bytes(dst))
+        return b'\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb\x08\x00' + ip + l4 + b'\x00' * payload
+
+    for i in range(n_flows):
+        client = [10, 0, int(rng.integers(0, 256)), int(rng.integers(1, 255))]
+        server = [192, 168, 1, int(rng.integers(1, 20))]
+        sport = 20000 + i % 40000
+        kind = rng.random()
+        ts += float(rng.exponential(0.002))
+        if kind < 0.6:
+            dport = int(rng.choice([80, 443, 22, 25, 21]))
+            request, response = int(rng.integers(0, 600)), int(rng.integers(0, 1400))
+            packets = [(client, server, sport, dport, 0, 0x02), (server, client, dport, sport, 0, 0x12),
+                       (client, server, sport, dport, 0, 0x10), (client, server, sport, dport, request, 0x18),
+                       (server, client, dport, sport, response, 0x18), (client, server, sport, dport, 0, 0x11),
+                       (server, client, dport, sport, 0, 0x11), (client, server, sport, dport, 0, 0x10)]
+            for k, (a, b, sp, dp, size, flags) in enumerate(packets):
+                frames.append((ts + k * 1e-4, frame(6, a, b, sp, dp, size, flags)))
+        elif kind < 0.8:
+            dport = int(rng.integers(1, 1024))
+            frames.append((ts, frame(6, client, server, sport, dport, 0, 0x02)))
+            frames.append((ts + 1e-4, frame(6, server, client, dport, sport, 0, 0x14)))
+        else:
+            dport = int(rng.choice([53, 123]))
+            frames.append((ts, frame(17, client, server, sport, dport, 40)))
+            frames.append((ts + 1e-4, frame(17, server, client, dport, sport, 120)))
+    frames.sort(key=lambda f: f[0])
+    return frames
+
+
+def write_pcap(path, frames):
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for ts, data in frames:
+            sec = int(ts)
+            f.write(struct.pack('<IIII', sec, int(round((ts - sec) * 1e6)), len(data), len(data)))
+            f.write(data)
+
+
+# --- cases: each returns (samples, items per sample) ------------------------------
+
+def case_preprocess_single():
+    from src import model_registry
+    from src.preprocessing import preprocess_features
+    encoder, scaler = model_registry.get_encoder(), model_registry.get_scaler()
+    records = [list(r) for r in kdd_records(2000)]
+    preprocess_features(records[0], encoder, scaler)
+    return timed(lambda r: preprocess_features(r, encoder, scaler), [(r,) for r in records]), 1
+
+
+def case_preprocess_batch():
+    from src import model_registry
+    preprocessor = model_registry.get_preprocessor()
+    records = kdd_records()
+    batches = [(records[i:i + 1024],) for i in range(0, len(records) - 1023, 1024)]
+    return timed(preprocessor.transform, batches * 3), 1024
+
+
+def _kdd_matrix(n=None):
+    from src import model_registry
+    return model_registry.get_preprocessor().transform(kdd_records(n))
+
+
+def case_predict_single_compiled():
+    from src import model_registry
+    model = model_registry.get_compiled_model()
+    X = _kdd_matrix(1000)
+    return timed(model.predict, [(X[i:i + 1],) for i in range(len(X))]), 1
+
+
+def case_predict_single_sklearn():
+    from src import model_registry
+    model = model_registry.get_model()
+    X = _kdd_matrix(200)
+    model.predict(X[:1])
+    return timed(model.predict, [(X[i:i + 1],) for i in range(len(X))]), 1
+
+
+def case_predict_batch_sklearn():
+    from src import model_registry
+    model = model_registry.get_model()
+    X = _kdd_matrix()
+    batches = [(X[i:i + 4096],) for i in range(0, len(X) - 4095, 4096)]
+    return timed(model.predict, batches), 4096
+
+
+def case_predict_micro_batch_compiled():
+    from src import model_registry
+    model = model_registry.get_compiled_model()
+    X = _kdd_matrix(8192)
+    return timed(model.predict, [(X[i:i + 32],) for i in range(0, len(X), 32)]), 32
+
+
+def case_predict_micro_batch_serving():
+    # The cascade over the compiled forest when the bundle has a calibrated one
+    from src import model_registry
+    model = model_registry.get_serving_model()
+    X = _kdd_matrix(8192)
+    return timed(model.predict, [(X[i:i + 32],) for i in range(0, len(X), 32)]), 32
+
+
+def case_decode_fast():
+    from src.realtime.fast_decode import decode_frame
+    frames = synthetic_frames()
+    return timed(lambda f: [decode_frame(data, ts) for ts, data in f],
+                 [(frames[i:i + 256],) for i in range(0, len(frames) - 255, 256)]), 256
+
+
+def case_decode_scapy():
+    from scapy.layers.l2 import Ether
+    from src.realtime.feature_extractor import parse_packet
+    frames = synthetic_frames(300)
+    return timed(lambda f: [parse_packet(Ether(data)) for _, data in f],
+                 [(frames[i:i + 64],) for i in range(0, len(frames) - 63, 64)]), 64
+
+
+def case_extract_features():
+    """Packet fields -> flow table -> 41 connection features (with window statistics)."""
+    from src.realtime.fast_decode import decode_frame
+    from src.realtime.feature_extractor import extract_connection_features
+    from src.realtime.flow_table import FlowTable
+    from src.realtime.traffic_stats import TrafficStats
+    fields = [decode_frame(data, ts) for ts, data in synthetic_frames()]
+    flow_table, traffic_stats = FlowTable(), TrafficStats()
+
+    def run(chunk):
+        for f in chunk:
+            for conn in flow_table.update(*f):
+                extract_connection_features(conn, traffic_stats)
+
+    return timed(run, [(fields[i:i + 256],) for i in range(0, len(fields) - 255, 256)]), 256
+
+
+def case_extract_features_legacy():
+    """The original per-packet extract_features() on dissected scapy packets."""
+    from scapy.layers.l2 import Ether
+    from src.realtime.feature_extractor import extract_features
+    packets = [Ether(data) for _, data in synthetic_frames(300)]
+    return timed(extract_features, [(p,) for p in packets]), 1
+
+
+def case_pipeline():
+    """Whole offline path on a synthetic pcap: read, decode, flows, features, preprocess, predict, write."""
+    from src.realtime.offline import score_pcaps
+    frames = synthetic_frames()
+    with tempfile.TemporaryDirectory() as tmp:
+        pcap = os.path.join(tmp, 'synthetic.pcap')
+        write_pcap(pcap, frames)
+        out = os.path.join(tmp, 'out.csv')
+        score_pcaps([pcap], out)  # warm-up: model load
+        return timed(lambda: score_pcaps([pcap], out), [()] * 3), len(frames)
+
+
+def case_app_cold_start():
+    """Wall time of `import src.app` in fresh interpreters."""
+    code = "import time; t = time.perf_counter(); import src.app; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(3):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return samples, 1
+
+
+CASES = {
+    'preprocess_single': case_preprocess_single,
+    'preprocess_batch': case_preprocess_batch,
+    'predict_single_compiled': case_predict_single_compiled,
+    'predict_single_sklearn': case_predict_single_sklearn,
+    'predict_micro_batch_compiled': case_predict_micro_batch_compiled,
+    'predict_micro_batch_serving': case_predict_micro_batch_serving,
+    'predict_batch_sklearn': case_predict_batch_sklearn,
+    'decode_fast': case_decode_fast,
+    'decode_scapy': case_decode_scapy,
+    'extract_features': case_extract_features,
+    'extract_features_legacy': case_extract_features_legacy,
+    'pipeline': case_pipeline,
+    'app_cold_start': case_app_cold_start,
+}
+
+
+def run_case(name):
+    """Run one case in this process and return its result dict."""
+    warnings.filterwarnings("ignore")
+    samples, items = CASES[name]()
+    result = percentiles(samples, items)
+    result['peak_rss_mb'] = peak_rss_bytes() / 2**20
+    return result
+
+
+def run_suite(names):
+    results = {}
+    for name in names:
+        # A fresh interpreter per case keeps peak memory and load times independent
+        proc = subprocess.run([sys.executable, '-m', 'src.benchmark', '_case', name],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            error = proc.stderr.strip()[-2000:]
+            print(f"{name:<30} FAILED\n{error}")
+            # Kept in the results so compare() reports it instead of skipping the case
+            results[name] = {'failed': True, 'error': error.splitlines()[-1] if error else f"exit {proc.returncode}"}
+            continue
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        r = results[name]
+        print(f"{name:<30} p50 {r['p50_us']:>10.1f}us  p99 {r['p99_us']:>10.1f}us  "
+              f"{r['items_per_s']:>12,.0f}/s  peak {r['peak_rss_mb']:7.1f} MiB")
+    return results
+
+
+def environment():
+    import sklearn
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(baseline, current, tolerance=0.10, memory_tolerance=0.20):
+    """
+    List of (case, metric, baseline, current, change) for every regression beyond
+    tolerance. A case that failed, or that the baseline has and current lacks, is a
+    regression with metric 'failed' / 'missing' (values None).
+    """
+    regressions = []
+    for name, old in baseline['cases'].items():
+        if name not in current['cases'] and not old.get('failed'):
+            regressions.append((name, 'missing', None, None, None))
+    for name, new in current['cases'].items():
+        if new.get('failed'):
+            regressions.append((name, 'failed', None, None, None))
+            continue
+        old = baseline['cases'].get(name)
+        if old is None or old.get('failed'):
+            continue
+        checks = [
+            ('p50_us', old['p50_us'], new['p50_us'], new['p50_us'] > old['p50_us'] * (1 + tolerance)),
+            ('items_per_s', old['items_per_s'], new['items_per_s'],
+             new['items_per_s'] < old['items_per_s'] * (1 - tolerance)),
+            ('peak_rss_mb', old['peak_rss_mb'], new['peak_rss_mb'],
+             new['peak_rss_mb'] > old['peak_rss_mb'] * (1 + memory_tolerance)),
+        ]
+        for metric, before, after, regressed in checks:
+            if regressed:
+                regressions.append((name, metric, before, after, after / before - 1 if before else float('inf')))
+    return regressions
+
+
+def print_comparison(baseline, current, regressions, tolerance):
+    print(f"Baseline {baseline['environment'].get('commit')} vs current {current['environment'].get('commit')} "
+          f"(tolerance {tolerance:.0%})")
+    for name, new in current['cases'].items():
+        old = baseline['cases'].get(name)
+        if new.get('failed'):
+            print(f"  {name:<30} FAILED: {new['error']}")
+            continue
+        if old is None or old.get('failed'):
+            print(f"  {name:<30} new case")
+            continue
+        print(f"  {name:<30} p50 {new['p50_us'] / old['p50_us'] - 1:+7.1%}  "
+              f"throughput {new['items_per_s'] / old['items_per_s'] - 1:+7.1%}  "
+              f"peak memory {new['peak_rss_mb'] / old['peak_rss_mb'] - 1:+7.1%}")
+    for name, metric, before, after, change in regressions:
+        if before is None:
+            print(f"REGRESSION {name} {metric}")
+        else:
+            print(f"REGRESSION {name} {metric}: {before:,.1f} -> {after:,.1f} ({change:+.1%})")
+    if not regressions:
+        print("No regressions.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite with baseline comparison.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="run the suite and write a JSON result")
+    run.add_argument('-o', '--output', default='benchmarks/baseline.json')
+    run.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    run.add_argument('--compare', metavar='BASELINE', help="compare against this baseline afterwards")
+    cmp = sub.add_parser('compare', help="compare two result files")
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    for p in (run, cmp):
+        p.add_argument('--tolerance', type=float, default=0.10, help="allowed latency/throughput change")
+        p.add_argument('--memory-tolerance', type=float, default=0.20, help="allowed peak memory growth")
+    case = sub.add_parser('_case')
+    case.add_argument('name', choices=list(CASES))
+    args = parser.parse_args()
+
+    if args.command == '_case':
+        print(json.dumps(run_case(args.name)))
+        return
+
+    if args.command == 'run':
+        current = {'environment': environment(), 'cases': run_suite(args.cases)}
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+        if not args.compare:
+            return
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    regressions = compare(baseline, current, args.tolerance, args.memory_tolerance)
+    print_comparison(baseline, current, regressions, args.tolerance)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
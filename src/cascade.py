@@ -0,0 +1,200 @@
+"""
+Two-stage cascade in front of the full forest.
+
+Almost all live traffic is benign, yet every record used to pay for all 100
+trees. The cascade first scores every row with a small, shallow forest trained
+alongside the full one to tell normal traffic from attacks (a few trees of depth
+FIRST_STAGE_DEPTH, a fraction of the full forest's nodes and depth). Rows it
+gives a probability of normal of at least `threshold` are answered 'normal'
+right away; only the uncertain and suspicious rest is escalated to the full
+forest. Both stages are CompiledForests over the same preprocessed input, so
+the cascade is a drop-in model (predict, classes_) for the prediction cache, the
+live engine and the batch API.
+
+The threshold is picked on labelled data for a target recall loss: the share of
+the file's intrusions that the full forest detects but the cascade would clear.
+No threshold below 0.5 is used, so a row the first stage thinks is an attack is
+never cleared. The first stage and its threshold are stored in the model bundle;
+a bundle without a threshold serves the full forest alone.
+
+    python -m src.cascade --test data/KDDTest+.txt --max-recall-loss 0.001
+    python -m src.cascade --off                  # keep the first stage, serve the forest alone
+"""
+import argparse
+import os
+import threading
+import time
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from src.compiled_forest import CompiledForest
+
+NORMAL_LABEL = 'normal'
+FIRST_STAGE_TREES = 4
+FIRST_STAGE_DEPTH = 8
+DEFAULT_MAX_RECALL_LOSS = 0.001
+MIN_THRESHOLD = 0.5
+
+
+def fit_first_stage(X, labels, n_trees=FIRST_STAGE_TREES, max_depth=FIRST_STAGE_DEPTH, n_jobs=-1):
+    """Shallow normal-vs-attack forest on the full forest's training input, compiled."""
+    y = np.where(np.asarray(labels) == NORMAL_LABEL, NORMAL_LABEL, 'attack')
+    model = RandomForestClassifier(n_estimators=n_trees, max_depth=max_depth, random_state=42, n_jobs=n_jobs)
+    return CompiledForest.from_sklearn(model.fit(X, y))
+
+
+class CascadeModel:
+    """
+    First stage + full forest with the predict() / classes_ of the forest.
+    model can be replaced at any time (e.g. by an online learning swap); a batch
+    in flight finishes with the forest it started with.
+    """
+
+    def __init__(self, first_stage, model, threshold):
+        self.first_stage = first_stage
+        self.model = model
+        self.threshold = float(threshold)
+        self._normal = list(first_stage.classes_).index(NORMAL_LABEL)
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.escalated = 0
+
+    @property
+    def classes_(self):
+        return self.model.classes_
+
+    @property
+    def n_features_in_(self):
+        return self.model.n_features_in_
+
+    def normal_scores(self, X):
+        """First-stage probability of normal for each row."""
+        return self.first_stage.predict_proba(X)[:, self._normal]
+
+    def predict(self, X):
+        model = self.model
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        escalate = np.flatnonzero(self.normal_scores(X) < self.threshold)
+        out = np.full(len(X), NORMAL_LABEL, dtype=model.classes_.dtype)
+        if len(escalate):
+            out[escalate] = model.predict(X[escalate])
+        with self._lock:
+            self.rows += len(X)
+            self.escalated += len(escalate)
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {'threshold': self.threshold, 'rows': self.rows, 'escalated': self.escalated,
+                    'escalated_fraction': self.escalated / self.rows if self.rows else 0.0}
+
+
+def calibrate(first_stage, model, X, labels, max_recall_loss=DEFAULT_MAX_RECALL_LOSS):
+    """
+    Lowest threshold (most rows cleared) whose recall loss on (X, labels) is at
+    most max_recall_loss, with the escalated fraction and detection rates it gives.
+    """
+    labels = np.asarray(labels)
+    attacks = labels != NORMAL_LABEL
+    forest_pred = model.predict(X)
+    detected = attacks & (forest_pred != NORMAL_LABEL)
+    scores = CascadeModel(first_stage, model, 1.0).normal_scores(X)
+
+    # Clearing a row needs score >= threshold; allow at most `allowed` detected intrusions through
+    allowed = int(max_recall_loss * attacks.sum())
+    detected_scores = np.sort(scores[detected])[::-1]
+    threshold = MIN_THRESHOLD
+    if allowed < len(detected_scores):
+        threshold = max(threshold, float(np.nextafter(detected_scores[allowed], np.inf)))
+    # Above 1.0 when even the surest rows would cost too much recall: everything escalates
+    escalate = scores < threshold
+
+    cascade_pred = np.where(escalate, forest_pred, NORMAL_LABEL)
+    n_attacks = max(int(attacks.sum()), 1)
+    return {
+        'threshold': threshold,
+        'rows': len(labels),
+        'escalated_fraction': float(escalate.mean()) if len(labels) else 0.0,
+        'forest_detection_rate': float(detected.sum() / n_attacks),
+        'cascade_detection_rate': float((attacks & (cascade_pred != NORMAL_LABEL)).sum() / n_attacks),
+        'recall_loss': float((detected & ~escalate).sum() / n_attacks),
+        'forest_accuracy': float(np.mean(forest_pred == labels)),
+        'cascade_accuracy': float(np.mean(cascade_pred == labels)),
+    }
+
+
+def throughput(predict, X, batch_size, repeat=3):
+    """Best-of-repeat rows per second of predict over X in batches of batch_size."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(0, len(X), batch_size):
+            predict(X[i:i + batch_size])
+        best = min(best, time.perf_counter() - start)
+    return len(X) / best
+
+
+def main():
+    from src import model_registry
+    from src.model_bundle import MANIFEST, load_bundle, save_compiled
+    from src.preprocessing import categorical_cols
+    from src.train import load_dataset
+
+    parser = argparse.ArgumentParser(description="Calibrate the cascade's first-stage threshold.")
+    parser.add_argument('--test', default='data/KDDTest+.txt', help="labelled NSL-KDD file to calibrate on")
+    parser.add_argument('--max-recall-loss', type=float, default=DEFAULT_MAX_RECALL_LOSS,
+                        help="share of intrusions the forest detects that the cascade may clear")
+    parser.add_argument('--train', default=None,
+                        help="fit a new first stage on this NSL-KDD file (default: the bundle's)")
+    parser.add_argument('--batch', type=int, default=256, help="batch size for the throughput comparison")
+    parser.add_argument('--bundle', default=model_registry.BUNDLE_PATH)
+    parser.add_argument('--dry-run', action='store_true', help="report only, leave the bundle unchanged")
+    parser.add_argument('--off', action='store_true', help="store no threshold: serve the full forest alone")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.bundle, MANIFEST)):
+        parser.error(f"no model bundle at {args.bundle}; run python -m src.model_bundle build")
+    bundle = load_bundle(args.bundle)
+    preprocessor, model = bundle.preprocessor, bundle.model
+
+    def encoded(path):
+        data = load_dataset(path)
+        return preprocessor.transform_columns(data['numeric'], [data[col] for col in categorical_cols]), data['label']
+
+    first_stage = bundle.first_stage
+    if args.train:
+        first_stage = fit_first_stage(*encoded(args.train))
+    if first_stage is None:
+        parser.error("the bundle has no first stage; pass --train or retrain with python -m src.train")
+
+    if args.off:
+        save_compiled(args.bundle, model, preprocessor, first_stage=first_stage, threshold=None,
+                      model_sha256=bundle.manifest.get('model_sha256'))
+        print(f"Cascade disabled in {args.bundle}")
+        return
+
+    X, labels = encoded(args.test)
+    report = calibrate(first_stage, model, X, labels, args.max_recall_loss)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    cascade = CascadeModel(first_stage, model, report['threshold'])
+    forest_rate = throughput(model.predict, X, args.batch)
+    cascade_rate = throughput(cascade.predict, X, args.batch)
+
+    print(f"First stage: {first_stage.n_trees} trees, {len(first_stage.feature):,} nodes, depth {first_stage.max_depth} "
+          f"(forest: {model.n_trees} trees, {len(model.feature):,} nodes, depth {model.max_depth})")
+    print(f"Threshold {report['threshold']:.4f} for recall loss <= {args.max_recall_loss:.4f} on {report['rows']} rows")
+    print(f"  escalated to the forest   {report['escalated_fraction']:8.2%}")
+    print(f"  recall loss               {report['recall_loss']:8.2%}")
+    print(f"  detection rate            {report['forest_detection_rate']:8.2%} -> {report['cascade_detection_rate']:.2%}")
+    print(f"  accuracy                  {report['forest_accuracy']:8.2%} -> {report['cascade_accuracy']:.2%}")
+    print(f"  rows/s (batches of {args.batch}) {forest_rate:10,.0f} -> {cascade_rate:,.0f} "
+          f"({cascade_rate / forest_rate:.2f}x)")
+    if not args.dry_run:
+        save_compiled(args.bundle, model, preprocessor, first_stage=first_stage, threshold=report['threshold'],
+                      model_sha256=bundle.manifest.get('model_sha256'))
+        print(f"Threshold saved to {args.bundle}")
+
+
+if __name__ == '__main__':
+    main()
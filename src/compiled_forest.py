@@ -0,0 +1,246 @@
+"""
+Flat-array form of a trained RandomForestClassifier for low-latency prediction.
+
+All trees are concatenated into one structure of arrays (split feature, threshold,
+child pointers, per-node class distribution) and traversed with NumPy, one level
+of every tree at a time, instead of going through sklearn's per-call validation,
+joblib dispatch and per-tree Python loop. Predictions are identical to
+model.predict(): inputs are compared as float32 exactly like sklearn's trees, leaf
+distributions are normalized the same way and accumulated over the trees in the
+same order.
+
+The traversal is NumPy-level, so its win is on single rows and micro-batches
+(the Dash detect callback, the live capture batches): per-call overhead drops
+from milliseconds to well under one. For batches of many thousands of rows,
+sklearn's compiled traversal is faster and bulk scorers should keep using it.
+
+    python -m src.compiled_forest        # benchmark against sklearn on data/KDDTest+.txt
+"""
+import time
+import numpy as np
+
+# Rows traversed at once; bounds the (rows x trees x classes) temporary
+ROW_BLOCK = 256
+
+
+def float32_thresholds(threshold):
+    """
+    Largest float32 <= each float64 threshold. For a float32 input x,
+    x <= t  <=>  x <= t32, so splits can be evaluated entirely in float32.
+    """
+    t32 = threshold.astype(np.float32)
+    too_big = t32.astype(np.float64) > threshold
+    t32[too_big] = np.nextafter(t32[too_big], np.float32(-np.inf))
+    return t32
+
+
+class CompiledForest:
+
+    def __init__(self, feature, threshold, children, value, roots, classes, max_depth, n_features):
+        # np.asarray turns np.memmap inputs into plain ndarray views of the same
+        # pages: indexing a memmap subclass is noticeably slower per call
+        feature, threshold, children, value, roots = (
+            np.asarray(a) for a in (feature, threshold, children, value, roots))
+        self.feature = feature        # (n_nodes,) int32, 0 at leaves
+        self.threshold = threshold    # (n_nodes,) float64
+        self.children = children      # (n_nodes, 2) int32 [left, right]; leaves point to themselves
+        self.value = value            # (n_nodes, n_classes) float64, normalized class distribution
+        self.roots = roots            # (n_trees,) int32
+        self.classes_ = classes
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features)
+
+        # Traversal-ready views: native index width, flat child table, float32 splits.
+        # Arrays already stored as intp (e.g. memory-mapped from a bundle) are not copied.
+        self._feature = feature.astype(np.intp, copy=False)
+        self._children = children.astype(np.intp, copy=False).ravel()
+        self._threshold32 = float32_thresholds(np.asarray(threshold, dtype=np.float64))
+        self._is_leaf = children[:, 0] == np.arange(len(children))
+        self._roots = roots.astype(np.intp, copy=False)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        offsets = []
+        total = 0
+        for est in model.estimators_:
+            offsets.append(total)
+            total += est.tree_.node_count
+
+        n_classes = len(model.classes_)
+        feature = np.zeros(total, dtype=np.int32)
+        threshold = np.zeros(total, dtype=np.float64)
+        children = np.zeros((total, 2), dtype=np.int32)
+        value = np.zeros((total, n_classes), dtype=np.float64)
+        max_depth = 0
+
+        for offset, est in zip(offsets, model.estimators_):
+            tree = est.tree_
+            n = tree.node_count
+            nodes = np.arange(offset, offset + n, dtype=np.int32)
+            leaf = tree.children_left == -1
+            feature[nodes] = np.where(leaf, 0, tree.feature)
+            threshold[nodes] = np.where(leaf, 0.0, tree.threshold)
+            children[nodes, 0] = np.where(leaf, nodes, tree.children_left + offset)
+            children[nodes, 1] = np.where(leaf, nodes, tree.children_right + offset)
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            proba = tree.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            value[nodes] = proba / normalizer
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(feature, threshold, children, value, np.array(offsets, dtype=np.int32),
+                   np.asarray(model.classes_), max_depth, model.n_features_in_)
+
+    @classmethod
+    def concat(cls, forests, weights=None):
+        """
+        One forest voting with every tree of the given forests (e.g. a base forest
+        plus trees fitted later on new data). Classes keep the first forest's order;
+        labels it does not know are appended, with zero probability in the trees
+        that never saw them. weights, if given, is the vote of each tree of each
+        forest relative to the others; it is folded into the leaf values, so the
+        result is a plain forest whose predict_proba is the weighted average.
+        """
+        classes = list(forests[0].classes_)
+        for forest in forests[1:]:
+            classes += [c for c in forest.classes_ if c not in classes]
+        column = {c: i for i, c in enumerate(classes)}
+
+        total = sum(len(forest.feature) for forest in forests)
+        feature = np.zeros(total, dtype=np.int32)
+        threshold = np.zeros(total, dtype=np.float64)
+        children = np.zeros((total, 2), dtype=np.int32)
+        value = np.zeros((total, len(classes)), dtype=np.float64)
+        roots = []
+        offset = 0
+        n_trees = sum(forest.n_trees for forest in forests)
+        if weights is None:
+            weights = [1.0] * len(forests)
+        total_weight = sum(w * forest.n_trees for w, forest in zip(weights, forests))
+        for forest, weight in zip(forests, weights):
+            n = len(forest.feature)
+            nodes = slice(offset, offset + n)
+            feature[nodes] = forest.feature
+            threshold[nodes] = forest.threshold
+            children[nodes] = np.asarray(forest.children) + offset
+            value[nodes, [column[c] for c in forest.classes_]] = forest.value
+            if weight * n_trees != total_weight:
+                value[nodes] *= weight * n_trees / total_weight
+            roots.append(np.asarray(forest.roots) + offset)
+            offset += n
+        return cls(feature, threshold, children, value, np.concatenate(roots).astype(np.int32),
+                   np.array(classes, dtype=object), max(f.max_depth for f in forests), forests[0].n_features_in_)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def apply(self, X):
+        """Leaf node index reached in every tree: (n_samples, n_trees)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n, n_features = X.shape
+        flat_x = X.ravel()
+        nodes = np.tile(self._roots, n)
+        x_base = np.repeat(np.arange(n, dtype=np.intp) * n_features, self.n_trees)
+
+        # Only (row, tree) pairs that have not reached a leaf yet are advanced each level
+        active = np.flatnonzero(~self._is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            go_right = flat_x[x_base[active] + self._feature[current]] > self._threshold32[current]
+            following = self._children[2 * current + go_right]
+            nodes[active] = following
+            active = active[~self._is_leaf[following]]
+        return nodes.reshape(n, self.n_trees)
+
+    def decision_steps(self, X):
+        """
+        The decision paths of X, one tree level at a time: yields (rows, features,
+        nodes) for every (row, tree) pair still descending, where features[i] is
+        the feature the split tested for rows[i] and nodes[i] the child it went to.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n, n_features = X.shape
+        flat_x = X.ravel()
+        nodes = np.tile(self._roots, n)
+        rows = np.repeat(np.arange(n, dtype=np.intp), self.n_trees)
+        active = np.flatnonzero(~self._is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            split = self._feature[current]
+            go_right = flat_x[rows[active] * n_features + split] > self._threshold32[current]
+            following = self._children[2 * current + go_right]
+            yield rows[active], split, following
+            nodes[active] = following
+            active = active[~self._is_leaf[following]]
+
+    def predict_proba(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        out = np.empty((len(X), len(self.classes_)), dtype=np.float64)
+        for start in range(0, len(X), ROW_BLOCK):
+            leaves = self.apply(X[start:start + ROW_BLOCK])
+            # Summing over the tree axis adds the trees one after another in estimator
+            # order, the same accumulation RandomForestClassifier.predict_proba does
+            proba = self.value[leaves].sum(axis=1)
+            proba /= self.n_trees
+            out[start:start + ROW_BLOCK] = proba
+        return out
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+def benchmark(model, X, single_rows=200, micro_batch=32, repeat=3):
+    """Compare sklearn and compiled prediction latency/throughput on the rows of X."""
+    compiled = CompiledForest.from_sklearn(model)
+    assert np.array_equal(compiled.predict(X), model.predict(X)), "compiled predictions differ from sklearn"
+
+    def single_row_us(predict):
+        rows = X[:single_rows]
+        start = time.perf_counter()
+        for row in rows:
+            predict(row.reshape(1, -1))
+        return 1e6 * (time.perf_counter() - start) / len(rows)
+
+    def batch_rows_per_s(predict, size=None):
+        size = size or len(X)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for i in range(0, len(X), size):
+                predict(X[i:i + size])
+            best = min(best, time.perf_counter() - start)
+        return len(X) / best
+
+    return {
+        'sklearn_single_row_us': single_row_us(model.predict),
+        'compiled_single_row_us': single_row_us(compiled.predict),
+        'sklearn_micro_batch_rows_per_s': batch_rows_per_s(model.predict, micro_batch),
+        'compiled_micro_batch_rows_per_s': batch_rows_per_s(compiled.predict, micro_batch),
+        'sklearn_batch_rows_per_s': batch_rows_per_s(model.predict),
+        'compiled_batch_rows_per_s': batch_rows_per_s(compiled.predict),
+        'nodes': len(compiled.feature),
+        'max_depth': compiled.max_depth,
+    }
+
+
+if __name__ == '__main__':
+    import warnings
+    import joblib
+    import pandas as pd
+    from src.preprocessing import columns, column_dtypes, feature_cols, preprocess_features_batch
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    model = joblib.load('models/model.joblib')
+    df = pd.read_csv('data/KDDTest+.txt', names=columns, dtype=column_dtypes)
+    X = preprocess_features_batch(df[feature_cols].values, joblib.load('models/encoder.joblib'),
+                                  joblib.load('models/scaler.joblib'))
+    for name, value in benchmark(model, X).items():
+        print(f"{name:<34}{value:,.1f}")
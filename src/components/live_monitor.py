@@ -1,9 +1,6 @@
 import dash
 from dash import html
-import threading
-from src.realtime.packet_capture import start_live_capture
-
-capture_thread = None
+from src.realtime.packet_capture import start_capture, stop_capture, capture_status
 
 def layout():
     return html.Div([
@@ -14,7 +11,6 @@ def layout():
     ])
 
 def register_callbacks(app):
-    global capture_thread
 
     @app.callback(
         dash.dependencies.Output("live-monitor-output", "children"),
@@ -22,14 +18,14 @@ def register_callbacks(app):
          dash.dependencies.Input("stop-btn", "n_clicks")],
     )
     def control_capture(start_clicks, stop_clicks):
-        global capture_thread
         changed_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
-        if "start-btn" in changed_id and not capture_thread:
-            capture_thread = threading.Thread(target=start_live_capture, daemon=True)
-            capture_thread.start()
+        running = capture_status()['running']
+        if "start-btn" in changed_id and not running:
+            start_capture()
             return "Packet capture started."
-        if "stop-btn" in changed_id and capture_thread:
-            # Stopping Scapy thread gracefully is non-trivial, user can Ctrl+C manually in fallback
-            capture_thread = None
-            return "Packet capture stopped. (May require manual Ctrl+C to fully halt sniffing)"
+        if "stop-btn" in changed_id and running:
+            # Stops the sniffer thread, scores the flows still open and drains the engine
+            status = stop_capture()
+            return (f"Packet capture stopped: {status['packets']} packets, {status['forwarded']} scored, "
+                    f"{status['sampled_out']} sampled out, {status.get('shed_packets', 0)} shed.")
         return ""
@@ -1,10 +1,6 @@
 import dash
 from dash import html, dcc
-import joblib
-from src.preprocessing import preprocess_features
-
-model = joblib.load('models/model.joblib')
-scaler = joblib.load('models/scaler.joblib')
+from src import model_registry
 
 def layout(feature_names):
     return html.Div([
@@ -29,9 +25,8 @@ def register_callbacks(app, feature_names):
         if n_clicks:
             try:
                 features = list(values)
-                processed = preprocess_features(features, scaler)
-                prediction = model.predict([processed])[0]
-                msg = "Intrusion Detected" if prediction == 1 else "Normal Traffic"
+                prediction = model_registry.get_prediction_cache().predict([features])[0]
+                msg = "Normal Traffic" if prediction == 'normal' else "Intrusion Detected"
                 return html.Div(f"Prediction: {msg}")
             except Exception as e:
                 return html.Div(f"Prediction error: {str(e)}")
@@ -0,0 +1,95 @@
+"""
+Streaming feature-drift sketch against the training StandardScaler statistics.
+
+Scored rows are already standardized with the training mean and scale, so under
+the training distribution every numeric column has mean 0 and standard deviation
+1. DriftMonitor keeps exponentially decayed count / sum / sum of squares per
+column (a few NumPy reductions per batch, no per-row Python), and reports each
+numeric feature's current mean shift in training standard deviations and its
+standard deviation ratio, plus the rate of categorical values the encoder has
+never seen (encoded as its unknown value). Decay is by rows, so the sketch
+describes roughly the last half_life * 2 rows whatever the traffic rate.
+"""
+import threading
+import numpy as np
+from src.preprocessing import feature_cols
+
+# A numeric feature is reported as drifted past either limit. Only growth of the
+# spread counts: heavy-tailed counters (src_bytes, hot, ...) routinely show a much
+# smaller spread than the training set over any recent window.
+MEAN_SHIFT_LIMIT = 1.0
+STD_RATIO_LIMIT = 2.0
+UNKNOWN_RATE_LIMIT = 0.05
+
+
+class DriftMonitor:
+    """Decayed moments of standardized model inputs; update() takes preprocessed (N, 41) arrays."""
+
+    def __init__(self, num_idx, cat_idx, unknown_value=-1, half_life=50000):
+        self.num_idx = np.asarray(num_idx, dtype=np.intp)
+        self.cat_idx = np.asarray(cat_idx, dtype=np.intp)
+        self.unknown_value = unknown_value
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self.reset()
+
+    @classmethod
+    def for_preprocessor(cls, preprocessor, half_life=50000):
+        unknown = preprocessor.unknown_value if preprocessor.unknown_value is not None else -1
+        return cls(preprocessor.num_idx, preprocessor.cat_idx, unknown, half_life)
+
+    def reset(self):
+        with self._lock:
+            self.rows = 0
+            self._weight = 0.0
+            self._sum = np.zeros(len(self.num_idx))
+            self._sumsq = np.zeros(len(self.num_idx))
+            self._unknown = np.zeros(len(self.cat_idx))
+
+    def update(self, X, weights=None):
+        """Add the rows of X; weights, if given, counts row i weights[i] times (e.g. repeated records)."""
+        X = np.asarray(X)
+        if X.ndim != 2 or not len(X):
+            return
+        numeric = X[:, self.num_idx].astype(np.float64, copy=False)
+        unknown = X[:, self.cat_idx] == self.unknown_value
+        if weights is None:
+            n = len(X)
+            sums = numeric.sum(axis=0)
+            sumsq = np.einsum('ij,ij->j', numeric, numeric)
+            unknown = unknown.sum(axis=0)
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+            n = float(weights.sum())
+            sums = weights @ numeric
+            sumsq = np.einsum('i,ij,ij->j', weights, numeric, numeric)
+            unknown = weights @ unknown
+        decay = 0.5 ** (n / self.half_life)
+        with self._lock:
+            self.rows += int(n)
+            self._weight = self._weight * decay + n
+            self._sum = self._sum * decay + sums
+            self._sumsq = self._sumsq * decay + sumsq
+            self._unknown = self._unknown * decay + unknown
+
+    def report(self):
+        """Per-feature mean shift, std ratio and unknown-category rate, and the features past the limits."""
+        with self._lock:
+            weight, sums, sumsq, unknown, rows = self._weight, self._sum, self._sumsq, self._unknown, self.rows
+        if not weight:
+            return {'rows': 0, 'mean_shift': {}, 'std_ratio': {}, 'unknown_rate': {}, 'drifted': []}
+        mean = sums / weight
+        std = np.sqrt(np.maximum(sumsq / weight - mean * mean, 0.0))
+        unknown_rate = unknown / weight
+        numeric_names = [feature_cols[i] for i in self.num_idx]
+        categorical_names = [feature_cols[i] for i in self.cat_idx]
+        drifted = [name for name, m, s in zip(numeric_names, mean, std)
+                   if abs(m) > MEAN_SHIFT_LIMIT or s > STD_RATIO_LIMIT]
+        drifted += [name for name, rate in zip(categorical_names, unknown_rate) if rate > UNKNOWN_RATE_LIMIT]
+        return {
+            'rows': rows,
+            'mean_shift': dict(zip(numeric_names, mean.tolist())),
+            'std_ratio': dict(zip(numeric_names, std.tolist())),
+            'unknown_rate': dict(zip(categorical_names, unknown_rate.tolist())),
+            'drifted': drifted,
+        }
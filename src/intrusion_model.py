@@ -5,16 +5,16 @@ import preprocessing  # Import your preprocessing module
 
 def train_intrusion_model():
     # Load preprocessed data
-    train_df, test_df = preprocessing.load_preprocess_data('../data/KDDTrain+.txt', '../data/KDDTest+.txt')
+    train_df, test_df, scaler, encoder = preprocessing.load_preprocess_data('../data/KDDTrain+.txt', '../data/KDDTest+.txt')
     
-    # Separate features and labels
-    X_train = train_df.drop('label', axis=1)
+    # Separate features and labels (difficulty is metadata, not a model input)
+    X_train = train_df.drop(['label', 'difficulty'], axis=1)
     y_train = train_df['label']
-    X_test = test_df.drop('label', axis=1)
+    X_test = test_df.drop(['label', 'difficulty'], axis=1)
     y_test = test_df['label']
     
-    # Train Random Forest Classifier
-    clf = RandomForestClassifier(n_estimators=100, random_state=42)
+    # Train Random Forest Classifier on all cores
+    clf = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
     clf.fit(X_train, y_train)
     
     # Predict on test set
@@ -0,0 +1,296 @@
+"""
+Process-wide runtime metrics in the Prometheus text format.
+
+Hot paths record into counters and histograms that are sharded per thread: each
+recording thread gets its own count array on first use, so an observation is a
+bisect plus two in-place additions with no lock taken. The shards are only summed
+when /metrics is scraped (a concurrent observation may land in the next scrape,
+never in none); a finished thread's shard is folded into a retired total.
+
+Values that already exist elsewhere (queue depth, cache hit rate, capture
+counters, model load times) are not copied on the hot path at all: collectors
+registered with register_collector() read them at scrape time.
+
+The pipeline stages are timed into one histogram, netid_stage_seconds{stage=...}:
+
+    capture     decoding one packet into header fields (sampled, see SAMPLE_EVERY)
+    extract     flow table update and connection features for one packet (sampled)
+    preprocess  encoding + scaling one batch of uncached rows
+    predict     one forest call on that batch
+
+    curl localhost:8050/metrics
+"""
+import threading
+import weakref
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds: 1 us .. 10 s
+DEFAULT_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-packet stages are timed on every SAMPLE_EVERY-th packet only: two clock reads
+# and an observation would otherwise be a sizeable fraction of a ~2 us decode
+SAMPLE_EVERY = 16
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+
+class _Shard:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class _Sharded:
+    """
+    Per-thread (counts, sum) shards; only shard creation, retirement and snapshots
+    lock. When a thread ends, its shard is folded into a retired total, so threads
+    that come and go (a web server's request threads) do not accumulate shards.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = _Shard(size)
+        # Reentrant: a thread's shard is retired while its thread-local data is torn down
+        self._lock = threading.RLock()
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = _Shard(self._size)
+            with self._lock:
+                self._shards[id(shard)] = shard
+            # Only the thread-local holds the token: it is freed, and the shard retired, when the thread ends
+            token = self._local.token = _Token()
+            weakref.finalize(token, self._retire, shard)
+            self._local.shard = shard
+            return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            retired = self._retired
+            for i, n in enumerate(shard.counts):
+                retired.counts[i] += n
+            retired.sum += shard.sum
+            del self._shards[id(shard)]
+
+    def snapshot(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            counts = list(self._retired.counts)
+            total = self._retired.sum
+        for shard in shards:
+            for i, n in enumerate(shard.counts):
+                counts[i] += n
+            total += shard.sum
+        return counts, total
+
+
+class _Token:
+    pass
+
+
+class _CounterChild:
+    def __init__(self):
+        self._sharded = _Sharded(0)
+
+    def inc(self, amount=1):
+        self._sharded.shard().sum += amount
+
+    def value(self):
+        return self._sharded.snapshot()[1]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._sharded = _Sharded(len(buckets) + 1)
+
+    def observe(self, value):
+        shard = self._sharded.shard()
+        # Index of the first bucket with value <= upper bound; len(buckets) is +Inf
+        shard.counts[bisect_left(self.buckets, value)] += 1
+        shard.sum += value
+
+    def observe_many(self, values):
+        shard = self._sharded.shard()
+        buckets = self.buckets
+        counts = shard.counts
+        for value in values:
+            counts[bisect_left(buckets, value)] += 1
+        shard.sum += sum(values)
+
+    def snapshot(self):
+        """(cumulative bucket counts including +Inf, sum of observations)."""
+        counts, total = self._sharded.snapshot()
+        cumulative = []
+        running = 0
+        for n in counts:
+            running += n
+            cumulative.append(running)
+        return cumulative, total
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        with _lock:
+            _metrics.append(self)
+
+    def labels(self, *values):
+        """The child for one combination of label values; keep a reference to it on hot paths."""
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _unlabelled(self):
+        return self._children[()]
+
+    def _labelled_children(self):
+        with self._children_lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, values)), child) for values, child in items]
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. rows scored."""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+    def collect(self):
+        samples = [('_total', labels, child.value()) for labels, child in self._labelled_children()]
+        return [(self.name, self.kind, self.help, samples)]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies in seconds, batch sizes) in fixed buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._unlabelled().observe(value)
+
+    def observe_many(self, values):
+        self._unlabelled().observe_many(values)
+
+    def collect(self):
+        samples = []
+        for labels, child in self._labelled_children():
+            cumulative, total = child.snapshot()
+            for upper, count in zip(self.buckets + (float('inf'),), cumulative):
+                samples.append(('_bucket', dict(labels, le=upper), count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative[-1]))
+        return [(self.name, self.kind, self.help, samples)]
+
+
+def register_collector(collect):
+    """
+    Add a scrape-time source of samples. collect() returns a list of
+    (name, kind, help, samples) families, samples being (labels dict, value)
+    pairs; kind is 'gauge' or 'counter' (counter names get the _total suffix).
+    """
+    with _lock:
+        _collectors.append(collect)
+    return collect
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels.items():
+        value = _format_value(value) if key == 'le' else str(value)
+        value = value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _families():
+    with _lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+    families = []
+    for metric in metrics:
+        families.extend(metric.collect())
+    for collect in collectors:
+        try:
+            for name, kind, help, samples in collect():
+                suffix = '_total' if kind == 'counter' else ''
+                families.append((name, kind, help, [(suffix, labels, value) for labels, value in samples]))
+        except Exception as e:
+            # One broken source must not take the whole endpoint down
+            print(f"Metrics collector error: {e}")
+    return families
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, kind, help, samples in _families():
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            if value is None:
+                continue
+            lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram('netid_stage_seconds',
+                          'Time spent per pipeline stage (per packet for capture/extract, per batch otherwise).',
+                          labelnames=('stage',))
+SCORING_LATENCY_SECONDS = Histogram('netid_scoring_latency_seconds',
+                                    'Time from a connection being queued for scoring to its prediction.')
+BATCH_ROWS = Histogram('netid_batch_rows', 'Rows per inference micro-batch.',
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+
+
+def stage(name):
+    """The netid_stage_seconds child for one stage (capture, extract, preprocess, predict)."""
+    return STAGE_SECONDS.labels(name)
@@ -0,0 +1,233 @@
+"""
+Versioned, pickle-free bundle of everything needed to score NSL-KDD records.
+
+A bundle is a directory holding
+
+    manifest.json    format version, column schema, encoder categories, class
+                     labels, for every array its file, dtype, shape and sha256,
+                     and the sha256 of the model.joblib the forest was compiled from
+    *.npy            raw arrays: scaler mean/scale and the CompiledForest node arrays
+                     (plus cascade_* for the cascade's first stage, when trained)
+
+Arrays are plain .npy files (64-byte aligned data after a short header), loaded
+with np.load(mmap_mode='r', allow_pickle=False): nothing is unpickled and the
+forest is mapped from the page cache instead of rebuilt from sklearn objects, so
+loading takes milliseconds and every process scoring from the same bundle shares
+the same physical pages. Encoder, scaler and model are written together and
+checked against the manifest once at load time, so mismatched artifacts cannot be
+combined by accident.
+
+    python -m src.model_bundle build      # models/*.joblib -> models/bundle
+    python -m src.model_bundle verify     # check checksums and schema, time the load
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+from src.compiled_forest import CompiledForest
+from src.preprocessing import CompiledPreprocessor, categorical_cols, feature_cols
+
+BUNDLE_PATH = 'models/bundle'
+BUNDLE_FORMAT = 'netid-bundle'
+BUNDLE_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+class Bundle:
+    """
+    A loaded bundle: the preprocessor, the compiled forest and the manifest they
+    came from, plus the cascade's first stage and threshold when it has them.
+    """
+
+    def __init__(self, manifest, preprocessor, model, first_stage=None, cascade_threshold=None):
+        self.manifest = manifest
+        self.preprocessor = preprocessor
+        self.model = model
+        self.first_stage = first_stage
+        self.cascade_threshold = cascade_threshold
+
+    @property
+    def classes(self):
+        return self.model.classes_
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_bundle(path, model, encoder, scaler, first_stage=None, threshold=None, model_path=None):
+    """
+    Write a bundle for a fitted RandomForestClassifier, OrdinalEncoder and StandardScaler,
+    optionally with the cascade's compiled first stage and its threshold (see cascade).
+    model_path is the joblib file the model was saved to; its checksum lets
+    scorers check that the sklearn model is the bundle's forest (see model_registry).
+    The bundle is assembled next to path and moved into place at the end, so a
+    reader never sees a half-written bundle.
+    """
+    forest = model if isinstance(model, CompiledForest) else CompiledForest.from_sklearn(model)
+    return save_compiled(path, forest, CompiledPreprocessor(encoder, scaler), first_stage, threshold,
+                         file_sha256(model_path) if model_path else None)
+
+
+def _forest_arrays(forest, prefix=''):
+    return {
+        # Index arrays are stored at native width so loading maps them without a copy
+        f'{prefix}feature': forest.feature.astype(np.intp),
+        f'{prefix}threshold': forest.threshold,
+        f'{prefix}children': forest.children.astype(np.intp),
+        f'{prefix}value': forest.value,
+        f'{prefix}roots': forest.roots.astype(np.intp),
+    }
+
+
+def _load_forest(arrays, classes, max_depth, n_features, prefix=''):
+    return CompiledForest(arrays[f'{prefix}feature'], arrays[f'{prefix}threshold'], arrays[f'{prefix}children'],
+                          arrays[f'{prefix}value'], arrays[f'{prefix}roots'], np.array(classes, dtype=object),
+                          max_depth, n_features)
+
+
+def save_compiled(path, forest, preprocessor, first_stage=None, threshold=None, model_sha256=None):
+    """
+    save_bundle() for an already compiled forest and preprocessor (e.g. the serving
+    ones). Pass model_sha256 only when forest is still exactly that model.joblib.
+    """
+    arrays = _forest_arrays(forest)
+    if first_stage is not None:
+        arrays.update(_forest_arrays(first_stage, 'cascade_'))
+    if preprocessor.mean is not None:
+        arrays['scaler_mean'] = preprocessor.mean
+    if preprocessor.scale is not None:
+        arrays['scaler_scale'] = preprocessor.scale
+
+    tmp_path = path.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    entries = {}
+    for name, array in arrays.items():
+        file_name = f"{name}.npy"
+        file_path = os.path.join(tmp_path, file_name)
+        np.save(file_path, np.ascontiguousarray(array), allow_pickle=False)
+        entries[name] = {
+            'file': file_name,
+            'dtype': np.dtype(array.dtype).str,
+            'shape': list(array.shape),
+            'sha256': file_sha256(file_path),
+        }
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'version': BUNDLE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'feature_cols': list(feature_cols),
+        'categorical_cols': list(categorical_cols),
+        'categories': [[str(c) for c in values] for values in preprocessor.categories],
+        'unknown_value': preprocessor.unknown_value,
+        'classes': [str(c) for c in forest.classes_],
+        'max_depth': forest.max_depth,
+        'n_features': forest.n_features_in_,
+        'arrays': entries,
+    }
+    if model_sha256 is not None:
+        manifest['model_sha256'] = model_sha256
+    if first_stage is not None:
+        # A null threshold keeps the first stage but serves the forest alone
+        manifest['cascade'] = {
+            'classes': [str(c) for c in first_stage.classes_],
+            'max_depth': first_stage.max_depth,
+            'threshold': threshold,
+        }
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    old_path = path.rstrip('/') + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"{path} is not a model bundle.")
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported bundle version {manifest.get('version')} (expected {BUNDLE_VERSION}).")
+    if manifest['feature_cols'] != list(feature_cols) or manifest['categorical_cols'] != list(categorical_cols):
+        raise ValueError("Bundle column schema does not match this code's feature columns.")
+    return manifest
+
+
+def load_bundle(path=BUNDLE_PATH, verify=True):
+    """
+    Map a bundle's arrays and build its preprocessor and compiled forest.
+    With verify, every array file is checked against its manifest checksum first.
+    Raises ValueError on a wrong format, version, schema, checksum, dtype or shape.
+    """
+    manifest = read_manifest(path)
+    arrays = {}
+    for name, entry in manifest['arrays'].items():
+        file_path = os.path.join(path, entry['file'])
+        if verify and file_sha256(file_path) != entry['sha256']:
+            raise ValueError(f"Checksum mismatch for {file_path}.")
+        array = np.load(file_path, mmap_mode='r', allow_pickle=False)
+        if array.dtype.str != entry['dtype'] or list(array.shape) != entry['shape']:
+            raise ValueError(f"{file_path} does not match the manifest dtype/shape.")
+        arrays[name] = array
+
+    preprocessor = CompiledPreprocessor.from_arrays(manifest['categories'], manifest['unknown_value'],
+                                                    arrays.get('scaler_mean'), arrays.get('scaler_scale'))
+    model = _load_forest(arrays, manifest['classes'], manifest['max_depth'], manifest['n_features'])
+    if len(manifest['classes']) != model.value.shape[1] or model.n_features_in_ != len(feature_cols):
+        raise ValueError("Bundle model does not match its manifest.")
+    first_stage, cascade = None, manifest.get('cascade')
+    if cascade is not None:
+        first_stage = _load_forest(arrays, cascade['classes'], cascade['max_depth'], manifest['n_features'],
+                                   'cascade_')
+        if len(cascade['classes']) != first_stage.value.shape[1]:
+            raise ValueError("Bundle cascade first stage does not match its manifest.")
+    return Bundle(manifest, preprocessor, model, first_stage, cascade['threshold'] if cascade else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify a model bundle.")
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--bundle', default=BUNDLE_PATH, help="bundle directory")
+    parser.add_argument('--model', default='models/model.joblib')
+    parser.add_argument('--encoder', default='models/encoder.joblib')
+    parser.add_argument('--scaler', default='models/scaler.joblib')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        import joblib
+        save_bundle(args.bundle, joblib.load(args.model), joblib.load(args.encoder), joblib.load(args.scaler),
+                    model_path=args.model)
+        print(f"Bundle written to {args.bundle}")
+
+    start = time.perf_counter()
+    bundle = load_bundle(args.bundle, verify=True)
+    verified = time.perf_counter() - start
+    start = time.perf_counter()
+    load_bundle(args.bundle, verify=False)
+    loaded = time.perf_counter() - start
+    size = sum(os.path.getsize(os.path.join(args.bundle, name)) for name in os.listdir(args.bundle))
+    print(f"Bundle v{bundle.manifest['version']} ({bundle.manifest['created']}): {bundle.model.n_trees} trees, "
+          f"{len(bundle.model.feature):,} nodes, {len(bundle.classes)} classes, {size / 2**20:.1f} MiB")
+    if bundle.first_stage is not None:
+        threshold = bundle.cascade_threshold
+        print(f"Cascade first stage: {bundle.first_stage.n_trees} trees, {len(bundle.first_stage.feature):,} nodes, "
+              f"threshold {'off' if threshold is None else f'{threshold:.4f}'}")
+    print(f"Load with checksums: {1000 * verified:.1f} ms, without: {1000 * loaded:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
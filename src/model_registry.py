@@ -0,0 +1,299 @@
+"""
+Process-wide registry for the trained artifacts.
+
+Every consumer (Dash app, live capture, manual input, offline scorers) asks the
+registry instead of calling joblib.load at import time, so each artifact is
+loaded at most once per process and only when first needed: importing the app
+no longer blocks on the forest before the server binds.
+
+When a model bundle exists (models/bundle, see model_bundle) the preprocessor and
+the compiled forest come from it: it loads in milliseconds without unpickling and
+is verified against its manifest once, on first use. When the bundle carries a
+calibrated cascade first stage, the serving model is the cascade over the
+compiled forest (see cascade). The bulk and offline scorers run the same
+cascade, but escalate to the sklearn model for its faster large batches when the
+bundle records model.joblib's checksum as the source of its forest; otherwise
+they escalate to the bundle's forest too, so every scorer predicts the same.
+
+Artifacts are opened with joblib.load(mmap_mode='r'), so the NumPy arrays joblib
+stored in them are mapped from the page cache rather than copied. sklearn's trees
+copy their node arrays into private buffers on unpickling, so for multi-worker
+servers call preload() in the parent before forking (e.g. gunicorn --preload):
+the workers then share the loaded forest copy-on-write.
+
+    python -m src.model_registry      # load everything and print load time / resident size
+"""
+import os
+import threading
+import time
+import joblib
+from src import metrics
+
+MODEL_PATH = 'models/model.joblib'
+ENCODER_PATH = 'models/encoder.joblib'
+SCALER_PATH = 'models/scaler.joblib'
+BUNDLE_PATH = 'models/bundle'
+
+_lock = threading.RLock()
+_cache = {}
+_load_stats = {}
+_swaps = 0
+
+
+def resident_bytes():
+    """Current resident set size of this process, or None where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current RSS; KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def _get(name, loader):
+    # Fast path without the lock once loaded
+    value = _cache.get(name)
+    if value is not None:
+        return value
+    with _lock:
+        value = _cache.get(name)
+        if value is None:
+            rss_before = resident_bytes()
+            start = time.perf_counter()
+            value = loader()
+            elapsed = time.perf_counter() - start
+            rss_after = resident_bytes()
+            _load_stats[name] = {
+                'load_seconds': elapsed,
+                'resident_delta_bytes': rss_after - rss_before if rss_before is not None else None,
+            }
+            _cache[name] = value
+        return value
+
+
+def get_model():
+    return _get('model', lambda: joblib.load(MODEL_PATH, mmap_mode='r'))
+
+
+def get_encoder():
+    return _get('encoder', lambda: joblib.load(ENCODER_PATH, mmap_mode='r'))
+
+
+def get_scaler():
+    return _get('scaler', lambda: joblib.load(SCALER_PATH, mmap_mode='r'))
+
+
+def _load_bundle():
+    from src.model_bundle import MANIFEST, load_bundle
+    if not os.path.exists(os.path.join(BUNDLE_PATH, MANIFEST)):
+        return False  # cached as "no bundle", so the check runs once
+    return load_bundle(BUNDLE_PATH, verify=True)
+
+
+def get_bundle():
+    """The verified model bundle, or None when only the joblib artifacts exist."""
+    return _get('bundle', _load_bundle) or None
+
+
+def get_preprocessor():
+    def load():
+        bundle = get_bundle()
+        if bundle is not None:
+            return bundle.preprocessor
+        from src.preprocessing import CompiledPreprocessor
+        return CompiledPreprocessor(get_encoder(), get_scaler())
+    return _get('preprocessor', load)
+
+
+def get_compiled_model():
+    """Flat-array forest for single rows and micro-batches (see compiled_forest)."""
+    def load():
+        bundle = get_bundle()
+        if bundle is not None:
+            return bundle.model
+        from src.compiled_forest import CompiledForest
+        return CompiledForest.from_sklearn(get_model())
+    return _get('compiled_model', load)
+
+
+def get_cascade():
+    """The bundle's calibrated cascade over the compiled forest, or None when it has none."""
+    def load():
+        bundle = get_bundle()
+        if bundle is None or bundle.first_stage is None or bundle.cascade_threshold is None:
+            return False  # cached as "no cascade"
+        from src.cascade import CascadeModel
+        return CascadeModel(bundle.first_stage, get_compiled_model(), bundle.cascade_threshold)
+    return _get('cascade', load) or None
+
+
+def get_batch_model():
+    """
+    What the bulk and offline scorers predict with: the serving model (see
+    get_serving_model), with the sklearn model in place of the compiled forest
+    when it is the bundle's forest (checked by sha256). Without a bundle, the
+    sklearn model.
+    """
+    def load():
+        from src.model_bundle import file_sha256
+        bundle = get_bundle()
+        if bundle is None:
+            return get_model()
+        expected = bundle.manifest.get('model_sha256')
+        if expected is None or not os.path.exists(MODEL_PATH) or file_sha256(MODEL_PATH) != expected:
+            print(f"{MODEL_PATH} is not the model the bundle was built from; scoring batches with the bundle's forest")
+            return get_serving_model()
+        cascade = get_cascade()
+        if cascade is None:
+            return get_model()
+        from src.cascade import CascadeModel
+        return CascadeModel(cascade.first_stage, get_model(), cascade.threshold)
+    return _get('batch_model', load)
+
+
+def get_serving_model():
+    """What live, batch and manual scoring predict with: the cascade if calibrated, else the compiled forest."""
+    return get_cascade() or get_compiled_model()
+
+
+def get_explainer():
+    """Per-node path contributions of the compiled forest, for alert explanations (see explain)."""
+    from src.explain import ContributionExplainer
+    return _get('explainer', lambda: ContributionExplainer(get_compiled_model()))
+
+
+def get_drift_monitor():
+    """Sketch of the scored feature distribution against the scaler statistics (see drift)."""
+    from src.drift import DriftMonitor
+    return _get('drift_monitor', lambda: DriftMonitor.for_preprocessor(get_preprocessor()))
+
+
+def get_prediction_cache():
+    """Process-wide LRU of raw record -> prediction in front of the compiled forest (see prediction_cache)."""
+    from src.prediction_cache import PredictionCache
+    return _get('prediction_cache', lambda: PredictionCache(get_serving_model(), get_preprocessor().transform,
+                                                            monitor=get_drift_monitor()))
+
+
+def swap_compiled_model(model, explainer=None):
+    """
+    Atomically replace the serving forest (e.g. after online learning). Callers
+    already holding the old one finish with it; the cascade escalates to the new
+    one, and the prediction cache switches and drops its entries. Nothing is
+    reloaded, so scoring never pauses. Pass the new forest's explainer, built
+    beforehand, to install it with the forest; otherwise it is rebuilt on next use.
+    """
+    global _swaps
+    with _lock:
+        _cache['compiled_model'] = model
+        if explainer is not None:
+            _cache['explainer'] = explainer
+        else:
+            _cache.pop('explainer', None)
+        cascade = _cache.get('cascade')
+        if cascade:
+            cascade.model = model
+        batch_model = _cache.get('batch_model')
+        if batch_model is not None:
+            # model.joblib no longer matches what is served
+            from src.cascade import CascadeModel
+            if isinstance(batch_model, CascadeModel):
+                batch_model.model = model
+            else:
+                _cache['batch_model'] = model
+        cache = _cache.get('prediction_cache')
+        if cache is not None:
+            cache.swap_model(cascade or model)
+        _swaps += 1
+
+
+def collect_metrics():
+    """Scrape-time model and prediction-cache metrics (see src.metrics); never loads anything."""
+    with _lock:
+        load_stats = {name: s['load_seconds'] for name, s in _load_stats.items()}
+        cache = _cache.get('prediction_cache')
+        monitor = _cache.get('drift_monitor')
+        cascade = _cache.get('cascade')
+    families = [
+        ('netid_model_load_seconds', 'gauge', 'Time taken to load each model artifact.',
+         [({'artifact': name}, seconds) for name, seconds in load_stats.items()]),
+        ('netid_resident_memory_bytes', 'gauge', 'Resident set size of this process.', [({}, resident_bytes())]),
+        ('netid_model_swaps', 'counter', 'Serving model replacements without a reload.', [({}, _swaps)]),
+    ]
+    if cache is not None:
+        s = cache.stats()
+        families += [
+            ('netid_prediction_cache_lookups', 'counter', 'Prediction cache lookups by result.',
+             [({'result': result}, s[result]) for result in ('hits', 'misses', 'deduplicated')]),
+            ('netid_prediction_cache_evictions', 'counter', 'Prediction cache evictions.', [({}, s['evictions'])]),
+            ('netid_prediction_cache_hit_ratio', 'gauge', 'Share of lookups answered without scoring.',
+             [({}, s['hit_rate'])]),
+            ('netid_prediction_cache_entries', 'gauge', 'Entries in the prediction cache.', [({}, s['size'])]),
+        ]
+    if cascade:
+        s = cascade.stats()
+        families += [
+            ('netid_cascade_rows', 'counter', 'Rows scored by the cascade, by the stage that answered.',
+             [({'stage': 'first'}, s['rows'] - s['escalated']), ({'stage': 'forest'}, s['escalated'])]),
+            ('netid_cascade_threshold', 'gauge', 'First-stage probability of normal needed to clear a row.',
+             [({}, s['threshold'])]),
+        ]
+    if monitor is not None:
+        report = monitor.report()
+        families += [
+            ('netid_drift_rows', 'counter', 'Rows seen by the drift monitor.', [({}, report['rows'])]),
+            ('netid_drift_mean_shift', 'gauge', 'Recent feature mean, in training standard deviations from the training mean.',
+             [({'feature': name}, value) for name, value in report['mean_shift'].items()]),
+            ('netid_drift_std_ratio', 'gauge', 'Recent feature standard deviation over the training one.',
+             [({'feature': name}, value) for name, value in report['std_ratio'].items()]),
+            ('netid_drift_unknown_category_rate', 'gauge', 'Recent share of categorical values unseen in training.',
+             [({'feature': name}, value) for name, value in report['unknown_rate'].items()]),
+        ]
+    return families
+
+
+metrics.register_collector(collect_metrics)
+
+
+def preload(batch_model=True):
+    """Load everything now, e.g. in a server parent process before it forks workers."""
+    if batch_model:
+        get_batch_model()
+    get_preprocessor()
+    get_serving_model()
+    get_explainer()
+
+
+def clear():
+    """Forget all loaded artifacts (the next get_* call reloads from disk)."""
+    with _lock:
+        _cache.clear()
+        _load_stats.clear()
+
+
+def stats():
+    """Per-artifact load time and resident-size growth, plus the current resident size."""
+    with _lock:
+        return {
+            'artifacts': {name: dict(s) for name, s in _load_stats.items()},
+            'resident_bytes': resident_bytes(),
+        }
+
+
+if __name__ == '__main__':
+    start_rss = resident_bytes()
+    preload()
+    report = stats()
+    for name, s in report['artifacts'].items():
+        delta = s['resident_delta_bytes']
+        delta_text = f"{delta / 2**20:8.1f} MiB" if delta is not None else "       n/a"
+        print(f"{name:<16}{1000 * s['load_seconds']:9.1f} ms {delta_text}")
+    if report['resident_bytes'] is not None:
+        print(f"Resident size: {report['resident_bytes'] / 2**20:.1f} MiB "
+              f"(process baseline {start_rss / 2**20:.1f} MiB)")
@@ -0,0 +1,228 @@
+"""
+Sweep forest size, depth limit, pruning and feature subsets for the
+accuracy / latency / memory trade-off, and deploy the chosen point.
+
+For every combination of depth limit, pruning (min_samples_leaf, ccp_alpha) and
+feature subset one forest of the largest size is fitted; smaller sizes are its
+first trees (the seed is fixed, so they are exactly the smaller forests).
+Feature subsets are the top-k features by importance in the first unrestricted
+forest. Candidates are fitted on the training file minus a held-out validation
+share and measured on that share; the test file is only used by export, to
+report the accuracy of the point that is deployed (it is retrained on the whole
+training file), so selecting a point never looks at the test set:
+
+    accuracy        share of validation records classified correctly
+    row_us          p50 single-row latency of the compiled forest (manual input)
+    batch_rows_s    compiled forest throughput in batches of 256 (live capture)
+    joblib_bytes    size of model.joblib
+    resident_bytes  memory of the serving forest (compiled node arrays)
+
+A candidate is on the Pareto frontier when no other one is at least as accurate,
+as fast per row and as small in memory, and strictly better in one of them.
+The default ccp_alpha values span no pruning, light pruning (~15% fewer nodes)
+and heavy pruning (~80% fewer nodes) on NSL-KDD.
+
+    python -m src.model_sweep run -o models/sweep.json
+    python -m src.model_sweep report models/sweep.json --all
+    python -m src.model_sweep export models/sweep.json 7      # retrain point 7 as the deployed model
+"""
+import argparse
+import copy
+import json
+import os
+import tempfile
+import time
+import joblib
+import numpy as np
+from sklearn.model_selection import train_test_split
+from src.benchmark import percentiles, timed
+from src.compiled_forest import CompiledForest
+from src.preprocessing import feature_cols
+from src.train import CACHE_DIR, encode, fit_preprocessing, load_dataset, make_forest, mask_features, train
+
+TREES = (10, 25, 50, 100)
+DEPTHS = (None, 20, 12, 8)
+MIN_SAMPLES_LEAF = (1, 5)
+CCP_ALPHAS = (0.0, 1e-4, 1e-3)
+FEATURE_COUNTS = (41, 20, 10)
+BATCH_ROWS = 256
+LATENCY_ROWS = 500
+# Share of the training file held out to measure candidates on
+VALIDATION_SHARE = 0.2
+
+
+def forest_prefix(model, n_trees):
+    """The forest made of model's first n_trees trees, without refitting."""
+    prefix = copy.copy(model)
+    prefix.estimators_ = model.estimators_[:n_trees]
+    prefix.n_estimators = n_trees
+    return prefix
+
+
+def forest_nbytes(forest):
+    """Bytes held by a CompiledForest's arrays (views shared between attributes counted once)."""
+    arrays = {id(a): a for a in vars(forest).values() if isinstance(a, np.ndarray)}
+    return sum(a.nbytes for a in arrays.values())
+
+
+def joblib_nbytes(model):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.joblib')
+        joblib.dump(model, path)
+        return os.path.getsize(path)
+
+
+def measure(model, X_val, y_val):
+    compiled = CompiledForest.from_sklearn(model)
+    X32 = np.ascontiguousarray(X_val, dtype=np.float32)
+    rows = X32[:LATENCY_ROWS]
+    single = percentiles(timed(compiled.predict, [(rows[i:i + 1],) for i in range(len(rows))]))
+    batched = percentiles(timed(compiled.predict, [(X32[i:i + BATCH_ROWS],) for i in range(0, len(X32), BATCH_ROWS)]),
+                          BATCH_ROWS)
+    return {
+        'accuracy': float(np.mean(compiled.predict(X32) == y_val)),
+        'row_us': single['p50_us'],
+        'batch_rows_s': batched['items_per_s'],
+        'joblib_bytes': joblib_nbytes(model),
+        'resident_bytes': forest_nbytes(compiled),
+        'nodes': len(compiled.feature),
+        'max_depth': compiled.max_depth,
+    }
+
+
+def pareto_frontier(points):
+    """Indexes of the points no other point dominates on (accuracy up, row_us down, resident_bytes down)."""
+    def dominates(a, b):
+        no_worse = (a['accuracy'] >= b['accuracy'] and a['row_us'] <= b['row_us']
+                    and a['resident_bytes'] <= b['resident_bytes'])
+        better = (a['accuracy'] > b['accuracy'] or a['row_us'] < b['row_us']
+                  or a['resident_bytes'] < b['resident_bytes'])
+        return no_worse and better
+    return [i for i, p in enumerate(points) if not any(dominates(q, p) for q in points)]
+
+
+def sweep(train_path, trees=TREES, depths=DEPTHS, min_samples_leaf=MIN_SAMPLES_LEAF, ccp_alphas=CCP_ALPHAS,
+          feature_counts=FEATURE_COUNTS, n_jobs=-1, cache_dir=CACHE_DIR, validation_share=VALIDATION_SHARE):
+    """Fit and measure every candidate on a validation split of train_path; returns the sweep document (see main)."""
+    train_data = load_dataset(train_path, cache_dir)
+    encoder, scaler = fit_preprocessing(train_data)
+    # Not stratified: some NSL-KDD classes have a single record
+    X_train, X_val, y_train, y_val = train_test_split(encode(train_data, encoder, scaler),
+                                                      np.asarray(train_data['label']),
+                                                      test_size=validation_share, random_state=0)
+
+    ranking = None
+    points = []
+    # All features first: the first forest's importances rank the features for the subsets
+    for count in sorted(set(feature_counts), reverse=True):
+        for depth in depths:
+            for leaf in min_samples_leaf:
+                for alpha in ccp_alphas:
+                    if ranking is None and count < len(feature_cols):
+                        reference = make_forest(max(trees), n_jobs=n_jobs).fit(X_train, y_train)
+                        ranking = [feature_cols[i] for i in np.argsort(-reference.feature_importances_, kind='stable')]
+                    features = ranking[:count] if count < len(feature_cols) else None
+                    start = time.perf_counter()
+                    model = make_forest(max(trees), depth, leaf, alpha, n_jobs).fit(mask_features(X_train, features),
+                                                                                   y_train)
+                    fit_seconds = time.perf_counter() - start
+                    if ranking is None:
+                        ranking = [feature_cols[i] for i in np.argsort(-model.feature_importances_, kind='stable')]
+                    for n in sorted(trees):
+                        params = {'n_estimators': n, 'max_depth': depth, 'min_samples_leaf': leaf,
+                                  'ccp_alpha': alpha, 'features': features}
+                        point = {'id': len(points), 'params': params, **measure(forest_prefix(model, n), X_val, y_val)}
+                        points.append(point)
+                        print(f"{describe(point)}  (forest fitted in {fit_seconds:.1f}s)")
+
+    for i in pareto_frontier(points):
+        points[i]['frontier'] = True
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'train': train_path,
+        'validation_share': validation_share,
+        'feature_ranking': ranking,
+        'points': points,
+    }
+
+
+def describe(point):
+    p = point['params']
+    features = len(p['features']) if p['features'] else len(feature_cols)
+    return (f"{point['id']:>4}{'*' if point.get('frontier') else ' '} {p['n_estimators']:>5} "
+            f"{p['max_depth'] if p['max_depth'] is not None else '-':>5} {p['min_samples_leaf']:>4} "
+            f"{p['ccp_alpha']:>7g} {features:>4}  {point['accuracy']:.4f} {point['row_us']:>8.1f} "
+            f"{point['batch_rows_s']:>10,.0f} {point['joblib_bytes'] / 2**20:>8.2f} {point['resident_bytes'] / 2**20:>8.2f}")
+
+
+def report(doc, show_all=False):
+    header = (f"{'id':>5} {'trees':>5} {'depth':>5} {'leaf':>4} {'alpha':>7} {'feat':>4}  {'valacc':>6} "
+              f"{'row_us':>8} {'rows/s':>10} {'joblib':>8} {'res_MiB':>8}")
+    points = doc['points'] if show_all else [p for p in doc['points'] if p.get('frontier')]
+    print(f"{'All candidates' if show_all else 'Pareto frontier'} ({len(points)} of {len(doc['points'])}, "
+          f"* = on the frontier; train {doc['train']}, {doc['validation_share']:.0%} held out for accuracy; "
+          f"sizes in MiB)")
+    print(header)
+    for point in sorted(points, key=lambda p: p['row_us']):
+        print(describe(point))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep forest configurations for accuracy vs latency vs memory.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="fit and measure every candidate")
+    run.add_argument('-o', '--output', default='models/sweep.json')
+    run.add_argument('--train', default='data/KDDTrain+.txt')
+    run.add_argument('--validation-share', type=float, default=VALIDATION_SHARE,
+                     help="share of the training file candidates are measured on")
+    run.add_argument('--trees', type=int, nargs='+', default=list(TREES))
+    run.add_argument('--depths', nargs='+', default=['none' if d is None else str(d) for d in DEPTHS],
+                     help="depth limits ('none' for unlimited)")
+    run.add_argument('--min-samples-leaf', type=int, nargs='+', default=list(MIN_SAMPLES_LEAF))
+    run.add_argument('--ccp-alpha', type=float, nargs='+', default=list(CCP_ALPHAS))
+    run.add_argument('--features', type=int, nargs='+', default=list(FEATURE_COUNTS),
+                     help="feature subset sizes (top-k by importance)")
+    run.add_argument('--jobs', type=int, default=-1)
+    show = sub.add_parser('report', help="print the frontier of a sweep")
+    show.add_argument('sweep')
+    show.add_argument('--all', action='store_true', help="every candidate, not only the frontier")
+    export = sub.add_parser('export', help="retrain a sweep point as the deployed model (models/ and the bundle)")
+    export.add_argument('sweep')
+    export.add_argument('id', type=int)
+    export.add_argument('--train', default=None, help="training file (default: the sweep's)")
+    export.add_argument('--test', default='data/KDDTest+.txt', help="test file the deployed model is reported on")
+    export.add_argument('--jobs', type=int, default=-1)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        depths = [None if d.lower() == 'none' else int(d) for d in args.depths]
+        doc = sweep(args.train, args.trees, depths, args.min_samples_leaf, args.ccp_alpha,
+                    [min(k, len(feature_cols)) for k in args.features], args.jobs,
+                    validation_share=args.validation_share)
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2)
+        print(f"Sweep written to {args.output}")
+        report(doc)
+        return
+
+    with open(args.sweep) as f:
+        doc = json.load(f)
+    if args.command == 'report':
+        report(doc, args.all)
+        return
+
+    points = {p['id']: p for p in doc['points']}
+    if args.id not in points:
+        parser.error(f"no point {args.id} in {args.sweep}")
+    point = points[args.id]
+    model, accuracy, cascade, timer = train(args.train or doc['train'], args.test, n_jobs=args.jobs,
+                                            **point['params'])
+    print(f"Deployed point {args.id}: {point['params']}")
+    print(f"Test accuracy: {accuracy:.4f} (validation accuracy in the sweep: {point['accuracy']:.4f})")
+    if cascade is not None:
+        print(f"Cascade threshold {cascade['threshold']:.4f}, {cascade['escalated_fraction']:.2%} escalated")
+    timer.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Online learning: fold newly labelled records into the serving model without a
+full retrain or a restart.
+
+Labelled records are preprocessed with the serving encoder and scaler as they
+arrive and buffered. Every `interval` seconds, once at least min_records are
+buffered, a few new trees are fitted on the buffer and appended to the serving
+forest (CompiledForest.concat). Like `python -m src.train --warm-start`, the
+new trees see exactly the encoding the old ones were trained on. Unlike it, the
+new data does not have to contain every class: labels the base forest does not
+know are added as new classes. Online trees beyond max_online_trees are
+dropped oldest first; the base forest is never touched. Together the online
+trees carry at most max_online_share of the vote, whatever their number, so
+feedback can shift the model but never outvote the base forest.
+
+The new forest is swapped into the registry atomically
+(model_registry.swap_compiled_model): batches in flight finish on the old
+forest, the next ones use the new one, and nothing is reloaded from disk. Each
+update first scores the buffer with the current forest, so the stats report
+how well the model did on the new traffic before it learned from it.
+
+    POST /api/feedback     labelled records: NSL-KDD CSV lines (41 features, label[, difficulty])
+                           or JSON / NDJSON {"record": [...] or {...}, "label": "..."}
+    GET  /api/drift        drift report (see drift) and online learning stats
+
+Feedback retrains the detector, so a client that can post it can teach the
+model to clear its own traffic. The endpoint is off unless the server is started
+with NETID_FEEDBACK=1 and a NETID_FEEDBACK_TOKEN, which requests must send as
+"Authorization: Bearer <token>".
+
+    python -m src.online_learning data/new_labelled.txt --test data/KDDTest+.txt --save models/bundle
+"""
+import argparse
+import hmac
+import json
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from src import batch_api, model_registry
+from src.compiled_forest import CompiledForest
+from src.explain import ContributionExplainer
+from src.model_bundle import save_compiled
+from src.preprocessing import categorical_cols, feature_cols
+
+FEEDBACK_ENV = 'NETID_FEEDBACK'
+TOKEN_ENV = 'NETID_FEEDBACK_TOKEN'
+MIN_RECORDS = 5000
+MAX_ONLINE_SHARE = 0.25
+
+
+def online_weight(n_base, n_online, max_share=MAX_ONLINE_SHARE):
+    """Vote of each online tree (base trees vote 1) so that all of them carry at most max_share."""
+    if not n_online:
+        return 1.0
+    return min(1.0, max_share * n_base / ((1 - max_share) * n_online))
+
+
+class OnlineLearner:
+    """Buffers labelled records and periodically appends trees fitted on them to the serving forest."""
+
+    def __init__(self, trees_per_update=10, max_online_trees=100, min_records=MIN_RECORDS, max_buffer=50000,
+                 interval=300.0, n_jobs=2, save_path=None, max_online_share=MAX_ONLINE_SHARE):
+        self.trees_per_update = trees_per_update
+        self.min_records = min_records
+        self.max_online_share = max_online_share
+        self.max_buffer = max_buffer
+        self.interval = interval
+        self.n_jobs = n_jobs
+        self.save_path = save_path
+        self.base = None
+        self.parts = deque(maxlen=max(1, max_online_trees // trees_per_update))
+        self._buffer = deque()
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.received = 0
+        self.discarded = 0
+        self.updates = 0
+        self.last_update = None
+
+    def add(self, numeric, categoricals, labels):
+        """Buffer validated records (numeric array, categorical columns, labels), as batch_api.validate returns them."""
+        if not len(labels):
+            return 0
+        X = model_registry.get_preprocessor().transform_columns(numeric, categoricals)
+        y = np.asarray(labels, dtype=object)
+        with self._lock:
+            self._buffer.append((X, y))
+            self._buffered += len(y)
+            self.received += len(y)
+            # Bounded memory: the oldest batches go first
+            while self._buffered - len(self._buffer[0][1]) >= self.max_buffer:
+                dropped = self._buffer.popleft()
+                self._buffered -= len(dropped[1])
+                self.discarded += len(dropped[1])
+        return len(y)
+
+    def _take_buffer(self):
+        with self._lock:
+            if self._buffered < self.min_records:
+                return None
+            batches = list(self._buffer)
+            self._buffer.clear()
+            self._buffered = 0
+        return np.concatenate([X for X, _ in batches]), np.concatenate([y for _, y in batches])
+
+    def update(self):
+        """Fit and swap in new trees if enough records are buffered. Returns this update's stats, or None."""
+        with self._update_lock:
+            taken = self._take_buffer()
+            if taken is None:
+                return None
+            X, y = taken
+            start = time.perf_counter()
+            current = model_registry.get_compiled_model()
+            if self.base is None:
+                self.base = current
+            # Test-then-train: how the serving model did on this traffic before learning from it
+            accuracy_before = float(np.mean(current.predict(X) == y))
+            trees = RandomForestClassifier(n_estimators=self.trees_per_update, n_jobs=self.n_jobs,
+                                           random_state=self.updates).fit(X, y)
+            self.parts.append(CompiledForest.from_sklearn(trees))
+            weight = online_weight(self.base.n_trees, sum(part.n_trees for part in self.parts), self.max_online_share)
+            model = CompiledForest.concat([self.base, *self.parts], [1.0] + [weight] * len(self.parts))
+            # Built here, off the inference worker, so the first alert after the swap does not pay for it
+            model_registry.swap_compiled_model(model, ContributionExplainer(model))
+            if self.save_path:
+                cascade = model_registry.get_cascade()
+                save_compiled(self.save_path, model, model_registry.get_preprocessor(),
+                              cascade.first_stage if cascade else None, cascade.threshold if cascade else None)
+            self.updates += 1
+            self.last_update = {
+                'time': time.time(),
+                'records': len(y),
+                'labels': sorted(str(label) for label in np.unique(y)),
+                'accuracy_before': accuracy_before,
+                'trees': model.n_trees,
+                'online_trees': model.n_trees - self.base.n_trees,
+                'online_tree_weight': weight,
+                'seconds': time.perf_counter() - start,
+            }
+            print(f"Online update: {self.last_update}")
+            return self.last_update
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="online-learning", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.update()
+            except Exception as e:
+                # Keep serving with the current model; the buffer of this update is lost
+                print(f"Online learning update failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'received': self.received,
+                'buffered': self._buffered,
+                'discarded': self.discarded,
+                'updates': self.updates,
+                'last_update': self.last_update,
+            }
+
+
+_learner = None
+_learner_lock = threading.Lock()
+
+
+def get_learner():
+    """The process-wide learner, started (its update thread) on first use."""
+    global _learner
+    with _learner_lock:
+        if _learner is None:
+            _learner = OnlineLearner()
+            _learner.start()
+        return _learner
+
+
+def parse_feedback(body, fmt):
+    """(records, labels) from a feedback body; CSV lines carry the label after the 41 features."""
+    records, labels = [], []
+    for item in batch_api.parse_records(body, fmt, drop_labels=False):
+        if fmt == 'csv':
+            record, label = item[:len(feature_cols)], item[len(feature_cols)] if len(item) > len(feature_cols) else None
+        elif isinstance(item, dict):
+            record, label = item.get('record'), item.get('label')
+        else:
+            record, label = None, None
+        records.append(record)
+        labels.append(label.strip() if isinstance(label, str) and label.strip() else None)
+    return records, labels
+
+
+def feedback_token():
+    """The token /api/feedback requires, or None when feedback is disabled (the default)."""
+    if os.environ.get(FEEDBACK_ENV) != '1':
+        return None
+    token = os.environ.get(TOKEN_ENV, '').strip()
+    if not token:
+        print(f"{FEEDBACK_ENV}=1 without {TOKEN_ENV}: feedback stays disabled")
+        return None
+    return token
+
+
+def register_routes(server):
+    """Add the feedback and drift endpoints to a Flask server (app.server)."""
+    import flask
+
+    token = feedback_token()
+
+    def json_response(payload, status=200):
+        return flask.Response(json.dumps(payload), status=status, mimetype='application/json')
+
+    @server.route('/api/feedback', methods=['POST'])
+    def feedback():
+        request = flask.request
+        if token is None:
+            return json_response({'error': "feedback is disabled on this server"}, 404)
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(given.strip().encode(), token.encode()):
+            return json_response({'error': "missing or invalid feedback token"}, 401)
+        fmt = batch_api.FORMATS.get(request.mimetype)
+        if fmt is None:
+            return json_response({'error': f"unsupported Content-Type {request.mimetype!r}"}, 415)
+        body = request.stream.read(batch_api.MAX_BODY_BYTES + 1)
+        if len(body) > batch_api.MAX_BODY_BYTES:
+            return json_response({'error': f"body larger than {batch_api.MAX_BODY_BYTES} bytes"}, 413)
+        try:
+            records, labels = parse_feedback(body, fmt)
+        except (UnicodeDecodeError, ValueError, batch_api.BatchError) as e:
+            return json_response({'error': f"could not parse {fmt} body: {e}"}, 400)
+        if len(records) > batch_api.MAX_RECORDS:
+            return json_response({'error': f"more than {batch_api.MAX_RECORDS} records"}, 413)
+        rows, numeric, categoricals, errors = batch_api.validate(records)
+        errors = dict(errors)
+        kept = [i for i, row in enumerate(rows) if labels[row] is not None]
+        for row in rows:
+            if labels[row] is None:
+                errors[row] = "missing label"
+        accepted = get_learner().add(numeric[kept], [[col[i] for i in kept] for col in categoricals],
+                                     [labels[rows[i]] for i in kept])
+        return json_response({'accepted': accepted,
+                              'errors': [{'row': row, 'error': error} for row, error in sorted(errors.items())]})
+
+    @server.route('/api/drift')
+    def drift():
+        report = model_registry.get_drift_monitor().report()
+        report['online_learning'] = _learner.stats() if _learner is not None else None
+        return json_response(report)
+
+
+def main():
+    from src.train import load_dataset
+    parser = argparse.ArgumentParser(description="Fold labelled records into the model as online learning would.")
+    parser.add_argument('path', help="labelled NSL-KDD file (41 features, label[, difficulty])")
+    parser.add_argument('--test', default=None, help="NSL-KDD file to evaluate on before and after")
+    parser.add_argument('--trees', type=int, default=10, help="trees added per update")
+    parser.add_argument('--batch', type=int, default=5000, help="records per update")
+    parser.add_argument('--save', default=None, metavar='BUNDLE', help="write the result as a model bundle")
+    args = parser.parse_args()
+
+    preprocessor = model_registry.get_preprocessor()
+
+    def encoded(path):
+        data = load_dataset(path)
+        return data, preprocessor.transform_columns(data['numeric'], [data[col] for col in categorical_cols])
+
+    test = encoded(args.test) if args.test else None
+
+    def evaluate(label):
+        if test is not None:
+            data, X = test
+            accuracy = np.mean(model_registry.get_compiled_model().predict(X) == np.asarray(data['label']))
+            print(f"{label} test accuracy: {accuracy:.4f}")
+
+    evaluate("Before")
+    learner = OnlineLearner(trees_per_update=args.trees, min_records=1, save_path=args.save)
+    data = load_dataset(args.path)
+    labels = np.asarray(data['label'])
+    for start in range(0, len(labels), args.batch):
+        end = start + args.batch
+        learner.add(data['numeric'][start:end], [data[col][start:end] for col in categorical_cols],
+                    labels[start:end])
+        learner.update()
+    evaluate("After")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Prediction caching and batch deduplication.
+
+Live traffic repeats itself: scans and retries produce connection summaries with
+exactly the same 41 raw values, and every one of them used to pay the full
+preprocess + forest cost. PredictionCache remembers the prediction for each raw
+(pre-scaling) feature tuple in a bounded LRU, and within a batch only the unique
+uncached rows are preprocessed and sent to model.predict; results are scattered
+back to every position that asked.
+
+predict_unique() is the cache-free variant for bulk scorers working on numeric
+arrays, where rows rarely repeat across chunks but often within one.
+"""
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from src import metrics
+
+_MISSING = object()
+_preprocess_timer = metrics.stage('preprocess')
+_predict_timer = metrics.stage('predict')
+
+
+class PredictionCache:
+    """
+    Bounded LRU of raw feature tuple -> prediction in front of a model.
+
+    model is anything with predict(X); preprocess, if given, turns a list of raw
+    records into X (e.g. CompiledPreprocessor.transform), otherwise records are
+    used as numeric rows directly. Keys are the records as tuples, so lookups cost
+    one tuple hash and equality is exact (no collisions). Thread-safe. monitor, if
+    given (e.g. a drift.DriftMonitor), sees every row asked for, cached or not: the
+    cache then also keeps each entry's preprocessed row.
+    """
+
+    def __init__(self, model, preprocess=None, maxsize=65536, monitor=None):
+        self.model = model
+        self.preprocess = preprocess
+        self.maxsize = maxsize
+        self.monitor = monitor
+        self._lock = threading.Lock()
+        # Bumped by swap_model(), so predictions from the previous model are not cached after it
+        self._generation = 0
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.evictions = 0
+
+    @staticmethod
+    def keys(records):
+        """Hashable keys for raw records; usable as a batch preprocess step whose output predict() accepts."""
+        return [record if isinstance(record, tuple) else tuple(record) for record in records]
+
+    def predict(self, records):
+        """Predictions for a sequence of raw records, in order, as an object array."""
+        keys = self.keys(records)
+        out = np.empty(len(keys), dtype=object)
+        # Uncached key -> every position in this batch that needs it
+        pending = {}
+        # Cached key -> [preprocessed row, times it was asked for], for the monitor
+        seen = {}
+        monitor = self.monitor
+        with self._lock:
+            model = self.model
+            generation = self._generation
+            entries = self._entries
+            for i, key in enumerate(keys):
+                value = entries.get(key, _MISSING)
+                if value is not _MISSING:
+                    entries.move_to_end(key)
+                    out[i] = value[0]
+                    self.hits += 1
+                    if monitor is not None:
+                        seen.setdefault(key, [value[1], 0])[1] += 1
+                else:
+                    pending.setdefault(key, []).append(i)
+            self.misses += len(pending)
+            self.deduplicated += sum(len(positions) - 1 for positions in pending.values())
+
+        if pending:
+            unique = list(pending)
+            start = time.perf_counter()
+            X = self.preprocess(unique) if self.preprocess is not None else np.asarray(unique, dtype=np.float64)
+            preprocessed = time.perf_counter()
+            predictions = model.predict(X)
+            _preprocess_timer.observe(preprocessed - start)
+            _predict_timer.observe(time.perf_counter() - preprocessed)
+            with self._lock:
+                for key, prediction in zip(unique, predictions):
+                    out[pending[key]] = prediction
+                if generation == self._generation:
+                    # The monitor needs the rows of later hits too; float32 halves their size
+                    rows = X.astype(np.float32) if monitor is not None else [None] * len(unique)
+                    for key, prediction, row in zip(unique, predictions, rows):
+                        self._entries[key] = (prediction, row)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        if monitor is not None and (pending or seen):
+            # Every row of the batch counts, repeats included: a flood of one record is drift too
+            parts = [(X, [len(pending[key]) for key in unique])] if pending else []
+            if seen:
+                parts.append((np.vstack([row for row, _ in seen.values()]), [n for _, n in seen.values()]))
+            monitor.update(np.concatenate([part[0] for part in parts]),
+                           np.concatenate([np.asarray(part[1], dtype=np.float64) for part in parts]))
+        return out
+
+    def swap_model(self, model):
+        """
+        Score with model from now on and forget every cached prediction. Batches
+        already being scored finish on the previous model; nothing waits.
+        """
+        with self._lock:
+            self.model = model
+            self._generation += 1
+            self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.deduplicated
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'deduplicated': self.deduplicated,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.deduplicated) / lookups if lookups else 0.0,
+            }
+
+
+def predict_unique(predict, X):
+    """
+    predict(X) computed only on the unique rows of the 2-D numeric array X and
+    scattered back. Returns (predictions, number of unique rows).
+    """
+    X = np.ascontiguousarray(X)
+    if len(X) < 2:
+        return predict(X), len(X)
+    # One opaque bytes value per row, so np.unique compares whole rows at once
+    rows = X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return predict(X[first])[inverse.ravel()], len(first)
@@ -19,10 +19,14 @@ columns = [
     'difficulty'      # Difficulty level as an integer
 ]
 
+# Explicit parse dtypes: skips pandas' per-column type inference and keeps chunks consistent
+column_dtypes = {col: ('float64' if col.endswith('_rate') else 'int64') for col in columns}
+column_dtypes.update({'protocol_type': object, 'service': object, 'flag': object, 'label': object})
+
 def load_preprocess_data(train_path, test_path):
     # Load datasets
-    train_df = pd.read_csv(train_path, names=columns)
-    test_df = pd.read_csv(test_path, names=columns)
+    train_df = pd.read_csv(train_path, names=columns, dtype=column_dtypes)
+    test_df = pd.read_csv(test_path, names=columns, dtype=column_dtypes)
 
     # Encode categorical columns
     categorical_cols = ['protocol_type', 'service', 'flag']
@@ -39,16 +43,147 @@ def load_preprocess_data(train_path, test_path):
 
     return train_df, test_df, scaler, encoder
 
-def train_model(train_df):
+def train_model(train_df, n_jobs=-1):
     # Separate features and labels
     X_train = train_df.drop(['label', 'difficulty'], axis=1)
     y_train = train_df['label']
 
-    # Train Random Forest Classifier
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    # Train Random Forest Classifier (on all cores by default; see src.train for cached/incremental training)
+    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=n_jobs)
     model.fit(X_train, y_train)
     return model
 
+categorical_cols = ['protocol_type', 'service', 'flag']
+# The 41 model inputs (label and difficulty are never part of a record to score)
+feature_cols = columns[:-2]
+
+class CompiledPreprocessor:
+    """
+    Pandas-free equivalent of the encoder + scaler transform used at training time.
+    Built once from the fitted OrdinalEncoder and StandardScaler: the categorical
+    columns become plain dict lookups and the scaler becomes mean/scale NumPy vectors,
+    so a whole batch of (N, 41) raw records is transformed in one vectorized pass.
+    Output is identical to preprocess_features() on the same records.
+    """
+
+    def __init__(self, encoder, scaler):
+        unknown_value = float(encoder.unknown_value) if encoder.handle_unknown == 'use_encoded_value' else None
+        self._setup(encoder.categories_, unknown_value,
+                    scaler.mean_ if scaler.with_mean else None,
+                    scaler.scale_ if scaler.with_std else None)
+
+    def _setup(self, categories, unknown_value, mean, scale):
+        self.cat_idx = [feature_cols.index(col) for col in categorical_cols]
+        self.num_idx = [i for i, col in enumerate(feature_cols) if col not in categorical_cols]
+        self.categories = [list(values) for values in categories]
+        # category -> ordinal code, exactly as OrdinalEncoder assigns them
+        self.lookups = [{category: float(code) for code, category in enumerate(values)}
+                        for values in self.categories]
+        self.unknown_value = unknown_value
+        self.mean = np.asarray(mean, dtype=np.float64) if mean is not None else None
+        self.scale = np.asarray(scale, dtype=np.float64) if scale is not None else None
+
+    @classmethod
+    def from_files(cls, encoder_path='models/encoder.joblib', scaler_path='models/scaler.joblib'):
+        return cls(joblib.load(encoder_path), joblib.load(scaler_path))
+
+    @classmethod
+    def from_arrays(cls, categories, unknown_value, mean, scale):
+        """
+        Build directly from the fitted parameters (per-column category lists, the
+        unknown code or None, scaler mean/scale vectors or None), e.g. from a model bundle.
+        """
+        self = cls.__new__(cls)
+        self._setup(categories, unknown_value, mean, scale)
+        return self
+
+    def encode(self, col_pos, values):
+        """Ordinal-encode one categorical column (col_pos indexes categorical_cols)."""
+        lookup = self.lookups[col_pos]
+        if self.unknown_value is None:
+            return np.array([lookup[v] for v in values], dtype=np.float64)
+        unknown = self.unknown_value
+        return np.array([lookup.get(v, unknown) for v in values], dtype=np.float64)
+
+    def scale_numeric(self, numeric):
+        """Apply the StandardScaler in place to an (N, 38) float64 array of numeric columns."""
+        if self.mean is not None:
+            numeric -= self.mean
+        if self.scale is not None:
+            numeric /= self.scale
+        return numeric
+
+    def transform(self, records):
+        """
+        records: sequence of raw 41-value records (or an (N, 41) array), in feature_cols order.
+        Returns: float64 array of shape (N, 41) ready for model prediction.
+        """
+        raw = np.asarray(records, dtype=object)
+        if raw.ndim == 1:
+            raw = raw.reshape(1, -1)
+        if raw.shape[1] != len(feature_cols):
+            raise ValueError(f"Expected {len(feature_cols)} features but got {raw.shape[1]}.")
+
+        out = np.empty(raw.shape, dtype=np.float64)
+        out[:, self.num_idx] = self.scale_numeric(raw[:, self.num_idx].astype(np.float64))
+        for pos, idx in enumerate(self.cat_idx):
+            out[:, idx] = self.encode(pos, raw[:, idx])
+        return out
+
+    def transform_columns(self, numeric, categoricals):
+        """
+        Columnar variant of transform() for data that is already split by type
+        (e.g. a pandas chunk): numeric is an (N, 38) array of the numeric columns in
+        feature_cols order, categoricals the three categorical columns as sequences.
+        """
+        out = np.empty((len(numeric), len(feature_cols)), dtype=np.float64)
+        out[:, self.num_idx] = self.scale_numeric(np.array(numeric, dtype=np.float64))
+        for pos, idx in enumerate(self.cat_idx):
+            out[:, idx] = self.encode(pos, categoricals[pos])
+        return out
+
+    def encode_record(self, record):
+        """
+        First half of transform() for one record: categoricals become their ordinal
+        codes, numeric columns are converted to float but left unscaled. Lets a
+        pipeline stage ship fixed-width float rows and scale them later in bulk.
+        """
+        row = np.array([float(v) if i not in self.cat_idx else 0.0 for i, v in enumerate(record)], dtype=np.float64)
+        unknown = self.unknown_value
+        for pos, idx in enumerate(self.cat_idx):
+            row[idx] = self.lookups[pos].get(record[idx], unknown)
+        return row
+
+    def transform_encoded(self, X):
+        """Second half of transform(): scale the numeric columns of encode_record() rows in place."""
+        X[:, self.num_idx] = self.scale_numeric(X[:, self.num_idx])
+        return X
+
+    def decode(self, col_pos, code):
+        """Inverse of the ordinal encoding for one value ('?' for unknown)."""
+        code = int(code)
+        categories = self.categories[col_pos]
+        return categories[code] if 0 <= code < len(categories) else '?'
+
+# Compiled preprocessors keyed by the (encoder, scaler) pair they were built from
+_compiled = {}
+
+def get_compiled_preprocessor(encoder, scaler):
+    key = (id(encoder), id(scaler))
+    entry = _compiled.get(key)
+    if entry is None or entry[0] is not encoder or entry[1] is not scaler:
+        entry = (encoder, scaler, CompiledPreprocessor(encoder, scaler))
+        _compiled[key] = entry
+    return entry[2]
+
+def preprocess_features_batch(records, encoder, scaler):
+    """
+    Preprocess many NSL-KDD records at once without building a DataFrame.
+    records: sequence of 41-value records, each strictly in the order required by the model.
+    Returns: numpy array of shape (n_records, n_features)
+    """
+    return get_compiled_preprocessor(encoder, scaler).transform(records)
+
 def preprocess_features(input_features, encoder, scaler):
     """
     Preprocess a list of input features for a single NSL-KDD record.
@@ -57,25 +192,14 @@ def preprocess_features(input_features, encoder, scaler):
     scaler: Loaded scaler instance
     Returns: numpy array ready for model prediction (shape: (n_features,))
     """
-    # Only first 41 features (exclude label, difficulty; user never enters these)
-    expected_cols = columns[:-2]
-    categorical_cols = ['protocol_type', 'service', 'flag']
-    numeric_cols = [col for col in expected_cols if col not in categorical_cols]
-
-    # Build DataFrame for transformation
-    df = pd.DataFrame([input_features], columns=expected_cols)
-
-    # Encode categorical columns
-    df[categorical_cols] = encoder.transform(df[categorical_cols])
-
-    # Scale numeric columns
-    df[numeric_cols] = scaler.transform(df[numeric_cols])
-
-    return df.values.flatten()
+    return preprocess_features_batch([input_features], encoder, scaler)[0]
 
 if __name__ == "__main__":
-    train_file = '../data/KDDTrain+.txt'
-    test_file = '../data/KDDTest+.txt'
+    # python -m src.preprocessing, from the repository root
+    from src.model_bundle import save_bundle
+
+    train_file = 'data/KDDTrain+.txt'
+    test_file = 'data/KDDTest+.txt'
 
     # Load and preprocess data
     train_df, test_df, scaler, encoder = load_preprocess_data(train_file, test_file)
@@ -87,8 +211,11 @@ if __name__ == "__main__":
     model = train_model(train_df)
 
     # Save scaler, encoder, and model in models folder
-    joblib.dump(scaler, '../models/scaler.joblib')
-    joblib.dump(encoder, '../models/encoder.joblib')
-    joblib.dump(model, '../models/model.joblib')
+    joblib.dump(scaler, 'models/scaler.joblib')
+    joblib.dump(encoder, 'models/encoder.joblib')
+    joblib.dump(model, 'models/model.joblib')
+
+    # And the same three as one verified, pickle-free bundle for the scorers
+    save_bundle('models/bundle', model, encoder, scaler, model_path='models/model.joblib')
 
-    print("Scaler, encoder, and model saved successfully.")
+    print("Scaler, encoder, model and bundle saved successfully.")
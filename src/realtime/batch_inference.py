@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+import numpy as np
+from src import metrics
+
+
+class BatchInferenceEngine:
+    """
+    Scores feature vectors in micro-batches on a background worker thread.
+
+    Producers (e.g. the scapy sniff callback) call submit() with a feature vector
+    and a context object identifying where it came from. If a preprocess callable
+    is given, rows are submitted raw and the whole batch is preprocessed in one
+    call on the worker, keeping that cost off the producer thread. The worker
+    collects rows until either max_batch_size rows are queued or max_delay seconds
+    have passed since the first row of the batch arrived, runs a single
+    model.predict() on the whole batch, and calls on_result(context, prediction)
+    for every row, in submission order. If an explain callable is given, it is
+    called once per batch as explain(rows, predictions) with the submitted rows and
+    returns one explanation per row, passed as on_result(context, prediction,
+    explanation).
+    """
+
+    def __init__(self, model, on_result, max_batch_size=256, max_delay=0.005, max_queue_size=10000,
+                 preprocess=None, explain=None):
+        self.model = model
+        self.on_result = on_result
+        self.preprocess = preprocess
+        self.explain = explain
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.submitted = 0
+        self.dropped = 0
+        self.scored = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_batch_seen = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_predict_time = 0.0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="batch-inference", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """Stop the worker after flushing whatever is already queued."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, features, context=None):
+        """
+        Queue one feature vector for scoring. Never blocks the caller: if the queue
+        is full the row is dropped and counted, so the sniffer keeps up with the wire.
+        Returns True if the row was queued.
+        """
+        try:
+            self._queue.put_nowait((features, context, time.perf_counter()))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+        with self._stats_lock:
+            self.submitted += 1
+        return True
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _collect_batch(self):
+        # Block (briefly) for the first row, then drain until the batch is full
+        # or the deadline measured from that first row expires.
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._score(batch)
+
+    def _score(self, batch):
+        contexts = [item[1] for item in batch]
+        start = time.perf_counter()
+        try:
+            if self.preprocess is not None:
+                X = self.preprocess([item[0] for item in batch])
+            else:
+                X = np.vstack([np.asarray(item[0]).reshape(1, -1) for item in batch])
+            predictions = self.model.predict(X)
+        except Exception as e:
+            print(f"Batch inference error: {e}")
+            with self._stats_lock:
+                self.errors += len(batch)
+            for context in contexts:
+                self.on_result(context, None)
+            return
+        done = time.perf_counter()
+
+        if self.explain is not None:
+            try:
+                explanations = self.explain([item[0] for item in batch], predictions)
+            except Exception as e:
+                print(f"Batch explanation error: {e}")
+                explanations = [None] * len(batch)
+            for context, prediction, explanation in zip(contexts, predictions, explanations):
+                self.on_result(context, prediction, explanation)
+        else:
+            for context, prediction in zip(contexts, predictions):
+                self.on_result(context, prediction)
+
+        latencies = [done - item[2] for item in batch]
+        metrics.SCORING_LATENCY_SECONDS.observe_many(latencies)
+        metrics.BATCH_ROWS.observe(len(batch))
+        with self._stats_lock:
+            self.batches += 1
+            self.scored += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.total_latency += sum(latencies)
+            self.max_latency = max(self.max_latency, max(latencies))
+            self.total_predict_time += done - start
+
+    def stats(self):
+        """Snapshot of batch-size and latency statistics (latencies in milliseconds)."""
+        with self._stats_lock:
+            return {
+                'submitted': self.submitted,
+                'scored': self.scored,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'batches': self.batches,
+                'queue_depth': self.queue_depth(),
+                'avg_batch_size': self.scored / self.batches if self.batches else 0.0,
+                'max_batch_size': self.max_batch_seen,
+                'avg_latency_ms': 1000 * self.total_latency / self.scored if self.scored else 0.0,
+                'max_latency_ms': 1000 * self.max_latency,
+                'avg_predict_ms': 1000 * self.total_predict_time / self.batches if self.batches else 0.0,
+            }
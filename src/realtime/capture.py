@@ -0,0 +1,470 @@
+"""
+Managed packet capture: configuration, flow sampling and load shedding.
+
+CaptureConfig says what reaches Python at all: a BPF filter and snaplen applied
+in the kernel, the interfaces to listen on, and a deterministic flow-hash sample
+rate. Sampling is decided per flow from a hash of the direction-independent
+5-tuple, so a flow is either fully kept or fully skipped and the flow table never
+sees half a connection.
+
+LoadShedder watches the scoring backlog. Above a high-water mark it halves the
+sample rate applied to low-risk flows (by default, common client services);
+below a low-water mark it gives rate back step by step. Everything else is always
+kept, and shed packets are counted. Whether a flow is shed is decided once, at
+its first packet, and remembered until the flow goes idle, so a rate change only
+applies to new flows and never cuts one in half.
+
+CaptureSession reads raw AF_PACKET frames through fast_decode on its own thread,
+or runs a scapy AsyncSniffer, and either way can be stopped from another thread
+(the Dash Stop button) instead of only by Ctrl+C. Packets it forwards can also be
+handed to a payload_inspection.PayloadInspector with their frame.
+"""
+import ctypes
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from src import metrics
+from src.realtime.services import PROTOCOL_NAMES, lookup_service
+
+# Services whose flows may be sampled down under load; everything else is always scored
+LOW_RISK_SERVICES = frozenset({'http', 'http_443', 'domain_u', 'ntp_u', 'smtp', 'pop_3', 'imap4', 'ftp_data'})
+
+HASH_SPACE = 2 ** 32
+
+BPF_RET_K = 0x06
+SO_ATTACH_FILTER = 26
+
+
+def flow_hash(proto, src, sport, dst, dport):
+    """Direction-independent 32-bit hash of a packet's flow, so both halves of a flow agree."""
+    a = f"{src}:{sport}"
+    b = f"{dst}:{dport}"
+    key = f"{proto}|{a}|{b}" if a <= b else f"{proto}|{b}|{a}"
+    return zlib.crc32(key.encode())
+
+
+def sampled(h, rate):
+    """Whether a flow with hash h is inside a sample of the given rate (0..1)."""
+    # Scrambled by a multiplicative hash so the sample is independent of h % n sharding
+    return rate >= 1.0 or ((h * 2654435761) % HASH_SPACE) < rate * HASH_SPACE
+
+
+class CaptureConfig:
+    """
+    What to capture. bpf_filter is a tcpdump-style expression; interfaces a list
+    of interface names (None: scapy's default); snaplen the bytes kept per frame
+    (None: whole frames); sample_rate the fraction of flows kept. decoder 'fast'
+    reads raw frames from AF_PACKET sockets and decodes headers without scapy
+    (see fast_decode), falling back to scapy's sniffer where that is unavailable.
+    """
+
+    def __init__(self, bpf_filter=None, interfaces=None, snaplen=None, sample_rate=1.0,
+                 low_risk_services=LOW_RISK_SERVICES, decoder='fast'):
+        if not 0.0 < sample_rate <= 1.0:
+            raise ValueError(f"sample_rate must be in (0, 1], got {sample_rate}.")
+        if snaplen is not None and snaplen < 96:
+            raise ValueError("snaplen below 96 bytes would cut into the link/IP/TCP headers.")
+        if decoder not in ('fast', 'scapy'):
+            raise ValueError(f"decoder must be 'fast' or 'scapy', got {decoder!r}.")
+        self.bpf_filter = bpf_filter
+        self.interfaces = list(interfaces) if interfaces else None
+        self.snaplen = snaplen
+        self.sample_rate = sample_rate
+        self.low_risk_services = frozenset(low_risk_services)
+        self.decoder = decoder
+
+    def is_low_risk(self, proto, sport, dport):
+        return lookup_service(PROTOCOL_NAMES.get(proto), sport, dport) in self.low_risk_services
+
+    def describe(self):
+        return {
+            'bpf_filter': self.bpf_filter,
+            'interfaces': self.interfaces,
+            'snaplen': self.snaplen,
+            'sample_rate': self.sample_rate,
+            'decoder': self.decoder,
+        }
+
+
+class LoadShedder:
+    """
+    AIMD controller for the sample rate of low-risk flows: halve it while the
+    backlog is above high_water, add step back while it is below low_water.
+    admit() keeps each flow's decision (by normalized 5-tuple) until it has been
+    idle for idle_timeout. Decisions are kept in last-seen order, so expiring idle
+    flows only touches those, and when max_flows (the flow table's default size)
+    are remembered the least recently seen one is dropped: an active flow keeps
+    its decision through a flood of new ones.
+    """
+
+    def __init__(self, high_water=5000, low_water=1000, min_rate=0.05, step=0.05, idle_timeout=60.0,
+                 max_flows=500000):
+        self.high_water = high_water
+        self.low_water = low_water
+        self.min_rate = min_rate
+        self.step = step
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.rate = 1.0
+        self.shed = 0
+        self.evicted = 0
+        self.adjustments = 0
+        self.shedding_since = None
+        self.shedding_seconds = 0.0
+        self.flows = OrderedDict()   # normalized 5-tuple -> [kept, last packet time], least recently seen first
+
+    def admit(self, key, ts, low_risk):
+        """
+        Whether to keep a packet of the flow key = (proto, (addr, port), (addr, port)),
+        normalized. low_risk() is only called for a flow's first packet.
+        """
+        flows = self.flows
+        decision = flows.get(key)
+        if decision is None:
+            if len(flows) >= self.max_flows:
+                flows.popitem(last=False)
+                self.evicted += 1
+            keep = self.rate >= 1.0 or not low_risk() or sampled(flow_hash(key[0], *key[1], *key[2]), self.rate)
+            flows[key] = [keep, ts]
+        else:
+            keep = decision[0]
+            decision[1] = ts
+            flows.move_to_end(key)
+        if not keep:
+            self.shed += 1
+        return keep
+
+    def expire(self, now):
+        """Forget the decisions of flows idle for idle_timeout."""
+        flows = self.flows
+        deadline = now - self.idle_timeout
+        while flows and next(iter(flows.values()))[1] <= deadline:
+            flows.popitem(last=False)
+
+    def update(self, backlog, now=None):
+        """Feed the current backlog; returns the sample rate for low-risk flows."""
+        now = now if now is not None else time.time()
+        self.expire(now)
+        previous = self.rate
+        if backlog > self.high_water:
+            self.rate = max(self.min_rate, self.rate / 2)
+        elif backlog < self.low_water and self.rate < 1.0:
+            self.rate = min(1.0, self.rate + self.step)
+        if self.rate != previous:
+            self.adjustments += 1
+        if self.rate < 1.0 and self.shedding_since is None:
+            self.shedding_since = now
+        elif self.rate >= 1.0 and self.shedding_since is not None:
+            self.shedding_seconds += now - self.shedding_since
+            self.shedding_since = None
+        return self.rate
+
+    def stats(self, now=None):
+        now = now if now is not None else time.time()
+        active = now - self.shedding_since if self.shedding_since is not None else 0.0
+        return {
+            'low_risk_rate': self.rate,
+            'shed_packets': self.shed,
+            'adjustments': self.adjustments,
+            'shedding_seconds': self.shedding_seconds + active,
+            'tracked_flows': len(self.flows),
+            'evicted_flows': self.evicted,
+        }
+
+
+def _snaplen_program(bpf_filter, iface, snaplen):
+    """
+    Classic BPF program (list of (code, jt, jf, k)) that applies bpf_filter and
+    truncates accepted frames to snaplen. A BPF program's return value is the
+    number of bytes the kernel copies to the socket, so rewriting every accepting
+    'ret #k' to min(k, snaplen) is exactly a snaplen.
+    """
+    if not bpf_filter:
+        return [(BPF_RET_K, 0, 0, snaplen)]
+    from scapy.arch.common import compile_filter
+    program = compile_filter(bpf_filter, iface)
+    instructions = []
+    for i in range(program.bf_len):
+        ins = program.bf_insns[i]
+        k = ins.k
+        if ins.code == BPF_RET_K and k:
+            k = min(k, snaplen)
+        instructions.append((ins.code, ins.jt, ins.jf, k))
+    return instructions
+
+
+def _attach_program(sock, instructions):
+    code = b''.join(struct.pack('HBBI', *ins) for ins in instructions)
+    buffer = ctypes.create_string_buffer(code)
+    fprog = struct.pack('HL', len(instructions), ctypes.addressof(buffer))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def open_snaplen_sockets(config):
+    """
+    Linux only: listening sockets for config.interfaces with the filter and
+    snaplen attached in the kernel. Returns None where that is not possible
+    (other platforms, no privileges, no libpcap to compile the filter).
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    from scapy.config import conf
+    sockets = {}
+    try:
+        for iface in config.interfaces or [conf.iface]:
+            sock = conf.L2listen(iface=iface)
+            sockets[sock] = str(iface)
+            _attach_program(sock.ins, _snaplen_program(config.bpf_filter, iface, config.snaplen))
+    except Exception as e:
+        print(f"Kernel snaplen unavailable ({e}); capturing whole frames.")
+        for sock in sockets:
+            sock.close()
+        return None
+    return sockets
+
+
+class CaptureSession:
+    """
+    One stoppable capture. Every parsed packet (parse_packet() fields) that
+    survives sampling and shedding goes to on_fields; backlog() reports the
+    scoring queue depth for the shedder; on_stop runs after the sniffer has
+    stopped (e.g. to flush open flows). inspector, if given, sees every forwarded
+    packet right after on_fields. on_idle(now), if given, is called on the capture
+    thread (or, for scapy's sniffer, never concurrently with packets) when no
+    packet arrived for a while, so open flows can still time out on a quiet link.
+    """
+
+    # Packets between two shedder updates
+    CHECK_INTERVAL = 256
+    # Seconds between on_idle calls from scapy's sniffer path
+    IDLE_INTERVAL = 1.0
+
+    def __init__(self, config, on_fields, backlog=None, on_stop=None, shedder=None, inspector=None, on_idle=None):
+        self.config = config
+        self.on_fields = on_fields
+        self.inspector = inspector
+        self.on_idle = on_idle
+        self.backlog = backlog
+        self.on_stop = on_stop
+        self.shedder = shedder if shedder is not None else (LoadShedder() if backlog is not None else None)
+        self.sniffer = None
+        self._raw_thread = None
+        self._idle_thread = None
+        self._stop_event = threading.Event()
+        # Serializes scapy's packet callback with the idle ticker
+        self._packet_lock = threading.Lock()
+        self.decode_stats = {}
+        self.decoder = None
+        self.error = None
+        self.started = None
+        self.stopped = None
+        self._lock = threading.Lock()
+        self.packets = 0
+        self.ignored = 0
+        self.sampled_out = 0
+        self.forwarded = 0
+        self.errors = 0
+
+    @property
+    def running(self):
+        if self._raw_thread is not None:
+            return self._raw_thread.is_alive()
+        return self.sniffer is not None and self.sniffer.running
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.started = time.time()
+            self.stopped = None
+            self.error = None
+            source = self._open_raw_source() if self.config.decoder == 'fast' else None
+            if source is not None:
+                self._stop_event.clear()
+                self._raw_thread = threading.Thread(target=self._run_raw, args=(source,), name="capture", daemon=True)
+                self._raw_thread.start()
+                self.decoder = 'fast'
+                return
+            self._start_sniffer()
+            self.decoder = 'scapy'
+            if self.on_idle is not None:
+                self._stop_event.clear()
+                self._idle_thread = threading.Thread(target=self._run_idle, name="capture-idle", daemon=True)
+                self._idle_thread.start()
+
+    def _open_raw_source(self):
+        from src.realtime.fast_decode import AfPacketSource
+        config = self.config
+        try:
+            from scapy.config import conf
+            # Same default as scapy's sniffer: its default interface, not every one
+            interfaces = config.interfaces or ([str(conf.iface)] if conf.iface else None)
+            program = None
+            if config.bpf_filter or config.snaplen:
+                program = _snaplen_program(config.bpf_filter, interfaces[0] if interfaces else None,
+                                           config.snaplen or 262144)
+            return AfPacketSource(interfaces, program)
+        except Exception as e:
+            print(f"Raw AF_PACKET capture unavailable ({e}); using scapy's sniffer.")
+            return None
+
+    def _start_sniffer(self):
+        from scapy.all import AsyncSniffer
+        config = self.config
+        sockets = open_snaplen_sockets(config) if config.snaplen else None
+        if sockets is not None:
+            self.sniffer = AsyncSniffer(opened_socket=sockets, prn=self._on_packet, store=False)
+        else:
+            iface = config.interfaces[0] if config.interfaces and len(config.interfaces) == 1 \
+                else config.interfaces
+            self.sniffer = AsyncSniffer(iface=iface, filter=config.bpf_filter, prn=self._on_packet, store=False)
+        self.sniffer.start()
+
+    def _run_raw(self, source):
+        from src.realtime.fast_decode import decode_or_fallback
+        timer = metrics.stage('capture')
+        try:
+            for ts, frame, linktype in source.frames(self._stop_event, idle=self.on_idle is not None):
+                if frame is None:
+                    self._idle(ts)
+                    continue
+                self.packets += 1
+                timed = self.packets % metrics.SAMPLE_EVERY == 0
+                if timed:
+                    start = time.perf_counter()
+                try:
+                    fields = decode_or_fallback(frame, ts, linktype, self.decode_stats)
+                except Exception as e:
+                    self._count_error(e)
+                    continue
+                if timed:
+                    timer.observe(time.perf_counter() - start)
+                if self._handle(fields) and self.inspector is not None:
+                    try:
+                        self.inspector.inspect(fields, frame, linktype)
+                    except Exception as e:
+                        self._count_error(e)
+        except Exception as e:
+            self.error = e
+        finally:
+            source.close()
+
+    def _run_idle(self):
+        while not self._stop_event.wait(self.IDLE_INTERVAL):
+            with self._packet_lock:
+                self._idle(time.time())
+
+    def _idle(self, now):
+        try:
+            self.on_idle(now)
+        except Exception as e:
+            self._count_error(e)
+
+    def _on_packet(self, packet):
+        with self._packet_lock:
+            self._process_packet(packet)
+
+    def _process_packet(self, packet):
+        from src.realtime.feature_extractor import parse_packet
+        self.packets += 1
+        timed = self.packets % metrics.SAMPLE_EVERY == 0
+        if timed:
+            start = time.perf_counter()
+        try:
+            fields = parse_packet(packet)
+        except Exception as e:
+            self._count_error(e)
+            return
+        if timed:
+            metrics.stage('capture').observe(time.perf_counter() - start)
+        if self._handle(fields) and self.inspector is not None:
+            try:
+                self.inspector.inspect_packet(fields, packet)
+            except Exception as e:
+                self._count_error(e)
+
+    def _handle(self, fields):
+        """Sample, shed or forward one packet's fields; True if forwarded."""
+        if fields is None:
+            self.ignored += 1
+            return False
+        try:
+            ts, proto, src, sport, dst, dport, _, _ = fields
+            config = self.config
+            shedder = self.shedder
+            if shedder is not None and self.packets % self.CHECK_INTERVAL == 0:
+                shedder.update(self.backlog())
+            if config.sample_rate < 1.0 and not sampled(flow_hash(proto, src, sport, dst, dport), config.sample_rate):
+                self.sampled_out += 1
+                return False
+            if shedder is not None:
+                a = (src, sport)
+                b = (dst, dport)
+                key = (proto, a, b) if a <= b else (proto, b, a)
+                if not shedder.admit(key, ts, lambda: config.is_low_risk(proto, sport, dport)):
+                    return False
+            self.forwarded += 1
+            self.on_fields(fields)
+            return True
+        except Exception as e:
+            self._count_error(e)
+            return False
+
+    def _count_error(self, e):
+        # Keep capturing: one bad packet must not kill the capture thread
+        self.errors += 1
+        if self.errors <= 10:
+            print(f"Capture error: {e}")
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            if self._raw_thread is not None:
+                self._stop_event.set()
+                self._raw_thread.join(timeout)
+                self._raw_thread = None
+            elif self.sniffer is not None:
+                sniffer = self.sniffer
+                if sniffer.running:
+                    try:
+                        sniffer.stop(join=False)
+                    except Exception as e:
+                        print(f"Error stopping sniffer: {e}")
+                sniffer.join(timeout)
+                self.error = getattr(sniffer, 'exception', None)
+                self.sniffer = None
+                if self._idle_thread is not None:
+                    self._stop_event.set()
+                    self._idle_thread.join(timeout)
+                    self._idle_thread = None
+            else:
+                return
+            self.stopped = time.time()
+        if self.on_stop is not None:
+            self.on_stop()
+
+    def status(self):
+        end = self.stopped or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        status = {
+            'running': self.running,
+            'config': self.config.describe(),
+            'seconds': elapsed,
+            'packets': self.packets,
+            'packets_per_second': self.packets / elapsed if elapsed else 0.0,
+            'ignored': self.ignored,
+            'sampled_out': self.sampled_out,
+            'forwarded': self.forwarded,
+            'errors': self.errors,
+            'decoder': self.decoder,
+            'scapy_fallbacks': self.decode_stats.get('fallback', 0),
+        }
+        error = getattr(self.sniffer, 'exception', None) or self.error
+        if error is not None:
+            status['error'] = str(error)
+        if self.shedder is not None:
+            status.update(self.shedder.stats())
+        return status
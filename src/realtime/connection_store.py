@@ -0,0 +1,390 @@
+"""
+Append-only columnar history of scored connections.
+
+Every scored connection is kept with its timestamp, 5-tuple (the protocol is
+its protocol_type feature), the 41 raw features and the predicted label, so past alerts can be searched and history
+can be re-scored with another model. The store is a directory of segments:
+
+    data/history/seg-000001/   ts.npy src.npy sport.npy ... numeric.npy label.npy meta.json
+
+Each column is a fixed-dtype .npy file created at full segment size and written
+in place through a memory map, so appending copies a batch of rows into the
+page cache and nothing else. Records are buffered and converted a batch at a
+time (flush_rows, or flush_seconds after the first one on a quiet link), so the
+per-record cost on the live path is a tuple append. meta.json (rows written,
+label vocabulary) is rewritten atomically at every flush, so a crash loses at
+most the unflushed buffer.
+
+A segment is sealed after segment_rows records or segment_seconds seconds
+(checked at every append, so a quiet link still rotates hourly); with
+max_segments, the oldest segments are deleted beyond that many. At
+sealing, its rows are sorted by timestamp and a label index is written (row
+numbers grouped by label). Queries therefore skip segments by their time range
+and label counts, binary-search timestamps, and read only the matching rows of
+a label. All reads are memory-mapped.
+
+    python -m src.realtime.connection_store stats
+    python -m src.realtime.connection_store query --since 2026-01-01T00:00 --label neptune --limit 20
+    python -m src.realtime.connection_store rescore          # with the current serving model
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from src.preprocessing import categorical_cols, feature_cols
+
+HISTORY_PATH = 'data/history'
+META = 'meta.json'
+
+_categorical_idx = [feature_cols.index(col) for col in categorical_cols]
+_numeric_idx = [i for i in range(len(feature_cols)) if i not in _categorical_idx]
+
+# Per-row columns: name -> (dtype, trailing shape)
+COLUMNS = {
+    'ts': (np.float64, ()),
+    'src': ('S39', ()),        # longest IPv6 text form
+    'sport': (np.uint16, ()),
+    'dst': ('S39', ()),
+    'dport': (np.uint16, ()),
+    'numeric': (np.float64, (len(_numeric_idx),)),
+    'protocol_type': ('S8', ()),
+    'service': ('S16', ()),
+    'flag': ('S8', ()),
+    'label': (np.uint16, ()),  # index into the segment's label vocabulary
+}
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class Segment:
+    """One segment directory; columns are memory-mapped on first access."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        self._columns = {}
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    @property
+    def sealed(self):
+        return self.meta['sealed']
+
+    @property
+    def labels(self):
+        return self.meta['labels']
+
+    def column(self, name):
+        array = self._columns.get(name)
+        if array is None:
+            array = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+            self._columns[name] = array
+        return array[:self.rows]
+
+    def overlaps(self, start, end):
+        if not self.rows:
+            return False
+        return (start is None or self.meta['ts_max'] >= start) and (end is None or self.meta['ts_min'] < end)
+
+    def select(self, start=None, end=None, label=None):
+        """Row numbers with start <= ts < end and the given label, in timestamp order."""
+        if not self.overlaps(start, end) or (label is not None and label not in self.labels):
+            return np.empty(0, dtype=np.intp)
+        ts = self.column('ts')
+        if self.sealed:
+            # Sorted by time: binary search for the range, then the label's slice of the index
+            lo = np.searchsorted(ts, start, 'left') if start is not None else 0
+            hi = np.searchsorted(ts, end, 'left') if end is not None else self.rows
+            if label is None:
+                return np.arange(lo, hi)
+            offsets = self.meta['label_offsets'][label]
+            rows = np.load(os.path.join(self.path, 'label_index.npy'), mmap_mode='r')[offsets[0]:offsets[1]]
+            return rows[(rows >= lo) & (rows < hi)]
+        mask = np.ones(self.rows, dtype=bool)
+        if start is not None:
+            mask &= ts >= start
+        if end is not None:
+            mask &= ts < end
+        if label is not None:
+            mask &= self.column('label') == self.labels.index(label)
+        rows = np.flatnonzero(mask)
+        return rows[np.argsort(ts[rows], kind='stable')]
+
+    def records(self, rows):
+        """Columns of the given rows as a dict of arrays, with labels as strings."""
+        out = {name: self.column(name)[rows] for name in COLUMNS}
+        out['label'] = np.array(self.labels, dtype=object)[out['label']] if len(rows) else np.empty(0, dtype=object)
+        return out
+
+    def features(self, rows=None):
+        """(numeric (N, 38) array, [protocol_type, service, flag] string arrays), as CompiledPreprocessor.transform_columns takes them."""
+        rows = slice(None) if rows is None else rows
+        return (np.asarray(self.column('numeric')[rows]),
+                [self.column(col)[rows].astype(str) for col in categorical_cols])
+
+
+class ConnectionStore:
+    """
+    Writer and reader for a history directory. One process writes (the live
+    capture); others open it with readonly=True. Queries may run on any thread.
+    """
+
+    def __init__(self, path=HISTORY_PATH, segment_rows=100000, segment_seconds=3600, flush_rows=1024,
+                 max_segments=None, readonly=False, flush_seconds=5.0):
+        self.path = path
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self._pending = []
+        self._pending_since = None
+        self._active = None
+        self._arrays = None
+        self.appended = 0
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+            self._recover()
+
+    def _recover(self):
+        # Segments left open by a writer that has exited are sealed as they are
+        for path in self._segment_paths():
+            segment = Segment(path)
+            if not segment.sealed and not _process_alive(segment.meta.get('pid')):
+                arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r+') for name in COLUMNS}
+                self._seal(segment, arrays)
+
+    def append(self, ts, src, sport, dst, dport, features, label):
+        """Queue one scored connection; features are its 41 raw values in feature_cols order."""
+        if self.readonly:
+            raise ValueError("This connection store was opened read-only.")
+        with self._lock:
+            now = time.time()
+            if not self._pending:
+                self._pending_since = now
+            self._pending.append((ts, src, sport, dst, dport, features, label))
+            # Age checks here, not only at flush: on a quiet link flush_rows may take days
+            if (len(self._pending) >= self.flush_rows or now - self._pending_since >= self.flush_seconds
+                    or (self._active is not None and self._needs_rotation(now))):
+                self.flush()
+
+    def flush(self):
+        """Write the queued records into the active segment (rotating it when full or old)."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            while pending:
+                if self._active is None or self._needs_rotation():
+                    self._rotate()
+                room = self.segment_rows - self._active.meta['rows']
+                self._write(pending[:room])
+                pending = pending[room:]
+
+    def _needs_rotation(self, now=None):
+        meta = self._active.meta
+        return meta['rows'] >= self.segment_rows or (
+            meta['rows'] and (now or time.time()) - meta['created'] >= self.segment_seconds)
+
+    def _segment_paths(self):
+        if not os.path.isdir(self.path):
+            return []
+        names = sorted(name for name in os.listdir(self.path) if name.startswith('seg-'))
+        return [os.path.join(self.path, name) for name in names
+                if os.path.exists(os.path.join(self.path, name, META))]
+
+    def _rotate(self):
+        if self._active is not None:
+            self._seal(self._active, self._arrays)
+        paths = self._segment_paths()
+        number = int(os.path.basename(paths[-1])[4:]) + 1 if paths else 1
+        path = os.path.join(self.path, f"seg-{number:06d}")
+        os.makedirs(path)
+        self._arrays = {name: np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode='w+',
+                                                        dtype=dtype, shape=(self.segment_rows,) + shape)
+                        for name, (dtype, shape) in COLUMNS.items()}
+        meta = {'rows': 0, 'sealed': False, 'created': time.time(), 'pid': os.getpid(),
+                'labels': [], 'label_counts': {}, 'ts_min': None, 'ts_max': None, 'capacity': self.segment_rows}
+        _write_json(os.path.join(path, META), meta)
+        self._active = Segment(path)
+        if self.max_segments:
+            for old in paths[:max(0, len(paths) + 1 - self.max_segments)]:
+                shutil.rmtree(old, ignore_errors=True)
+
+    def _write(self, records):
+        meta = self._active.meta
+        start, end = meta['rows'], meta['rows'] + len(records)
+        columns = list(zip(*records))
+        arrays = self._arrays
+        ts = np.asarray(columns[0], dtype=np.float64)
+        arrays['ts'][start:end] = ts
+        arrays['src'][start:end] = columns[1]
+        arrays['sport'][start:end] = columns[2]
+        arrays['dst'][start:end] = columns[3]
+        arrays['dport'][start:end] = columns[4]
+        raw = np.array(columns[5], dtype=object)
+        arrays['numeric'][start:end] = raw[:, _numeric_idx].astype(np.float64)
+        for pos, col in zip(_categorical_idx, categorical_cols):
+            arrays[col][start:end] = raw[:, pos].astype(str)
+        labels = meta['labels']
+        unique, inverse, counts = np.unique(np.asarray(columns[6], dtype=str), return_inverse=True,
+                                            return_counts=True)
+        codes = []
+        for label, count in zip(unique.tolist(), counts.tolist()):
+            if label not in meta['label_counts']:
+                meta['label_counts'][label] = 0
+                labels.append(label)
+            meta['label_counts'][label] += count
+            codes.append(labels.index(label))
+        arrays['label'][start:end] = np.asarray(codes, dtype=np.uint16)[inverse.ravel()]
+        meta['rows'] = end
+        meta['ts_min'] = float(min(ts.min(), meta['ts_min'])) if meta['ts_min'] is not None else float(ts.min())
+        meta['ts_max'] = float(max(ts.max(), meta['ts_max'])) if meta['ts_max'] is not None else float(ts.max())
+        _write_json(os.path.join(self._active.path, META), meta)
+        self.appended += len(records)
+
+    def _seal(self, segment, arrays):
+        """Sort the segment by time, write its label index and mark it read-only."""
+        meta = segment.meta
+        rows = meta['rows']
+        order = np.argsort(arrays['ts'][:rows], kind='stable')
+        for array in arrays.values():
+            array[:rows] = array[:rows][order]
+            array.flush()
+        codes = np.asarray(arrays['label'][:rows])
+        index = np.argsort(codes, kind='stable').astype(np.int64)
+        np.save(os.path.join(segment.path, 'label_index.npy'), index)
+        counts = np.bincount(codes, minlength=len(meta['labels']))
+        bounds = np.concatenate([[0], np.cumsum(counts)]).tolist()
+        meta['label_offsets'] = {label: [bounds[i], bounds[i + 1]] for i, label in enumerate(meta['labels'])}
+        meta['sealed'] = True
+        meta['sealed_at'] = time.time()
+        _write_json(os.path.join(segment.path, META), meta)
+        if segment is self._active:
+            self._arrays = None
+            self._active = None
+
+    def close(self):
+        """Flush and seal the active segment."""
+        with self._lock:
+            self.flush()
+            if self._active is not None:
+                self._seal(self._active, self._arrays)
+
+    def segments(self):
+        with self._lock:
+            self.flush()
+            active = self._active.path if self._active is not None else None
+            return [self._active if path == active else Segment(path) for path in self._segment_paths()]
+
+    def query(self, start=None, end=None, label=None, limit=None):
+        """Records with start <= ts < end (epoch seconds) and the given label, oldest first, as columns."""
+        parts = []
+        found = 0
+        for segment in self.segments():
+            rows = segment.select(start, end, label)
+            if not len(rows):
+                continue
+            if limit is not None:
+                rows = rows[:limit - found]
+            parts.append(segment.records(rows))
+            found += len(rows)
+            if limit is not None and found >= limit:
+                break
+        if not parts:
+            return _empty_columns()
+        return {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+
+    def rescore(self, model, preprocessor, segments=None):
+        """
+        Score every stored row of the given segments (default: all) again, straight
+        from the mapped feature columns. Yields (segment, new labels, stored labels).
+        """
+        for segment in self.segments():
+            if segments is not None and segment.name not in segments:
+                continue
+            if not segment.rows:
+                continue
+            numeric, categoricals = segment.features()
+            predictions = model.predict(preprocessor.transform_columns(numeric, categoricals))
+            stored = np.array(segment.labels, dtype=object)[segment.column('label')]
+            yield segment, predictions, stored
+
+
+def _empty_columns():
+    return {name: np.empty((0,) + shape, dtype=dtype if name != 'label' else object)
+            for name, (dtype, shape) in COLUMNS.items()}
+
+
+def parse_time(text):
+    """Epoch seconds from an ISO date/time or a plain number."""
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, query or re-score the scored-connection history.")
+    parser.add_argument('command', choices=['stats', 'query', 'rescore'])
+    parser.add_argument('--path', default=HISTORY_PATH)
+    parser.add_argument('--since', default=None, help="ISO time or epoch seconds")
+    parser.add_argument('--until', default=None, help="ISO time or epoch seconds")
+    parser.add_argument('--label', default=None)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--segment', action='append', help="segment name to re-score (repeatable)")
+    args = parser.parse_args()
+    store = ConnectionStore(args.path, readonly=True)
+
+    if args.command == 'stats':
+        for segment in store.segments():
+            meta = segment.meta
+            span = (f"{datetime.fromtimestamp(meta['ts_min']):%Y-%m-%d %H:%M:%S} .. "
+                    f"{datetime.fromtimestamp(meta['ts_max']):%Y-%m-%d %H:%M:%S}") if segment.rows else "empty"
+            print(f"{segment.name}  {'sealed' if segment.sealed else 'open  '}  {segment.rows:>8} rows  {span}  "
+                  f"{meta['label_counts']}")
+    elif args.command == 'query':
+        found = store.query(parse_time(args.since), parse_time(args.until), args.label, args.limit)
+        for i in range(len(found['ts'])):
+            print(f"{datetime.fromtimestamp(found['ts'][i]):%Y-%m-%d %H:%M:%S}  {found['protocol_type'][i].decode():<5}"
+                  f"{found['src'][i].decode()}:{found['sport'][i]} -> {found['dst'][i].decode()}:{found['dport'][i]}  "
+                  f"{found['service'][i].decode():<10}{found['flag'][i].decode():<5}{found['label'][i]}")
+    else:
+        from src import model_registry
+        model, preprocessor = model_registry.get_serving_model(), model_registry.get_preprocessor()
+        for segment, predictions, stored in store.rescore(model, preprocessor, args.segment):
+            changed = predictions != stored
+            print(f"{segment.name}: {segment.rows} rows re-scored, {int(changed.sum())} changed")
+            for old, new in sorted(set(zip(stored[changed], predictions[changed])))[:10]:
+                print(f"    {old} -> {new}: {int(np.sum((stored == old) & (predictions == new)))}")
+
+
+if __name__ == '__main__':
+    main()
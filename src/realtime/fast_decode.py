@@ -0,0 +1,379 @@
+"""
+Header-only packet decoding straight from raw frame bytes.
+
+scapy dissects every layer of every frame into objects, while the flow table only
+needs the timestamp, protocol, addresses, ports, payload size and TCP flags.
+decode_frame() reads exactly those fields with struct.unpack_from at fixed
+offsets of the frame buffer (bytes, mmap slice or memoryview), so nothing is
+copied but the address strings. It returns the same tuple as
+feature_extractor.parse_packet().
+
+Covered: Ethernet (with 802.1Q/802.1ad tags), raw IP, Linux cooked (SLL/SLL2)
+and BSD loopback link layers; IPv4 and IPv6 without extension headers; TCP,
+UDP and ICMP. Anything else it cannot decode with certainty (tunnels, IPv6
+extension headers, MPLS/PPPoE, truncated headers) is returned as FALLBACK and
+handed to scapy by decode_or_fallback().
+
+Frame sources that feed it without scapy:
+
+    read_frames(path)     pcap and pcapng files, memory-mapped, yielding views
+    AfPacketSource        Linux AF_PACKET sockets, received into one reused buffer
+
+    python -m src.realtime.fast_decode capture.pcap     # packets/s: fast vs scapy
+"""
+import mmap
+import select
+import socket
+import struct
+import sys
+import time
+
+# Returned when a frame needs the scapy decoder
+FALLBACK = object()
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+# Platform-specific aliases for raw IP
+RAW_LINKTYPES = (LINKTYPE_RAW, 12, 14, 228, 229)
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+VLAN_TYPES = (0x8100, 0x88A8, 0x9100)
+ETH_P_ALL = 0x0003
+# sockaddr_ll packet type and hardware type of a frame this host sent on loopback
+PACKET_OUTGOING = 4
+ARPHRD_LOOPBACK = 772
+
+PROTO_ICMP = 1
+PROTO_TCP = 6
+PROTO_UDP = 17
+# Protocols scapy would look inside (tunnels, extension headers): leave to scapy
+FALLBACK_PROTOS = frozenset({0, 4, 41, 43, 44, 47, 50, 51, 60, 135})
+
+_u16 = struct.Struct('!H')
+_ipv4 = struct.Struct('!BxH2xHxB')   # ver/ihl, total length, flags/fragment offset, protocol
+_ipv6 = struct.Struct('!4xHB')       # payload length, next header
+_ports = struct.Struct('!HH')
+_tcp_flags = struct.Struct('!BB')    # data offset/NS, flags
+_seq = struct.Struct('!I')
+_inet_ntoa = socket.inet_ntoa
+_inet_ntop = socket.inet_ntop
+_AF_INET6 = socket.AF_INET6
+
+
+def _network_offset(frame, linktype):
+    """(ethertype, offset of the network header) for a frame, or (None, None) if unknown."""
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        ethertype = _u16.unpack_from(frame, offset)[0]
+        while ethertype in VLAN_TYPES:
+            offset += 4
+            ethertype = _u16.unpack_from(frame, offset)[0]
+        return ethertype, offset + 2
+    if linktype in RAW_LINKTYPES:
+        version = frame[0] >> 4
+        return (ETH_P_IP if version == 4 else ETH_P_IPV6 if version == 6 else None), 0
+    if linktype == LINKTYPE_LINUX_SLL:
+        return _u16.unpack_from(frame, 14)[0], 16
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return _u16.unpack_from(frame, 0)[0], 20
+    if linktype == LINKTYPE_NULL:
+        family = frame[0] or frame[3]  # host byte order of the capturing machine
+        return (ETH_P_IP if family == 2 else ETH_P_IPV6 if family in (24, 28, 30) else None), 4
+    return None, None
+
+
+def decode_frame(frame, ts, linktype=LINKTYPE_ETHERNET):
+    """
+    (ts, proto, src, sport, dst, dport, payload_len, tcp_flags) for a TCP/UDP/ICMP
+    frame, None for frames parse_packet() would also skip (ARP, ICMPv6, other
+    protocols, non-first fragments), FALLBACK when scapy has to decide.
+    """
+    try:
+        ethertype, offset = _network_offset(frame, linktype)
+        if ethertype == ETH_P_IP:
+            version_ihl, total_len, fragment, proto = _ipv4.unpack_from(frame, offset)
+            if version_ihl >> 4 != 4:
+                return FALLBACK
+            if fragment & 0x1FFF:
+                return None  # no transport header in later fragments
+            if proto in FALLBACK_PROTOS:
+                return FALLBACK
+            ihl = 4 * (version_ihl & 0x0F)
+            src = _inet_ntoa(frame[offset + 12:offset + 16])
+            dst = _inet_ntoa(frame[offset + 16:offset + 20])
+            l4 = offset + ihl
+            l4_len = total_len - ihl
+        elif ethertype == ETH_P_IPV6:
+            l4_len, proto = _ipv6.unpack_from(frame, offset)
+            if proto in FALLBACK_PROTOS or proto == PROTO_ICMP:
+                return FALLBACK
+            src = _inet_ntop(_AF_INET6, frame[offset + 8:offset + 24])
+            dst = _inet_ntop(_AF_INET6, frame[offset + 24:offset + 40])
+            l4 = offset + 40
+        elif ethertype is None or ethertype == 0x0806:
+            return None if ethertype == 0x0806 else FALLBACK
+        else:
+            return FALLBACK  # MPLS, PPPoE, ... may still carry IP
+
+        if proto == PROTO_TCP:
+            sport, dport = _ports.unpack_from(frame, l4)
+            offset_byte, flags = _tcp_flags.unpack_from(frame, l4 + 12)
+            header = 4 * (offset_byte >> 4) or 20
+            return ts, PROTO_TCP, src, sport, dst, dport, max(l4_len - header, 0), \
+                ((offset_byte & 0x01) << 8) | flags
+        if proto == PROTO_UDP:
+            sport, dport = _ports.unpack_from(frame, l4)
+            return ts, PROTO_UDP, src, sport, dst, dport, max(l4_len - 8, 0), 0
+        if proto == PROTO_ICMP:
+            if len(frame) < l4 + 8:
+                return FALLBACK
+            return ts, PROTO_ICMP, src, frame[l4], dst, 0, max(l4_len - 8, 0), 0
+        return None
+    except (struct.error, IndexError, ValueError, OSError):
+        return FALLBACK  # truncated headers
+
+
+def tcp_segment(frame, linktype=LINKTYPE_ETHERNET):
+    """
+    (sequence number, captured payload view, payload length on the wire) of a
+    TCP frame decode_frame() can read, or None. The view is shorter than the
+    length when the capture snaplen cut the frame.
+    """
+    try:
+        ethertype, offset = _network_offset(frame, linktype)
+        if ethertype == ETH_P_IP:
+            version_ihl, total_len, fragment, proto = _ipv4.unpack_from(frame, offset)
+            if version_ihl >> 4 != 4 or fragment & 0x1FFF or proto != PROTO_TCP:
+                return None
+            ihl = 4 * (version_ihl & 0x0F)
+            l4 = offset + ihl
+            l4_len = total_len - ihl
+        elif ethertype == ETH_P_IPV6:
+            l4_len, proto = _ipv6.unpack_from(frame, offset)
+            if proto != PROTO_TCP:
+                return None
+            l4 = offset + 40
+        else:
+            return None
+        seq = _seq.unpack_from(frame, l4 + 4)[0]
+        header = 4 * (frame[l4 + 12] >> 4) or 20
+        length = max(l4_len - header, 0)
+        start = l4 + header
+        # Bounded by the IP length too: Ethernet pads short frames
+        return seq, frame[start:min(start + length, len(frame))], length
+    except (struct.error, IndexError, ValueError):
+        return None
+
+
+def scapy_decode(frame, ts, linktype=LINKTYPE_ETHERNET):
+    """The slow path: dissect with scapy and run parse_packet()."""
+    from scapy.config import conf
+    from scapy.packet import Raw
+    import scapy.layers.all  # noqa: F401  (registers the link-layer types)
+    from src.realtime.feature_extractor import parse_packet
+    packet = conf.l2types.get(linktype, Raw)(bytes(frame))
+    packet.time = ts
+    return parse_packet(packet)
+
+
+def decode_or_fallback(frame, ts, linktype=LINKTYPE_ETHERNET, stats=None):
+    fields = decode_frame(frame, ts, linktype)
+    if fields is FALLBACK:
+        if stats is not None:
+            stats['fallback'] = stats.get('fallback', 0) + 1
+        return scapy_decode(frame, ts, linktype)
+    return fields
+
+
+def _read_pcap(view, big_endian, nanosecond):
+    endian = '>' if big_endian else '<'
+    linktype = struct.unpack_from(endian + 'I', view, 20)[0] & 0x0FFFFFFF
+    record = struct.Struct(endian + 'IIII')
+    scale = 1000000000 if nanosecond else 1000000
+    offset = 24
+    end = len(view)
+    while offset + 16 <= end:
+        sec, frac, caplen, _ = record.unpack_from(view, offset)
+        offset += 16
+        yield sec + frac / scale, view[offset:offset + caplen], linktype
+        offset += caplen
+
+
+def _read_pcapng(view):
+    end = len(view)
+    offset = 0
+    endian = '<'
+    interfaces = []  # (linktype, timestamp units per second) per interface id
+    while offset + 12 <= end:
+        if struct.unpack_from('<I', view, offset)[0] == 0x0A0D0D0A:
+            # Section header: byte-order magic decides the endianness of the section
+            endian = '<' if struct.unpack_from('<I', view, offset + 8)[0] == 0x1A2B3C4D else '>'
+            interfaces = []
+        block_type, block_len = struct.unpack_from(endian + 'II', view, offset)
+        if block_len < 12:
+            break
+        if block_type == 1:  # interface description
+            linktype = struct.unpack_from(endian + 'H', view, offset + 8)[0]
+            units = 1000000
+            opt = offset + 16
+            while opt + 4 <= offset + block_len - 4:
+                code, length = struct.unpack_from(endian + 'HH', view, opt)
+                if code == 0:
+                    break
+                if code == 9:  # if_tsresol
+                    value = view[opt + 4]
+                    units = 2 ** (value & 0x7F) if value & 0x80 else 10 ** value
+                opt += 4 + (length + 3) // 4 * 4
+            interfaces.append((linktype, units))
+        elif block_type == 6:  # enhanced packet
+            iface, ts_high, ts_low, caplen = struct.unpack_from(endian + 'IIII', view, offset + 8)
+            linktype, units = interfaces[iface] if iface < len(interfaces) else (LINKTYPE_ETHERNET, 1000000)
+            data = offset + 28
+            yield ((ts_high << 32) | ts_low) / units, view[data:data + caplen], linktype
+        elif block_type == 3:  # simple packet (no timestamp)
+            linktype = interfaces[0][0] if interfaces else LINKTYPE_ETHERNET
+            caplen = min(struct.unpack_from(endian + 'I', view, offset + 8)[0], block_len - 16)
+            yield 0.0, view[offset + 12:offset + 12 + caplen], linktype
+        offset += block_len
+
+
+def read_frames(path):
+    """
+    Yield (ts, frame, linktype) for every record of a pcap or pcapng file. The file
+    is memory-mapped and frames are memoryview slices of it, valid until the
+    generator is closed.
+    """
+    with open(path, 'rb') as f:
+        if not f.read(1):
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        magic = bytes(view[:4])
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4', b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d'):
+            yield from _read_pcap(view, magic[0] == 0xa1, magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d'))
+        elif magic == b'\x0a\x0d\x0d\x0a':
+            yield from _read_pcapng(view)
+        else:
+            raise ValueError(f"{path} is not a pcap or pcapng file.")
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            pass  # a caller still holds a frame view; the map goes with it
+
+
+# AF_PACKET hardware types -> link-layer decoding
+HATYPE_LINKTYPES = {1: LINKTYPE_ETHERNET, ARPHRD_LOOPBACK: LINKTYPE_ETHERNET, 0xFFFE: LINKTYPE_RAW, 0xFFFF: LINKTYPE_RAW}
+
+
+class AfPacketSource:
+    """
+    Raw frames from Linux AF_PACKET sockets (needs CAP_NET_RAW). Every frame is
+    received into one preallocated buffer with recvfrom_into, so reading does not
+    allocate per packet; the memoryview handed out is only valid until the next
+    read. An optional classic BPF program (list of (code, jt, jf, k), e.g. from
+    capture._snaplen_program) is attached in the kernel. Without interfaces one
+    socket listens on all of them. Loopback hands every frame to the socket twice,
+    as sent and as received, so the sent copy is dropped there.
+    """
+
+    def __init__(self, interfaces=None, program=None, buffer_size=65536):
+        if not sys.platform.startswith('linux'):
+            raise OSError("AF_PACKET capture is only available on Linux.")
+        from src.realtime.capture import _attach_program
+        self.sockets = []
+        try:
+            for iface in interfaces or [None]:
+                sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+                self.sockets.append(sock)
+                if iface:
+                    sock.bind((iface, 0))
+                if program:
+                    _attach_program(sock, program)
+                sock.setblocking(False)
+        except Exception:
+            self.close()
+            raise
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+
+    def frames(self, stop_event, poll_interval=0.2, idle=False):
+        """
+        Yield (ts, frame, linktype) until stop_event is set. With idle, a poll
+        interval without any frame yields (now, None, None).
+        """
+        buffer, view = self.buffer, self.view
+        while not stop_event.is_set():
+            readable, _, _ = select.select(self.sockets, [], [], poll_interval)
+            if idle and not readable:
+                yield time.time(), None, None
+            for sock in readable:
+                while True:
+                    try:
+                        n, address = sock.recvfrom_into(buffer)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    if address[2] == PACKET_OUTGOING and address[3] == ARPHRD_LOOPBACK:
+                        continue
+                    linktype = HATYPE_LINKTYPES.get(address[3])
+                    if linktype is not None:
+                        yield time.time(), view[:n], linktype
+
+    def close(self):
+        for sock in self.sockets:
+            sock.close()
+        self.sockets = []
+
+
+def benchmark(path, repeat=3):
+    """Packets/s of the fast decoder vs scapy's PcapReader + parse_packet on one file."""
+    from scapy.utils import PcapReader
+    from src.realtime.feature_extractor import parse_packet
+
+    def fast():
+        stats = {}
+        return [decode_or_fallback(frame, ts, linktype, stats) for ts, frame, linktype in read_frames(path)], stats
+
+    def slow():
+        with PcapReader(path) as reader:
+            return [parse_packet(packet) for packet in reader]
+
+    def best_time(run):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    fast_seconds, (fast_fields, stats) = best_time(fast)
+    slow_seconds, slow_fields = best_time(slow)
+    # Timestamps go through float either way; compare everything else exactly
+    mismatches = sum(a is None and b is not None or b is None and a is not None or
+                     (a is not None and (a[1:] != b[1:] or abs(a[0] - b[0]) > 1e-6))
+                     for a, b in zip(fast_fields, slow_fields))
+    n = len(slow_fields)
+    return {
+        'packets': n,
+        'fast_packets_per_s': n / fast_seconds,
+        'scapy_packets_per_s': n / slow_seconds,
+        'speedup': slow_seconds / fast_seconds,
+        'fallbacks': stats.get('fallback', 0),
+        'mismatches': mismatches + abs(len(fast_fields) - n),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the raw-bytes decoder against scapy.")
+    parser.add_argument('pcap', help="pcap or pcapng file")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    for name, value in benchmark(args.pcap, args.repeat).items():
+        print(f"{name:<22}{value:,.1f}" if isinstance(value, float) else f"{name:<22}{value:,}")
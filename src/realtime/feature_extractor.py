@@ -1,3 +1,9 @@
+from scapy.layers.inet import IP, TCP, UDP, ICMP
+from scapy.layers.inet6 import IPv6
+from src.preprocessing import feature_cols
+
+FEATURE_INDEX = {name: i for i, name in enumerate(feature_cols)}
+
 def extract_features(packet):
     """
     Attempt to extract as many NSL-KDD features as possible from a single packet.
@@ -62,3 +68,74 @@ def extract_features(packet):
     except Exception as e:
         print(f"Feature extraction error: {e}")
         return None
+
+
+def parse_packet(packet):
+    """
+    Pull the header fields the flow table needs out of a scapy packet.
+    Returns (ts, proto, src, sport, dst, dport, payload_len, tcp_flags), or None for
+    frames that are not TCP/UDP/ICMP over IP. For ICMP, sport carries the ICMP type.
+    """
+    if IP in packet:
+        ip = packet[IP]
+        # Transport bytes from the IP header, so frames cut short by a capture snaplen
+        # (or padded by Ethernet) still count their real size
+        l4_len = ip.len - 4 * ip.ihl if ip.len is not None and ip.ihl is not None else None
+    elif IPv6 in packet:
+        ip = packet[IPv6]
+        l4_len = ip.plen if ip.nh in (6, 17) else None  # no extension headers in between
+    else:
+        return None
+    ts = float(packet.time)
+
+    if TCP in packet:
+        l4 = packet[TCP]
+        header = 4 * l4.dataofs if l4.dataofs else 20
+        payload_len = max(l4_len - header, 0) if l4_len is not None else len(l4.payload)
+        return ts, 6, ip.src, l4.sport, ip.dst, l4.dport, payload_len, int(l4.flags)
+    if UDP in packet:
+        l4 = packet[UDP]
+        payload_len = max(l4_len - 8, 0) if l4_len is not None else len(l4.payload)
+        return ts, 17, ip.src, l4.sport, ip.dst, l4.dport, payload_len, 0
+    if ICMP in packet:
+        l4 = packet[ICMP]
+        payload_len = max(l4_len - 8, 0) if l4_len is not None else len(l4.payload)
+        return ts, 1, ip.src, l4.type, ip.dst, 0, payload_len, 0
+    return None
+
+def tcp_segment(packet, payload_len):
+    """
+    (sequence number, payload bytes, payload length) of a scapy TCP packet whose
+    parse_packet() payload length is given, or None (see fast_decode.tcp_segment).
+    """
+    if TCP not in packet:
+        return None
+    l4 = packet[TCP]
+    # Cut at the length from the IP header: the payload may carry Ethernet padding
+    return l4.seq, bytes(l4.payload)[:payload_len], payload_len
+
+def extract_connection_features(conn, traffic_stats=None, content=None):
+    """
+    Build the 41 NSL-KDD features for one completed connection from the flow table
+    (see flow_table.Connection). If a TrafficStats instance is given, the connection
+    is added to it and the time- and host-based window features are filled in.
+    content holds the connection's content features from payload inspection
+    (see payload_inspection), if any. Features that are not tracked stay 0.
+    """
+    features = [0] * len(feature_cols)
+    features[FEATURE_INDEX['duration']] = int(conn.duration)
+    features[FEATURE_INDEX['protocol_type']] = conn.protocol_type
+    features[FEATURE_INDEX['service']] = conn.service
+    features[FEATURE_INDEX['flag']] = conn.flag
+    features[FEATURE_INDEX['src_bytes']] = conn.src_bytes
+    features[FEATURE_INDEX['dst_bytes']] = conn.dst_bytes
+    features[FEATURE_INDEX['land']] = conn.land
+    features[FEATURE_INDEX['wrong_fragment']] = conn.wrong_fragment
+    features[FEATURE_INDEX['urgent']] = conn.urgent
+    if traffic_stats is not None:
+        for name, value in traffic_stats.update(conn).items():
+            features[FEATURE_INDEX[name]] = value
+    if content:
+        for name, value in content.items():
+            features[FEATURE_INDEX[name]] = value
+    return features
@@ -0,0 +1,255 @@
+import heapq
+from array import array
+from collections import namedtuple
+from src.realtime.services import PROTOCOL_NAMES, lookup_service
+
+# TCP header flag bits
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+PSH = 0x08
+ACK = 0x10
+URG = 0x20
+
+# Per-flow TCP state bits
+ORIG_SYN = 0x01
+RESP_SYNACK = 0x02
+ORIG_FIN = 0x04
+RESP_FIN = 0x08
+ORIG_RST = 0x10
+RESP_RST = 0x20
+
+# One completed connection, ready for feature extraction. emitted is the table's
+# clock when it completed: idle flows end long before they are emitted.
+Connection = namedtuple('Connection', [
+    'start', 'duration', 'protocol_type', 'service', 'flag',
+    'src', 'sport', 'dst', 'dport', 'src_bytes', 'dst_bytes',
+    'land', 'wrong_fragment', 'urgent', 'emitted',
+])
+
+
+def is_closed(state):
+    """A flow is closed once either side reset it or both sides sent FIN."""
+    if state & (ORIG_RST | RESP_RST):
+        return True
+    return state & (ORIG_FIN | RESP_FIN) == (ORIG_FIN | RESP_FIN)
+
+
+def tcp_flag(state):
+    """Map the accumulated TCP state bits of a flow to its NSL-KDD connection flag."""
+    if not state & ORIG_SYN:
+        return 'OTH'
+    if state & ORIG_RST:
+        return 'RSTO' if state & RESP_SYNACK else 'RSTOS0'
+    if state & RESP_RST:
+        return 'RSTR' if state & RESP_SYNACK else 'REJ'
+    if not state & RESP_SYNACK:
+        return 'SH' if state & ORIG_FIN else 'S0'
+    if state & ORIG_FIN and state & RESP_FIN:
+        return 'SF'
+    if state & ORIG_FIN:
+        return 'S2'
+    if state & RESP_FIN:
+        return 'S3'
+    return 'S1'
+
+
+class FlowTable:
+    """
+    Bidirectional connection table keyed by the normalized 5-tuple.
+
+    Flow state lives in fixed-capacity typed arrays indexed by slot number (one
+    slot per live flow, recycled through a free list), so memory stays bounded at
+    max_flows no matter how many addresses are seen. Expiry is driven by a heap of
+    (deadline, slot, generation) entries: only flows whose deadline has passed are
+    touched, and entries are re-armed lazily when a flow saw traffic after the
+    entry was pushed. A flow ends after idle_timeout seconds without packets, or
+    close_timeout seconds after FIN/RST from both sides (or any RST).
+    When the table is full the flow with the earliest deadline is emitted early.
+    Entries of emitted flows stay in the heap until their deadline comes up, so
+    once it holds COMPACT_FACTOR * max_flows entries it is rebuilt from the live
+    flows alone; a flood of short connections cannot grow it past that.
+    """
+
+    # Heap entries per flow slot before the heap is rebuilt from the live flows
+    COMPACT_FACTOR = 2
+
+    def __init__(self, max_flows=500000, idle_timeout=60.0, close_timeout=1.0):
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.close_timeout = close_timeout
+
+        self.slots = {}                  # normalized key -> slot
+        self.keys = [None] * max_flows   # slot -> normalized key
+        self.free = list(range(max_flows - 1, -1, -1))
+        self.expiry = []                 # heap of (deadline, slot, generation)
+
+        self.start = array('d', bytes(8 * max_flows))
+        self.last = array('d', bytes(8 * max_flows))
+        self.orig_bytes = array('Q', bytes(8 * max_flows))
+        self.resp_bytes = array('Q', bytes(8 * max_flows))
+        self.generation = array('I', bytes(4 * max_flows))
+        self.urgent = array('I', bytes(4 * max_flows))
+        self.wrong_fragment = array('I', bytes(4 * max_flows))
+        self.state = array('B', bytes(max_flows))
+        self.orig_is_first = array('B', bytes(max_flows))  # 1 if the originator is key[1]
+
+        self.emitted = 0
+        self.forced = 0
+        self.compactions = 0
+        self.clock = 0.0                 # latest time seen; never goes back
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _deadline(self, slot):
+        timeout = self.close_timeout if is_closed(self.state[slot]) else self.idle_timeout
+        return self.last[slot] + timeout
+
+    def update(self, ts, proto, src, sport, dst, dport, payload_len, tcp_flags=0, wrong_fragment=0):
+        """
+        Account one packet to its flow and return the connections that completed
+        up to time ts (possibly empty). For ICMP, pass the ICMP type as sport and 0 as dport.
+        """
+        completed = self.expire(ts)
+
+        a = (src, sport)
+        b = (dst, dport)
+        key = (proto, a, b) if a <= b else (proto, b, a)
+        slot = self.slots.get(key)
+
+        if slot is None:
+            if not self.free:
+                completed.append(self._evict_earliest())
+            slot = self.free.pop()
+            self.slots[key] = slot
+            self.keys[slot] = key
+            self.generation[slot] = (self.generation[slot] + 1) & 0xFFFFFFFF
+            self.start[slot] = ts
+            self.orig_bytes[slot] = 0
+            self.resp_bytes[slot] = 0
+            self.urgent[slot] = 0
+            self.wrong_fragment[slot] = 0
+            self.state[slot] = 0
+            # A SYN-ACK as the first packet means we missed the SYN: the sender is the responder
+            from_responder = proto == 6 and tcp_flags & (SYN | ACK) == (SYN | ACK)
+            self.orig_is_first[slot] = (key[1] == a) != from_responder
+            self._push(ts + self.idle_timeout, slot)
+
+        self.last[slot] = ts
+        from_orig = (key[1] == a) == bool(self.orig_is_first[slot])
+        if from_orig:
+            self.orig_bytes[slot] += payload_len
+        else:
+            self.resp_bytes[slot] += payload_len
+        if wrong_fragment:
+            self.wrong_fragment[slot] += 1
+
+        if proto == 6 and tcp_flags:
+            state = self.state[slot]
+            if tcp_flags & URG:
+                self.urgent[slot] += 1
+            if from_orig:
+                if tcp_flags & SYN and not tcp_flags & ACK:
+                    state |= ORIG_SYN
+                if tcp_flags & FIN:
+                    state |= ORIG_FIN
+                if tcp_flags & RST:
+                    state |= ORIG_RST
+            else:
+                if tcp_flags & SYN and tcp_flags & ACK:
+                    state |= RESP_SYNACK
+                if tcp_flags & FIN:
+                    state |= RESP_FIN
+                if tcp_flags & RST:
+                    state |= RESP_RST
+            if state != self.state[slot]:
+                was_closed = is_closed(self.state[slot])
+                self.state[slot] = state
+                if not was_closed and is_closed(state):
+                    # The deadline just got shorter; lazy re-arming only ever extends, so push it
+                    self._push(self._deadline(slot), slot)
+
+        return completed
+
+    def _push(self, deadline, slot):
+        if len(self.expiry) >= self.COMPACT_FACTOR * self.max_flows:
+            self._compact()
+        heapq.heappush(self.expiry, (deadline, slot, self.generation[slot]))
+
+    def _compact(self):
+        """Drop stale heap entries: one entry per live flow, at its current deadline."""
+        generation = self.generation
+        self.expiry = [(self._deadline(slot), slot, generation[slot]) for slot in self.slots.values()]
+        heapq.heapify(self.expiry)
+        self.compactions += 1
+
+    def originator(self, key):
+        """(address, port) that opened the live flow with this normalized key, or None."""
+        slot = self.slots.get(key)
+        if slot is None:
+            return None
+        return key[1] if self.orig_is_first[slot] else key[2]
+
+    def expire(self, now):
+        """Emit every flow whose idle or close deadline is at or before now."""
+        if now > self.clock:
+            self.clock = now
+        completed = []
+        expiry = self.expiry
+        while expiry and expiry[0][0] <= now:
+            deadline, slot, generation = heapq.heappop(expiry)
+            if generation != self.generation[slot] or self.keys[slot] is None:
+                continue  # stale entry for a recycled or already emitted slot
+            actual = self._deadline(slot)
+            if actual > now:
+                # Flow saw traffic since this entry was pushed; re-arm it
+                heapq.heappush(expiry, (actual, slot, generation))
+                continue
+            completed.append(self._emit(slot))
+        return completed
+
+    def flush(self):
+        """Emit all live flows (e.g. at the end of a capture)."""
+        completed = [self._emit(slot) for slot in list(self.slots.values())]
+        self.expiry = []
+        return completed
+
+    def _evict_earliest(self):
+        while True:
+            deadline, slot, generation = heapq.heappop(self.expiry)
+            if generation == self.generation[slot] and self.keys[slot] is not None:
+                self.forced += 1
+                return self._emit(slot)
+
+    def _emit(self, slot):
+        key = self.keys[slot]
+        proto, first, second = key
+        orig, resp = (first, second) if self.orig_is_first[slot] else (second, first)
+        protocol_type = PROTOCOL_NAMES.get(proto, str(proto))
+
+        if protocol_type == 'tcp':
+            flag = tcp_flag(self.state[slot])
+        else:
+            flag = 'SF'
+
+        conn = Connection(
+            start=self.start[slot],
+            duration=self.last[slot] - self.start[slot],
+            protocol_type=protocol_type,
+            service=lookup_service(protocol_type, orig[1], resp[1]),
+            flag=flag,
+            src=orig[0], sport=orig[1], dst=resp[0], dport=resp[1],
+            src_bytes=self.orig_bytes[slot],
+            dst_bytes=self.resp_bytes[slot],
+            land=1 if orig == resp else 0,
+            wrong_fragment=self.wrong_fragment[slot],
+            urgent=self.urgent[slot],
+            emitted=self.clock,
+        )
+
+        del self.slots[key]
+        self.keys[slot] = None
+        self.free.append(slot)
+        self.emitted += 1
+        return conn
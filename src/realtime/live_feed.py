@@ -0,0 +1,164 @@
+"""
+Server-sent event feed of live results, shared by every dashboard tab.
+
+One producer thread reads the ResultsStore once per tick and turns it into a
+single pre-encoded event: the newest result lines and the per-second counts of
+normal / intrusion / error predictions. All connected clients are woken with
+that same byte string, so adding a tab costs one idle thread and one socket
+write per second, not a store read and re-render.
+
+The per-second counts are also kept for history_seconds. A client asking for a
+long window first gets a snapshot of that history downsampled on the server to
+at most MAX_POINTS buckets (computed once per tick and window, whoever asks),
+then folds the per-second ticks into the last bucket itself.
+
+    GET /live/stream?window=300      text/event-stream: one snapshot, then ticks
+"""
+import json
+import threading
+import time
+from collections import deque
+
+# Ticks kept for clients that briefly fall behind; older ones get a fresh snapshot
+REPLAY_TICKS = 30
+MAX_POINTS = 300
+GROUPS = ('normal', 'intrusion', 'error')
+
+
+def label_group(label):
+    if label == 'normal' or label == 'error':
+        return label
+    return 'intrusion'
+
+
+def sse_event(kind, payload, seq=None):
+    """One text/event-stream message as bytes."""
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {kind}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n".encode()
+
+
+class LiveFeed:
+    """
+    Aggregates a ResultsStore into per-second events for any number of SSE
+    clients. The producer thread starts with the first subscriber.
+    """
+
+    def __init__(self, store, interval=1.0, history_seconds=3600, max_lines=15):
+        self.store = store
+        self.interval = interval
+        self.max_lines = max_lines
+        self._history = deque(maxlen=int(history_seconds))
+        self._recent = deque(maxlen=max_lines)
+        self._events = deque(maxlen=REPLAY_TICKS)
+        self._condition = threading.Condition()
+        self._seq = 0
+        self._cursor = store.cursor()
+        self._totals = dict.fromkeys(GROUPS, 0)
+        self._series_cache = {}
+        self._thread = None
+        self.clients = 0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_tick = time.time()
+        while True:
+            next_tick += self.interval
+            time.sleep(max(0.0, next_tick - time.time()))
+            try:
+                self.tick(int(next_tick))
+            except Exception as e:
+                print(f"Live feed error: {e}")
+
+    def _counts_since_last_tick(self):
+        totals = dict.fromkeys(GROUPS, 0)
+        for label, count in self.store.counters()['by_label'].items():
+            totals[label_group(label)] += count
+        counts = {}
+        for group in GROUPS:
+            delta = totals[group] - self._totals[group]
+            # The store was cleared (new capture): everything counted now is new
+            counts[group] = delta if delta >= 0 else totals[group]
+        self._totals = totals
+        return counts
+
+    def tick(self, second):
+        """Aggregate everything stored since the last tick into one event and wake the clients."""
+        entries, self._cursor = self.store.read_since(self._cursor, limit=self.max_lines)
+        counts = self._counts_since_last_tick()
+        with self._condition:
+            self._history.append((second, counts))
+            self._recent.extend(str(entry) for entry in entries)
+            self._seq += 1
+            self._series_cache.clear()
+            event = sse_event('tick', {'t': second * 1000, 'counts': counts,
+                                       'lines': [str(entry) for entry in entries]}, self._seq)
+            self._events.append((self._seq, event))
+            self._condition.notify_all()
+
+    def series(self, window, max_points=MAX_POINTS):
+        """
+        Per-second rates over the last `window` seconds, summed into buckets so
+        there are at most max_points of them. Returns the bucket width too.
+        """
+        with self._condition:
+            key = (window, max_points)
+            cached = self._series_cache.get(key)
+            if cached is not None:
+                return cached
+            history = list(self._history)
+        bucket = max(1, -(-window // max_points))
+        points = {}
+        if history:
+            since = history[-1][0] - window
+            for second, counts in history:
+                if second <= since:
+                    continue
+                sums = points.setdefault(second - second % bucket, dict.fromkeys(GROUPS, 0))
+                for group, count in counts.items():
+                    sums[group] += count
+        starts = sorted(points)
+        series = {'bucket': bucket, 'window': window, 't': [start * 1000 for start in starts]}
+        for group in GROUPS:
+            series[group] = [points[start][group] / bucket for start in starts]
+        with self._condition:
+            self._series_cache[key] = series
+        return series
+
+    def snapshot(self, window):
+        with self._condition:
+            seq = self._seq
+            lines = list(self._recent)
+        return seq, sse_event('snapshot', {'series': self.series(window), 'lines': lines}, seq)
+
+    def stream(self, window=300, heartbeat=15.0):
+        """Generator of SSE bytes for one client: a snapshot, then every tick as it happens."""
+        self.start()
+        window = max(10, min(int(window), self._history.maxlen))
+        seq, event = self.snapshot(window)
+        with self._condition:
+            self.clients += 1
+        try:
+            yield f"retry: {int(self.interval * 3000)}\n".encode() + event
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._seq > seq, timeout=heartbeat)
+                    pending = [(s, e) for s, e in self._events if s > seq]
+                    missed = bool(pending) and pending[0][0] > seq + 1
+                if not pending:
+                    yield b": keep-alive\n\n"
+                elif missed:
+                    # Fell further behind than the replay buffer: start over from a snapshot
+                    seq, event = self.snapshot(window)
+                    yield event
+                else:
+                    seq = pending[-1][0]
+                    yield b''.join(e for _, e in pending)
+        finally:
+            with self._condition:
+                self.clients -= 1
@@ -0,0 +1,289 @@
+"""
+Offline scoring of pcap/pcapng captures through the live extract -> preprocess -> predict path.
+
+Packets are streamed from disk (never the whole capture in memory, unlike rdpcap),
+aggregated into connections by the same FlowTable/TrafficStats the live sniffer
+uses, and scored in large batches. One prediction per connection is written to
+CSV or NDJSON, and a throughput report is printed at the end.
+
+    python -m src.realtime.offline capture1.pcap capture2.pcapng -o predictions.csv --workers 4
+
+Several files are read in order as one capture. With --workers N, N processes
+each stream every file but only track the flows (and inspect the payloads) whose
+5-tuple hash falls in their shard, which is where the per-packet work goes.
+Every packet still advances each shard's flow table clock, so connections
+complete exactly when a single table would complete them. The parent merges the
+shards' connections back in one order and runs them through a single
+TrafficStats before scoring, so the traffic features (count, srv_count, the
+*_rate and dst_host_* windows) and the predictions do not depend on --workers.
+The only exception is a capture with more concurrent flows than a flow table
+holds (500000), where the shards evict different flows early.
+"""
+import argparse
+import csv
+import json
+import heapq
+import multiprocessing as mp
+import time
+import warnings
+from collections import Counter
+from src import model_registry
+from src.realtime.fast_decode import decode_or_fallback, read_frames
+from src.realtime.feature_extractor import extract_connection_features
+from src.realtime.flow_table import FlowTable
+from src.realtime.payload_inspection import PayloadInspector
+from src.realtime.pipeline import flow_shard
+from src.realtime.traffic_stats import TrafficStats
+warnings.filterwarnings("ignore", category=UserWarning)
+
+OUTPUT_FIELDS = ['start', 'src', 'sport', 'dst', 'dport', 'protocol_type', 'service', 'flag',
+                 'duration', 'src_bytes', 'dst_bytes', 'prediction']
+STAGES = ['read', 'extract', 'preprocess', 'predict', 'write']
+
+
+class PredictionWriter:
+    """Streams per-connection predictions to CSV or NDJSON."""
+
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        self.file = open(path, 'w', newline='')
+        if fmt == 'csv':
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(OUTPUT_FIELDS)
+
+    def write(self, connections, predictions):
+        if self.fmt == 'csv':
+            self.writer.writerows(
+                [c.start, c.src, c.sport, c.dst, c.dport, c.protocol_type, c.service, c.flag,
+                 c.duration, c.src_bytes, c.dst_bytes, p]
+                for c, p in zip(connections, predictions))
+        else:
+            self.file.writelines(
+                json.dumps(dict(zip(OUTPUT_FIELDS, [c.start, c.src, c.sport, c.dst, c.dport, c.protocol_type,
+                                                    c.service, c.flag, c.duration, c.src_bytes, c.dst_bytes,
+                                                    str(p)]))) + '\n'
+                for c, p in zip(connections, predictions))
+
+    def close(self):
+        self.file.close()
+
+
+def _conn_order(conn):
+    # Connections emitted at the same clock come out of the flow table in slot
+    # order; this order does not depend on which table (or shard) held them
+    return (conn.emitted, conn.start + conn.duration, conn.start, conn.protocol_type,
+            conn.src, conn.sport, conn.dst, conn.dport)
+
+
+def track_flows(paths, stats, stage_time, shard=0, n_shards=1, inspect=True):
+    """
+    Yield (connection, content features or None) for every flow of the captures
+    with flow_shard(...) == shard, ordered by _conn_order. Every packet still
+    advances the shard's flow table clock, so a flow completes at the same packet
+    and emission time whatever n_shards is. Counts go to stats, seconds per stage
+    to stage_time.
+    """
+    flow_table = FlowTable()
+    inspector = PayloadInspector(flow_table) if inspect else None
+    group = []       # emitted connections not yet yielded
+
+    def emit(connections):
+        for conn in connections:
+            group.append((conn, inspector.pop(conn) if inspector is not None else None))
+
+    def completed(clock=float('inf')):
+        # Connections emitted before clock: no later packet can emit one that sorts before them
+        group.sort(key=lambda item: _conn_order(item[0]))
+        n = 0
+        while n < len(group) and group[n][0].emitted < clock:
+            n += 1
+        done = group[:n]
+        del group[:n]
+        return done
+
+    decode_stats = {}
+    for path in paths:
+        # Header fields are decoded straight from the memory-mapped file; scapy only
+        # dissects the frames the fast decoder cannot handle (see fast_decode)
+        frames = read_frames(path)
+        while True:
+            t0 = time.perf_counter()
+            frame = next(frames, None)
+            if frame is None:
+                break
+            fields = decode_or_fallback(frame[1], frame[0], frame[2], decode_stats)
+            t1 = time.perf_counter()
+            stage_time['read'] += t1 - t0
+            stats['packets'] += 1
+            if fields is None:
+                stats['skipped'] += 1
+                continue
+            if n_shards > 1 and flow_shard(*fields[1:6], n_shards) != shard:
+                emit(flow_table.expire(fields[0]))
+            else:
+                emit(flow_table.update(*fields))
+                if inspector is not None:
+                    inspector.inspect(fields, frame[1], frame[2])
+            stage_time['extract'] += time.perf_counter() - t1
+            if group and group[0][0].emitted < flow_table.clock:
+                yield from completed(flow_table.clock)
+    stats['scapy_fallbacks'] = decode_stats.get('fallback', 0)
+
+    t0 = time.perf_counter()
+    emit(flow_table.flush())
+    stage_time['extract'] += time.perf_counter() - t0
+    yield from completed()
+    if inspector is not None:
+        stats['inspection'] = inspector.stats()
+
+
+def _new_stats():
+    return {'packets': 0, 'skipped': 0, 'flows': 0}, dict.fromkeys(STAGES, 0.0)
+
+
+def _shard_worker(paths, shard, n_shards, inspect, batch_size, queue):
+    # Streams this shard's connections to the parent in batches, then its stats
+    try:
+        stats, stage_time = _new_stats()
+        batch = []
+        for item in track_flows(paths, stats, stage_time, shard, n_shards, inspect):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                queue.put(batch)
+                batch = []
+        if batch:
+            queue.put(batch)
+        stats['stage_seconds'] = stage_time
+        queue.put(stats)
+    except Exception as e:
+        queue.put(e)
+
+
+def _received(queue, results):
+    while True:
+        item = queue.get()
+        if isinstance(item, Exception):
+            raise item
+        if isinstance(item, dict):
+            results.append(item)
+            return
+        yield from item
+
+
+def score_pcaps(paths, out_path, fmt='csv', workers=1, batch_size=4096, inspect=True):
+    """
+    Stream the given capture files, in order, through flow extraction and the
+    model, and write one prediction per connection to out_path. With workers > 1,
+    each worker process tracks one 5-tuple shard of the flows; their connections
+    are merged back in one order and go through a single TrafficStats here, so the
+    output does not depend on workers. With inspect, TCP payloads fill the content
+    features (see payload_inspection). Returns a stats dict with packet/flow
+    counts and seconds spent per stage (summed over processes).
+    """
+    model = model_registry.get_batch_model()
+    preprocessor = model_registry.get_preprocessor()
+    traffic_stats = TrafficStats()
+    writer = PredictionWriter(out_path, fmt)
+
+    stats, stage_time = _new_stats()
+    pending_conns = []
+    pending_rows = []
+
+    def score_pending():
+        t0 = time.perf_counter()
+        X = preprocessor.transform(pending_rows)
+        t1 = time.perf_counter()
+        predictions = model.predict(X)
+        t2 = time.perf_counter()
+        writer.write(pending_conns, predictions)
+        t3 = time.perf_counter()
+        stage_time['preprocess'] += t1 - t0
+        stage_time['predict'] += t2 - t1
+        stage_time['write'] += t3 - t2
+        stats['flows'] += len(pending_conns)
+        pending_conns.clear()
+        pending_rows.clear()
+
+    processes, results = [], []
+    if workers <= 1:
+        connections = track_flows(paths, stats, stage_time, inspect=inspect)
+    else:
+        ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+        queues = [ctx.Queue(maxsize=16) for _ in range(workers)]
+        processes = [ctx.Process(target=_shard_worker, args=(paths, shard, workers, inspect, batch_size, queue),
+                                 daemon=True)
+                     for shard, queue in enumerate(queues)]
+        for process in processes:
+            process.start()
+        # Each shard's stream is already in _conn_order: merging keeps it
+        connections = heapq.merge(*[_received(queue, results) for queue in queues],
+                                  key=lambda item: _conn_order(item[0]))
+
+    try:
+        for conn, content in connections:
+            t0 = time.perf_counter()
+            pending_conns.append(conn)
+            pending_rows.append(extract_connection_features(conn, traffic_stats, content))
+            stage_time['extract'] += time.perf_counter() - t0
+            if len(pending_conns) >= batch_size:
+                score_pending()
+        if pending_conns:
+            score_pending()
+    finally:
+        writer.close()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    for r in results:
+        # Every worker reads every packet; count each packet once
+        stats['packets'] = max(stats['packets'], r['packets'])
+        stats['skipped'] = max(stats['skipped'], r['skipped'])
+        stats['scapy_fallbacks'] = max(stats.get('scapy_fallbacks', 0), r['scapy_fallbacks'])
+        for stage, seconds in r['stage_seconds'].items():
+            stage_time[stage] += seconds
+        if 'inspection' in r:
+            merged = stats.setdefault('inspection', {'inspected_bytes': 0, 'skipped_port_bytes': 0,
+                                                     'indicators': Counter()})
+            merged['inspected_bytes'] += r['inspection']['inspected_bytes']
+            merged['skipped_port_bytes'] += r['inspection']['skipped_port_bytes']
+            merged['indicators'].update(r['inspection']['indicators'])
+    stats['stage_seconds'] = stage_time
+    return stats
+
+
+def print_report(stats, elapsed):
+    print(f"Packets: {stats['packets']}  Connections: {stats['flows']}  Wall time: {elapsed:.2f}s")
+    print(f"Throughput: {stats['packets'] / elapsed:,.0f} packets/s, {stats['flows'] / elapsed:,.0f} flows/s")
+    total = sum(stats['stage_seconds'].values()) or 1.0
+    print("Per-stage CPU time (summed over processes):")
+    for stage, seconds in stats['stage_seconds'].items():
+        print(f"  {stage:<11}{seconds:9.3f}s  {100 * seconds / total:5.1f}%")
+    if 'inspection' in stats:
+        inspection = stats['inspection']
+        found = ', '.join(f"{name} {count}" for name, count in inspection['indicators'].items() if count) or 'none'
+        print(f"Payload inspected: {inspection['inspected_bytes']:,} bytes "
+              f"({inspection['skipped_port_bytes']:,} skipped by port); indicators: {found}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score pcap/pcapng captures offline.")
+    parser.add_argument('pcaps', nargs='+', help="capture files to score")
+    parser.add_argument('-o', '--output', required=True, help="predictions file (.csv or .ndjson)")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default=None,
+                        help="output format (default: from the output extension)")
+    parser.add_argument('--workers', type=int, default=1, help="flow tracking processes (results are the same for any number)")
+    parser.add_argument('--batch-size', type=int, default=4096, help="connections per model.predict call")
+    parser.add_argument('--no-inspect', action='store_true',
+                        help="leave the payload content features (hot, num_failed_logins, ...) at 0")
+    args = parser.parse_args()
+
+    fmt = args.format or ('ndjson' if args.output.endswith(('.ndjson', '.jsonl', '.json')) else 'csv')
+    start = time.perf_counter()
+    stats = score_pcaps(args.pcaps, args.output, fmt, args.workers, args.batch_size, not args.no_inspect)
+    print_report(stats, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,251 @@
-from scapy.all import sniff
-from src.realtime.feature_extractor import extract_features
-from src.preprocessing import preprocess_features
-import joblib
+import argparse
+import itertools
+import threading
+import time
+from src.realtime.capture import CaptureConfig, CaptureSession
+from src.realtime.feature_extractor import parse_packet, extract_connection_features
+from src.realtime.flow_table import FlowTable
+from src.realtime.traffic_stats import TrafficStats
+from src.realtime.batch_inference import BatchInferenceEngine
+from src.realtime.results_store import ResultsStore
+from src.realtime.live_feed import LiveFeed
+from src.realtime.connection_store import ConnectionStore
+from src.realtime.payload_inspection import PayloadInspector
+from src import metrics, model_registry
+from src.explain import describe, explain_records
 import warnings
 warnings.filterwarnings("ignore",category=UserWarning)
-# Shared list for storing live results
-live_results = []
+# Shared bounded store for live results (Dash reads it through a cursor)
+live_results = ResultsStore(capacity=10000)
+# One aggregation of live_results per second, streamed to every dashboard tab
+live_feed = LiveFeed(live_results)
 
-model = joblib.load('models/model.joblib')
-scaler = joblib.load('models/scaler.joblib')
-encoder = joblib.load('models/encoder.joblib')
+# Connections are scored in micro-batches: flush every 256 rows or 5 ms, whichever comes first
+BATCH_SIZE = 256
+BATCH_DELAY = 0.005
+
+# Every scored connection is also kept on disk (see connection_store); opened on first capture.
+# Hourly (or 100k-row) segments, the oldest deleted past HISTORY_SEGMENTS: about two days
+# of history, at most ~40 MiB per segment.
+HISTORY_SEGMENTS = 48
+history = None
+
+def get_history():
+    global history
+    if history is None:
+        history = ConnectionStore(max_segments=HISTORY_SEGMENTS)
+    return history
+
+def handle_prediction(context, pred, explanation=None):
+    conn, features = context
+    if pred is None:
+        error_msg = f"Error scoring connection | Features: {features[:5]}..."
+        live_results.append(error_msg, label='error')
+        print(error_msg)
+        return
+
+    # Format the result for display
+    result_text = f"Connection Prediction: {'Normal' if pred == 'normal' else 'Intrusion'} | Features: {features[:5]}..."
+    if explanation is not None:
+        result_text += f" | {pred}: {describe(explanation, features)}"
+
+    # Add to shared results store (for Dash to read)
+    live_results.append(result_text, label=pred)
+    if history is not None:
+        history.append(conn.start, conn.src, conn.sport, conn.dst, conn.dport, features, pred)
+
+    # Also print to terminal (optional, for debugging)
+    print(result_text)
+
+# Created on first capture so importing this module does not load the model
+inference_engine = None
+
+def get_inference_engine():
+    global inference_engine
+    if inference_engine is None:
+        # Raw feature lists are queued and keyed per batch on the inference worker; the
+        # prediction cache then preprocesses and scores only the unique uncached rows
+        # with the flat-array forest (much faster than sklearn on micro-batches).
+        # Intrusions in each batch are explained together by their path contributions; the
+        # per-node contributions are computed here rather than on the first alert.
+        cache = model_registry.get_prediction_cache()
+        model_registry.get_explainer()
+        inference_engine = BatchInferenceEngine(cache, handle_prediction,
+                                                max_batch_size=BATCH_SIZE, max_delay=BATCH_DELAY,
+                                                preprocess=cache.keys, explain=explain_records)
+    return inference_engine
+
+# Packets are aggregated into connections; one record is scored per completed connection
+flow_table = FlowTable()
+# Sliding-window count/srv_count/dst_host_* statistics over completed connections
+traffic_stats = TrafficStats()
+# hot / num_failed_logins / logged_in / ... counted from TCP payloads (bounded per flow)
+payload_inspector = PayloadInspector(flow_table)
+
+def submit_connections(connections):
+    for conn in connections:
+        features = extract_connection_features(conn, traffic_stats, payload_inspector.pop(conn))
+        # The connection and its raw features travel with the row so the result maps back to them
+        inference_engine.submit(features, (conn, features))
+
+_extract_timer = metrics.stage('extract')
+_extract_calls = itertools.count(1)
 
 def predict_packet(packet):
-    features = extract_features(packet)
-    if features is not None:
-        try:
-            X = preprocess_features(features,encoder, scaler)
-            pred = model.predict([X])[0]
-            
-            # Format the result for display
-            result_text = f"Packet Prediction: {'Intrusion' if pred == 1 else 'Normal'} | Features: {features[:5]}..."
-            
-            # Add to shared results list (for Dash to read)
-            live_results.append(result_text)
-            
-            # Also print to terminal (optional, for debugging)
-            print(result_text)
-            
-        except Exception as e:
-            error_msg = f"Error processing packet: {str(e)}"
-            live_results.append(error_msg)
-            print(error_msg)
-
-def start_live_capture():
-    global live_results
-    # Clear previous results when starting new capture
-    live_results = []
-    print("Starting live packet sniffing (Ctrl+C to stop)...")
-    sniff(prn=predict_packet, store=False)
+    fields = parse_packet(packet)
+    if fields is not None:
+        submit_fields(fields)
+        payload_inspector.inspect_packet(fields, packet)
+
+def expire_idle(now):
+    # Called by the capture session when the link is quiet: flows still end on time
+    submit_connections(flow_table.expire(now))
+
+def submit_fields(fields):
+    # Timed on every SAMPLE_EVERY-th packet to keep the clock reads off most packets
+    if next(_extract_calls) % metrics.SAMPLE_EVERY:
+        submit_connections(flow_table.update(*fields))
+        return
+    start = time.perf_counter()
+    submit_connections(flow_table.update(*fields))
+    _extract_timer.observe(time.perf_counter() - start)
+
+def finish_capture():
+    # Runs once the sniffer has stopped: score the flows still open, then drain the engine
+    submit_connections(flow_table.flush())
+    payload_inspector.clear()
+    inference_engine.stop()
+    if history is not None:
+        history.flush()
+    print(f"Inference stats: {inference_engine.stats()}")
+    print(f"Prediction cache: {model_registry.get_prediction_cache().stats()}")
+
+# The running capture, if any (one per process: it owns flow_table and the engine)
+capture_session = None
+_session_lock = threading.Lock()
+# Packet counts of earlier sessions, so the exported counters never go backwards
+PACKET_OUTCOMES = ('forwarded', 'ignored', 'sampled_out', 'shed_packets', 'errors')
+_previous_packets = dict.fromkeys(PACKET_OUTCOMES + ('packets',), 0)
+
+def start_capture(config=None, inspect=True):
+    """
+    Start capturing in the background with the given CaptureConfig. Returns the
+    session. inspect=False leaves the payload content features at 0.
+    """
+    global capture_session
+    with _session_lock:
+        if capture_session is not None and capture_session.running:
+            return capture_session
+        if capture_session is not None:
+            previous = capture_session.status()
+            for key in _previous_packets:
+                _previous_packets[key] += previous.get(key, 0)
+        # Clear previous results when starting new capture (in place, so importers keep their reference)
+        live_results.clear()
+        engine = get_inference_engine()
+        get_history()
+        engine.start()
+        capture_session = CaptureSession(config or CaptureConfig(), submit_fields,
+                                         backlog=engine.queue_depth, on_stop=finish_capture,
+                                         inspector=payload_inspector if inspect else None,
+                                         on_idle=expire_idle)
+        capture_session.start()
+        print(f"Started live packet sniffing: {capture_session.config.describe()}")
+        return capture_session
+
+def stop_capture():
+    """Stop the running capture (flushing open flows). Returns its final status, or None."""
+    with _session_lock:
+        session = capture_session
+        if session is None:
+            return None
+        session.stop()
+        status = session.status()
+        print(f"Capture stopped: {status}")
+        return status
+
+def capture_status():
+    session = capture_session
+    return session.status() if session is not None else {'running': False}
+
+def collect_metrics():
+    """Scrape-time capture and scoring metrics (see src.metrics)."""
+    status = capture_status()
+    packets = {key: total + status.get(key, 0) for key, total in _previous_packets.items()}
+    families = [
+        ('netid_capture_running', 'gauge', 'Whether a capture is running.', [({}, status['running'])]),
+        ('netid_packets_captured', 'counter', 'Packets read from the capture interfaces.',
+         [({}, packets['packets'])]),
+        ('netid_packets', 'counter', 'Captured packets by outcome (shed: dropped by load shedding).',
+         [({'outcome': outcome.replace('_packets', '')}, packets[outcome]) for outcome in PACKET_OUTCOMES]),
+    ]
+    if 'low_risk_rate' in status:
+        families.append(('netid_low_risk_sample_rate', 'gauge',
+                         'Sample rate the load shedder currently applies to low-risk flows.',
+                         [({}, status['low_risk_rate'])]))
+    engine = inference_engine
+    if engine is not None:
+        stats = engine.stats()
+        families += [
+            ('netid_queue_depth', 'gauge', 'Connections waiting to be scored.', [({}, stats['queue_depth'])]),
+            ('netid_connections', 'counter', 'Connections by scoring outcome (dropped: scoring queue full).',
+             [({'outcome': outcome}, stats[outcome]) for outcome in ('submitted', 'scored', 'dropped', 'errors')]),
+            ('netid_inference_batches', 'counter', 'Micro-batches scored.', [({}, stats['batches'])]),
+        ]
+    inspection = payload_inspector.stats()
+    families += [
+        ('netid_payload_bytes', 'counter', 'TCP payload bytes by inspection outcome.',
+         [({'outcome': outcome}, inspection[f'{outcome}_bytes'])
+          for outcome in ('inspected', 'skipped_port', 'over_cap', 'over_budget', 'untracked')]),
+        ('netid_payload_gaps', 'counter', 'Stream gaps given up on by payload inspection.',
+         [({}, inspection['gaps'])]),
+        ('netid_content_indicators', 'counter', 'Content indicators found in scored connections.',
+         [({'feature': name}, count) for name, count in inspection['indicators'].items()]),
+    ]
+    return families
+
+metrics.register_collector(collect_metrics)
+
+def start_live_capture(config=None, inspect=True):
+    """Capture in the foreground until Ctrl+C."""
+    start_capture(config, inspect)
+    print("Capturing (Ctrl+C to stop)...")
+    try:
+        while capture_session.running:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_capture()
+
+def main():
+    global HISTORY_SEGMENTS
+    parser = argparse.ArgumentParser(description="Live packet capture and scoring.")
+    parser.add_argument('--iface', action='append', help="interface to capture on (repeatable)")
+    parser.add_argument('--filter', default=None, help="BPF capture filter, e.g. 'tcp or udp'")
+    parser.add_argument('--snaplen', type=int, default=None, help="bytes kept per frame (Linux, in-kernel)")
+    parser.add_argument('--sample-rate', type=float, default=1.0, help="fraction of flows to score")
+    parser.add_argument('--decoder', choices=['fast', 'scapy'], default='fast',
+                        help="raw AF_PACKET + header decoder, or scapy's sniffer")
+    parser.add_argument('--no-inspect', action='store_true', help="do not inspect TCP payloads")
+    parser.add_argument('--inspect-bytes', type=int, default=payload_inspector.max_bytes,
+                        help="payload bytes inspected per flow and direction on interactive services")
+    parser.add_argument('--inspect-other-bytes', type=int, default=payload_inspector.other_max_bytes,
+                        help="payload bytes inspected per flow and direction on other services")
+    parser.add_argument('--inspect-packet-bytes', type=int, default=payload_inspector.packet_budget,
+                        help="payload bytes inspected per packet at most")
+    parser.add_argument('--skip-port', type=int, action='append', default=[],
+                        help="never inspect payloads on this port (repeatable; adds to the defaults)")
+    parser.add_argument('--history-segments', type=int, default=HISTORY_SEGMENTS,
+                        help="connection history segments kept on disk (0: keep everything)")
+    args = parser.parse_args()
+    HISTORY_SEGMENTS = args.history_segments or None
+    payload_inspector.max_bytes = args.inspect_bytes
+    payload_inspector.other_max_bytes = args.inspect_other_bytes
+    payload_inspector.packet_budget = args.inspect_packet_bytes
+    payload_inspector.skip_ports |= set(args.skip_port)
+    start_live_capture(CaptureConfig(args.filter, args.iface, args.snaplen, args.sample_rate,
+                                     decoder=args.decoder), inspect=not args.no_inspect)
 
 if __name__ == '__main__':
-    start_live_capture()
+    main()
@@ -0,0 +1,340 @@
+"""
+Payload inspection for the NSL-KDD content features.
+
+Without looking at payloads, hot, num_failed_logins, logged_in, root_shell,
+su_attempted, num_file_creations, num_shells and num_access_files were always 0.
+PayloadInspector follows each TCP connection's two byte streams and counts
+indicator strings per feature: login failures and successes in server replies,
+su / root prompts, shell spawns, file creation commands and access to sensitive
+files.
+
+All patterns of one direction are matched in a single pass by an Aho-Corasick
+automaton compiled to a dense byte-transition table. Its state is carried from
+one segment to the next, so an indicator split across packets (telnet sends a
+keystroke per packet) is still found without buffering the stream. Only
+out-of-order segments are held, up to max_pending bytes per direction; past
+that, the gap is given up and matching restarts after it. Payloads are
+lowercased, and CR / NUL are read as newlines, by one bytes.translate call.
+
+A feature counts at most once per position however many of its patterns end
+there ('/usr/bin/' is not also '/bin/'), and the num_shells patterns never
+overlap, so one shell command is one spawn. Shells are counted in the client's
+stream only: the server's echo of a typed command would count it again.
+
+Scanning runs in Python on the capture thread at roughly 25 MB/s, so its cost is
+bounded per flow and per packet: at most max_bytes are inspected per direction
+on interactive services (INTERACTIVE_PORTS: logins and commands come early in a
+session) and other_max_bytes on the rest, where a request or status line is all
+the patterns look at; at most packet_budget bytes of any one segment are
+scanned; flows on skip_ports (encrypted services and bulk data) are never
+decoded; and at most max_flows flows are tracked.
+"""
+import time
+from collections import deque
+from src import metrics
+
+CONTENT_FEATURES = ('hot', 'num_failed_logins', 'logged_in', 'root_shell', 'su_attempted',
+                    'num_file_creations', 'num_shells', 'num_access_files')
+# 0/1 features in NSL-KDD; the rest are counts
+FLAG_FEATURES = frozenset({'logged_in', 'root_shell'})
+
+# (feature, direction, patterns). orig: client -> server, resp: server -> client.
+# Patterns are lowercase, and '\n' also stands for '\r' and NUL.
+PATTERNS = [
+    ('hot', 'orig', [b'/etc/', b'/bin/', b'/sbin/', b'/usr/bin/', b'/root', b'../', b'/cgi-bin/',
+                     b'wget ', b'curl ', b'chmod ', b'chown ', b'\ngcc ', b'\ncc ', b'rm -rf', b'.exe']),
+    ('num_failed_logins', 'resp', [b'login incorrect', b'login failed', b'authentication failed',
+                                   b'invalid password', b'access denied', b'\n530 ', b'\n535 ', b'\n-err']),
+    ('logged_in', 'resp', [b'last login', b'\n230 ', b'\n235 ', b'\n250 ', b'\n+ok', b' ok login',
+                           b' ok logged in', b'http/1.0 2', b'http/1.1 2', b'http/1.0 3', b'http/1.1 3']),
+    ('root_shell', 'resp', [b'uid=0(', b'\nroot@', b']# ', b'root# ']),
+    ('su_attempted', 'orig', [b'\nsu\n', b'\nsu -', b'\nsu root', b'sudo su', b'sudo -i', b'sudo -s']),
+    ('num_file_creations', 'orig', [b'\ntouch ', b'\nmkdir ', b'\nstor ', b'\nappe ', b'\ncp ', b'\nmv ',
+                                    b' > /', b' >> ']),
+    # Bare commands only at the start of a line, so '/bin/bash -i' is one shell
+    ('num_shells', 'orig', [b'/bin/sh', b'/bin/bash', b'/bin/csh', b'/bin/ksh', b'/bin/zsh', b'\nbash -i',
+                            b'\nsh -i', b'cmd.exe', b'powershell']),
+    ('num_access_files', 'orig', [b'/etc/passwd', b'/etc/shadow', b'/etc/hosts', b'/etc/sudoers', b'/etc/group',
+                                  b'.rhosts', b'.ssh/', b'boot.ini', b'win.ini']),
+]
+
+# Encrypted services (nothing to match) and bulk data channels
+SKIP_PORTS = frozenset({20, 22, 443, 465, 563, 636, 853, 989, 990, 992, 993, 995, 8443})
+# Command and login sessions (ftp, telnet, smtp, pop3, imap, rexec, rlogin, rsh)
+INTERACTIVE_PORTS = frozenset({21, 23, 25, 110, 143, 512, 513, 514})
+MAX_BYTES = 8192
+OTHER_MAX_BYTES = 1024
+# Bytes scanned per segment at most (a coalesced frame can carry 64 KiB)
+PACKET_BUDGET = 2048
+MAX_PENDING = 4096
+MAX_FLOWS = 65536
+# Segments further ahead than this are a gap, not reordering
+MAX_REORDER = 1 << 20
+
+SEQ_MASK = 0xFFFFFFFF
+_NORMALIZE = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ\r\0', b'abcdefghijklmnopqrstuvwxyz\n\n')
+
+
+class PatternAutomaton:
+    """
+    Aho-Corasick automaton over bytes, compiled to a full transition table:
+    scanning costs one table lookup per byte, whatever the number of patterns.
+    outputs are any hashable values; scan() counts them into counts[output],
+    each at most once per position however many of its patterns end there.
+    """
+
+    def __init__(self, patterns):
+        goto, fail, out = [{}], [0], [[]]
+        for pattern, output in patterns:
+            state = 0
+            for byte in pattern:
+                following = goto[state].get(byte)
+                if following is None:
+                    following = len(goto)
+                    goto[state][byte] = following
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                state = following
+            out[state].append(output)
+
+        table = [None] * len(goto)
+        table[0] = [goto[0].get(byte, 0) for byte in range(256)]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # Failure links point to shallower states, whose rows are already complete
+            row = list(table[fail[state]])
+            for byte, following in goto[state].items():
+                row[byte] = following
+            table[state] = row
+            for byte, following in goto[state].items():
+                fail[following] = table[fail[state]][byte]
+                out[following] += out[fail[following]]
+                queue.append(following)
+        self.table = [tuple(row) for row in table]
+        self.outputs = [tuple(sorted(set(o))) if o else None for o in out]
+        # Streams start as if at the beginning of a line
+        self.start = self.table[0][ord('\n')]
+
+    def __len__(self):
+        return len(self.table)
+
+    def scan(self, data, state, counts):
+        """Feed normalized bytes from state; adds matches to counts and returns the new state."""
+        table, outputs = self.table, self.outputs
+        for byte in data:
+            state = table[state][byte]
+            hits = outputs[state]
+            if hits is not None:
+                for output in hits:
+                    counts[output] += 1
+        return state
+
+
+def build_automata(patterns=PATTERNS):
+    """(client -> server automaton, server -> client automaton) counting into CONTENT_FEATURES positions."""
+    index = {name: i for i, name in enumerate(CONTENT_FEATURES)}
+    orig = {(p, index[feature]) for feature, direction, group in patterns if direction != 'resp' for p in group}
+    resp = {(p, index[feature]) for feature, direction, group in patterns if direction != 'orig' for p in group}
+    return PatternAutomaton(sorted(orig)), PatternAutomaton(sorted(resp))
+
+
+class _Stream:
+    """Reassembly state of one direction of a flow."""
+    __slots__ = ('next_seq', 'state', 'inspected', 'pending', 'pending_bytes')
+
+    def __init__(self, start):
+        self.next_seq = None
+        self.state = start
+        self.inspected = 0
+        self.pending = {}        # seq -> (captured payload, length on the wire)
+        self.pending_bytes = 0
+
+
+class _Flow:
+    __slots__ = ('orig', 'max_bytes', 'counts', 'streams')
+
+    def __init__(self, orig, max_bytes, automata):
+        self.orig = orig
+        self.max_bytes = max_bytes
+        self.counts = [0] * len(CONTENT_FEATURES)
+        self.streams = (_Stream(automata[0].start), _Stream(automata[1].start))
+
+
+class PayloadInspector:
+    """
+    Per-flow content indicator counts for the live and offline capture paths.
+    Call inspect() with every TCP packet after the flow table has seen it, and
+    pop() with every connection the flow table emits. flow_table, if given,
+    decides which side originated a flow; otherwise the first sender does.
+    Runs on the capture thread, like the flow table; indicator totals in
+    stats() count connections already popped.
+    """
+
+    def __init__(self, flow_table=None, max_bytes=MAX_BYTES, skip_ports=SKIP_PORTS, max_flows=MAX_FLOWS,
+                 max_pending=MAX_PENDING, patterns=PATTERNS, other_max_bytes=OTHER_MAX_BYTES,
+                 packet_budget=PACKET_BUDGET, interactive_ports=INTERACTIVE_PORTS):
+        self.flow_table = flow_table
+        self.max_bytes = max_bytes
+        self.other_max_bytes = other_max_bytes
+        self.packet_budget = packet_budget
+        self.interactive_ports = frozenset(interactive_ports)
+        self.skip_ports = frozenset(skip_ports)
+        self.max_flows = max_flows
+        self.max_pending = max_pending
+        self.automata = build_automata(patterns)
+        self.flows = {}
+        self._timer = metrics.stage('inspect')
+        self.segments = 0
+        self.inspected_bytes = 0
+        self.skipped_port_bytes = 0
+        self.over_cap_bytes = 0
+        self.over_budget_bytes = 0
+        self.untracked_bytes = 0
+        self.gaps = 0
+        self.indicators = [0] * len(CONTENT_FEATURES)
+
+    def _stream(self, fields):
+        _, proto, src, sport, dst, dport, payload_len, _ = fields
+        if proto != 6 or not payload_len:
+            return None, None
+        if sport in self.skip_ports or dport in self.skip_ports:
+            self.skipped_port_bytes += payload_len
+            return None, None
+        a = (src, sport)
+        b = (dst, dport)
+        key = (6, a, b) if a <= b else (6, b, a)
+        flow = self.flows.get(key)
+        if flow is None:
+            if len(self.flows) >= self.max_flows:
+                self.untracked_bytes += payload_len
+                return None, None
+            orig = self.flow_table.originator(key) if self.flow_table is not None else None
+            interactive = sport in self.interactive_ports or dport in self.interactive_ports
+            flow = self.flows[key] = _Flow(orig or a, self.max_bytes if interactive else self.other_max_bytes,
+                                           self.automata)
+        direction = 0 if a == flow.orig else 1
+        if flow.streams[direction].inspected >= flow.max_bytes:
+            self.over_cap_bytes += payload_len
+            return None, None
+        return flow, direction
+
+    def inspect(self, fields, frame, linktype):
+        """Inspect one raw frame (see fast_decode) whose decoded fields are given."""
+        flow, direction = self._stream(fields)
+        if flow is not None:
+            from src.realtime.fast_decode import tcp_segment
+            segment = tcp_segment(frame, linktype)
+            if segment is not None:
+                self.feed(flow, direction, *segment)
+
+    def inspect_packet(self, fields, packet):
+        """inspect() for a scapy packet."""
+        flow, direction = self._stream(fields)
+        if flow is not None:
+            from src.realtime.feature_extractor import tcp_segment
+            segment = tcp_segment(packet, fields[6])
+            if segment is not None:
+                self.feed(flow, direction, *segment)
+
+    def feed(self, flow, direction, seq, payload, length):
+        """Account one segment: in order it is scanned, ahead of the stream it is held (bounded)."""
+        self.segments += 1
+        timed = self.segments % metrics.SAMPLE_EVERY == 0
+        if timed:
+            start = time.perf_counter()
+        stream = flow.streams[direction]
+        if stream.next_seq is None:
+            stream.next_seq = seq
+        offset = (seq - stream.next_seq) & SEQ_MASK
+        if offset >= 1 << 31:
+            offset -= 1 << 32
+        if offset > 0:
+            if offset < MAX_REORDER and stream.pending_bytes + len(payload) <= self.max_pending:
+                stream.pending[seq] = (bytes(payload), length)
+                stream.pending_bytes += len(payload)
+            else:
+                self._skip_gap(flow, direction, stream, seq, payload, length)
+        else:
+            self._scan_in_order(flow, direction, stream, offset, payload, length)
+            self._drain(flow, direction, stream)
+        if timed:
+            self._timer.observe(time.perf_counter() - start)
+
+    def _scan_in_order(self, flow, direction, stream, offset, payload, length):
+        if offset < 0:
+            # Retransmission: only the part past what was already seen is new
+            if -offset >= length:
+                return
+            payload, length = payload[-offset:], length + offset
+        room = flow.max_bytes - stream.inspected
+        if room > 0:
+            chunk = bytes(payload[:min(room, self.packet_budget)]).translate(_NORMALIZE)
+            stream.state = self.automata[direction].scan(chunk, stream.state, flow.counts)
+            stream.inspected += len(chunk)
+            self.inspected_bytes += len(chunk)
+            if room > len(chunk) < len(payload):
+                # The rest of the segment is over the per-packet budget: a gap, like a snaplen cut
+                self.over_budget_bytes += min(room, len(payload)) - len(chunk)
+                stream.state = self.automata[direction].start
+        if len(payload) < length:
+            # Bytes cut off by the capture snaplen are a gap in the stream
+            stream.state = self.automata[direction].start
+        stream.next_seq = (stream.next_seq + length) & SEQ_MASK
+
+    def _drain(self, flow, direction, stream):
+        while stream.pending:
+            held = stream.pending.pop(stream.next_seq, None)
+            if held is None:
+                return
+            stream.pending_bytes -= len(held[0])
+            self._scan_in_order(flow, direction, stream, 0, held[0], held[1])
+
+    def _skip_gap(self, flow, direction, stream, seq, payload, length):
+        # Out of buffer space: give up on the missing bytes and carry on from the held segments, in order
+        self.gaps += 1
+        held = sorted([(s, p, n) for s, (p, n) in stream.pending.items()] + [(seq, bytes(payload), length)],
+                      key=lambda item: (item[0] - stream.next_seq) & SEQ_MASK)
+        stream.pending.clear()
+        stream.pending_bytes = 0
+        for s, p, n in held:
+            offset = (s - stream.next_seq) & SEQ_MASK
+            if offset >= 1 << 31:
+                offset -= 1 << 32
+            if offset > 0:
+                stream.state = self.automata[direction].start
+                stream.next_seq = s
+                offset = 0
+            self._scan_in_order(flow, direction, stream, offset, p, n)
+
+    def pop(self, conn):
+        """Content feature values of a completed connection (flow_table.Connection), or None if it had none."""
+        if conn.protocol_type != 'tcp':
+            return None
+        a = (conn.src, conn.sport)
+        b = (conn.dst, conn.dport)
+        flow = self.flows.pop((6, a, b) if a <= b else (6, b, a), None)
+        if flow is None or not any(flow.counts):
+            return None
+        for i, count in enumerate(flow.counts):
+            self.indicators[i] += count
+        return {name: min(count, 1) if name in FLAG_FEATURES else count
+                for name, count in zip(CONTENT_FEATURES, flow.counts)}
+
+    def clear(self):
+        """Forget every tracked flow (e.g. when the flow table was flushed)."""
+        self.flows = {}
+
+    def stats(self):
+        return {
+            'flows': len(self.flows),
+            'segments': self.segments,
+            'inspected_bytes': self.inspected_bytes,
+            'skipped_port_bytes': self.skipped_port_bytes,
+            'over_cap_bytes': self.over_cap_bytes,
+            'over_budget_bytes': self.over_budget_bytes,
+            'untracked_bytes': self.untracked_bytes,
+            'gaps': self.gaps,
+            'indicators': dict(zip(CONTENT_FEATURES, self.indicators)),
+        }
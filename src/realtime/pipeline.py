@@ -0,0 +1,305 @@
+"""
+Multi-process capture -> extract -> score pipeline.
+
+    capture process ──(packet rings, sharded by flow hash)──> N extraction workers
+    extraction worker i ──(feature ring i)──> inference worker i % M
+    inference worker j ──(result ring j)──> parent process
+
+Each stage runs in its own process, so capture, flow tracking and the forest each
+get their own core instead of sharing one GIL with the Dash server. Stages talk
+through ShmRing buffers of fixed-width records rather than pickled queues; a full
+ring drops the record and counts it, which is what stats() reports as backpressure.
+
+Packets are sharded by a hash of the normalized 5-tuple, so every packet of a
+flow reaches the same extraction worker and flow state never crosses processes.
+The time/host window features are therefore computed per shard: with more than
+one extraction worker, count/dst_host_count only see that shard's connections.
+
+Run standalone with:  python -m src.realtime.pipeline --extractors 2 --scorers 2
+"""
+import argparse
+import multiprocessing as mp
+import time
+import numpy as np
+from src.realtime.capture import flow_hash
+from src.realtime.shm_ring import ShmRing
+
+N_FEATURES = 41
+ADDR = 'S39'  # textual IPv4/IPv6 address
+
+PACKET_DTYPE = np.dtype([
+    ('ts', 'f8'), ('proto', 'u1'), ('tcp_flags', 'u1'), ('sport', 'u2'), ('dport', 'u2'),
+    ('payload_len', 'u4'), ('src', ADDR), ('dst', ADDR),
+])
+
+# Feature rows carry categoricals as ordinal codes and numeric columns unscaled
+FEATURE_DTYPE = np.dtype([
+    ('ts', 'f8'), ('sport', 'u2'), ('dport', 'u2'), ('src', ADDR), ('dst', ADDR),
+    ('features', 'f8', (N_FEATURES,)),
+])
+
+RESULT_DTYPE = np.dtype([
+    ('ts', 'f8'), ('sport', 'u2'), ('dport', 'u2'), ('src', ADDR), ('dst', ADDR),
+    ('label', 'i2'), ('features', 'f8', (N_FEATURES,)),
+])
+
+POLL_INTERVAL = 0.001
+
+
+def flow_shard(proto, src, sport, dst, dport, n_shards):
+    """Direction-independent shard for a packet so both halves of a flow land together."""
+    return flow_hash(proto, src, sport, dst, dport) % n_shards
+
+
+def capture_process(packet_specs, stop_event, iface=None, bpf_filter=None):
+    from scapy.all import sniff
+    from src.realtime.feature_extractor import parse_packet
+
+    rings = [ShmRing.attach(spec) for spec in packet_specs]
+    n_shards = len(rings)
+
+    def on_packet(packet):
+        fields = parse_packet(packet)
+        if fields is None:
+            return
+        ts, proto, src, sport, dst, dport, payload_len, tcp_flags = fields
+        ring = rings[flow_shard(proto, src, sport, dst, dport, n_shards)]
+        ring.push((ts, proto, tcp_flags, sport, dport, payload_len, src, dst))
+
+    # sniff() only checks for shutdown between packets, so run it in short slices
+    while not stop_event.is_set():
+        sniff(prn=on_packet, store=False, timeout=1, iface=iface, filter=bpf_filter)
+
+
+def extraction_process(packet_spec, feature_spec, stop_event, idle_timeout=60.0):
+    from src import model_registry
+    from src.realtime.feature_extractor import extract_connection_features
+    from src.realtime.flow_table import FlowTable
+    from src.realtime.traffic_stats import TrafficStats
+
+    packets = ShmRing.attach(packet_spec)
+    features_out = ShmRing.attach(feature_spec)
+    preprocessor = model_registry.get_preprocessor()
+    flow_table = FlowTable(idle_timeout=idle_timeout)
+    traffic_stats = TrafficStats()
+
+    def emit(connections):
+        for conn in connections:
+            features = extract_connection_features(conn, traffic_stats)
+            row = preprocessor.encode_record(features)
+            features_out.push((conn.start, conn.sport, conn.dport, conn.src, conn.dst, row))
+
+    # Flow time follows packet timestamps; when the ring is empty it advances with the
+    # wall clock from the last packet seen, so idle flows still time out (also on replays)
+    last_ts = None
+    last_wall = time.time()
+    while True:
+        batch = packets.pop_many(1024)
+        if not len(batch):
+            if stop_event.is_set():
+                break
+            if last_ts is not None:
+                emit(flow_table.expire(last_ts + time.time() - last_wall))
+            time.sleep(POLL_INTERVAL)
+            continue
+        for p in batch:
+            emit(flow_table.update(float(p['ts']), int(p['proto']), p['src'].decode(), int(p['sport']),
+                                   p['dst'].decode(), int(p['dport']), int(p['payload_len']), int(p['tcp_flags'])))
+        last_ts = float(batch[-1]['ts'])
+        last_wall = time.time()
+    emit(flow_table.flush())
+
+
+def inference_process(feature_specs, result_spec, stop_event, max_batch_size=256, max_delay=0.005):
+    import warnings
+    from src import model_registry
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    inputs = [ShmRing.attach(spec) for spec in feature_specs]
+    results = ShmRing.attach(result_spec)
+    preprocessor = model_registry.get_preprocessor()
+    model = model_registry.get_serving_model()
+    label_codes = {label: i for i, label in enumerate(model.classes_)}
+
+    while not (stop_event.is_set() and not any(len(ring) for ring in inputs)):
+        # Gather up to max_batch_size rows across input rings, waiting at most max_delay
+        deadline = time.perf_counter() + max_delay
+        parts = []
+        n = 0
+        while n < max_batch_size:
+            for ring in inputs:
+                part = ring.pop_many(max_batch_size - n)
+                if len(part):
+                    parts.append(part)
+                    n += len(part)
+            if n >= max_batch_size or time.perf_counter() >= deadline:
+                break
+            time.sleep(POLL_INTERVAL)
+        if not n:
+            continue
+
+        rows = np.concatenate(parts)
+        X = preprocessor.transform_encoded(rows['features'].copy())
+        predictions = model.predict(X)
+
+        out = np.empty(len(rows), dtype=RESULT_DTYPE)
+        for name in ('ts', 'sport', 'dport', 'src', 'dst', 'features'):
+            out[name] = rows[name]
+        out['label'] = [label_codes[p] for p in predictions]
+        results.push_many(out)
+
+
+class Pipeline:
+    """
+    Owns the shared-memory rings and the stage processes.
+    Call start(), then poll_results() periodically; stop() shuts everything down.
+    With capture=False no sniffer is started and packets are fed from the parent
+    through submit_packet() instead (e.g. when replaying a pcap).
+    """
+
+    def __init__(self, n_extractors=2, n_scorers=1, ring_capacity=65536, iface=None, bpf_filter=None,
+                 capture=True):
+        self.n_extractors = n_extractors
+        self.n_scorers = n_scorers
+        self.ring_capacity = ring_capacity
+        self.iface = iface
+        self.bpf_filter = bpf_filter
+        self.capture = capture
+        self.processes = []
+        self.scorers = []
+        self.packet_rings = []
+        self.feature_rings = []
+        self.result_rings = []
+        self.stop_event = None
+        self.score_stop_event = None
+        self.started = None
+        self.labels = None
+        self.preprocessor = None
+
+    def start(self):
+        from src import model_registry
+
+        # Loaded before the workers fork, so they inherit the forest copy-on-write
+        self.labels = list(model_registry.get_serving_model().classes_)
+        self.preprocessor = model_registry.get_preprocessor()
+
+        ctx = mp.get_context()
+        # Scorers get their own stop event so they can drain what the extractors flush on shutdown
+        self.stop_event = ctx.Event()
+        self.score_stop_event = ctx.Event()
+        self.packet_rings = [ShmRing(PACKET_DTYPE, self.ring_capacity) for _ in range(self.n_extractors)]
+        self.feature_rings = [ShmRing(FEATURE_DTYPE, self.ring_capacity) for _ in range(self.n_extractors)]
+        self.result_rings = [ShmRing(RESULT_DTYPE, self.ring_capacity) for _ in range(self.n_scorers)]
+
+        for j, result_ring in enumerate(self.result_rings):
+            specs = [ring.spec() for i, ring in enumerate(self.feature_rings) if i % self.n_scorers == j]
+            self.scorers.append(self._spawn(ctx, f"score-{j}", inference_process, specs, result_ring.spec(),
+                                            self.score_stop_event))
+        for i in range(self.n_extractors):
+            self.processes.append(self._spawn(ctx, f"extract-{i}", extraction_process, self.packet_rings[i].spec(),
+                                              self.feature_rings[i].spec(), self.stop_event))
+        if self.capture:
+            self.processes.append(self._spawn(ctx, "capture", capture_process,
+                                              [ring.spec() for ring in self.packet_rings],
+                                              self.stop_event, self.iface, self.bpf_filter))
+        self.started = time.time()
+
+    def _spawn(self, ctx, name, target, *args):
+        process = ctx.Process(target=target, args=args, name=name, daemon=True)
+        process.start()
+        return process
+
+    def submit_packet(self, ts, proto, src, sport, dst, dport, payload_len, tcp_flags=0):
+        """Feed one parsed packet (parse_packet() field order) to its extraction shard."""
+        ring = self.packet_rings[flow_shard(proto, src, sport, dst, dport, self.n_extractors)]
+        return ring.push((ts, proto, tcp_flags, sport, dport, payload_len, src, dst))
+
+    def poll_results(self, max_results=10000):
+        """Drain scored connections from the inference workers as display dicts."""
+        results = []
+        for ring in self.result_rings:
+            for r in ring.pop_many(max_results):
+                features = r['features']
+                results.append({
+                    'ts': float(r['ts']),
+                    'src': r['src'].decode(), 'sport': int(r['sport']),
+                    'dst': r['dst'].decode(), 'dport': int(r['dport']),
+                    'label': self.labels[r['label']],
+                    'protocol_type': self.preprocessor.decode(0, features[1]),
+                    'service': self.preprocessor.decode(1, features[2]),
+                    'flag': self.preprocessor.decode(2, features[3]),
+                })
+        return results
+
+    def stats(self):
+        """Per-stage throughput, ring depth and drop counters."""
+        elapsed = max(time.time() - self.started, 1e-9) if self.started else 0.0
+
+        def describe(rings):
+            pushed = sum(ring.pushed for ring in rings)
+            return {
+                'records': pushed,
+                'per_second': pushed / elapsed if elapsed else 0.0,
+                'queued': sum(len(ring) for ring in rings),
+                'dropped': sum(ring.dropped for ring in rings),
+            }
+
+        return {
+            'packets': describe(self.packet_rings),
+            'connections': describe(self.feature_rings),
+            'results': describe(self.result_rings),
+            'alive': [p.name for p in self.processes + self.scorers if p.is_alive()],
+        }
+
+    def stop(self, timeout=5.0):
+        if self.stop_event is None:
+            return
+        # Stop capture and extraction first, then let the scorers drain the flushed flows
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.score_stop_event.set()
+        for process in self.scorers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes, self.scorers = [], []
+        for ring in self.packet_rings + self.feature_rings + self.result_rings:
+            ring.close()
+        self.packet_rings, self.feature_rings, self.result_rings = [], [], []
+        self.stop_event = None
+        self.score_stop_event = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the multi-process live detection pipeline.")
+    parser.add_argument('--extractors', type=int, default=2, help="feature-extraction worker processes")
+    parser.add_argument('--scorers', type=int, default=1, help="inference worker processes")
+    parser.add_argument('--iface', default=None, help="interface to sniff (default: scapy's choice)")
+    parser.add_argument('--filter', default=None, help="BPF capture filter")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(args.extractors, args.scorers, iface=args.iface, bpf_filter=args.filter)
+    pipeline.start()
+    print("Pipeline started (Ctrl+C to stop)...")
+    try:
+        last_report = time.time()
+        while True:
+            for r in pipeline.poll_results():
+                verdict = 'Normal' if r['label'] == 'normal' else 'Intrusion'
+                print(f"{verdict} ({r['label']}) {r['src']}:{r['sport']} -> {r['dst']}:{r['dport']} "
+                      f"{r['protocol_type']}/{r['service']}/{r['flag']}")
+            if time.time() - last_report >= 5:
+                print(f"Pipeline stats: {pipeline.stats()}")
+                last_report = time.time()
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import threading
+import time
+
+
+class ResultsStore:
+    """
+    Fixed-capacity, thread-safe store for live prediction results.
+
+    Entries go into a ring buffer and get increasing sequence numbers, so memory
+    is bounded by capacity however long capture runs. Readers keep a cursor (the
+    sequence number after the last entry they saw) and read_since() returns only
+    newer entries. Aggregate counters (total, per label, per-second rates over the
+    last rate_window seconds) are updated in O(1) per insert and survive the
+    ring overwriting old entries.
+    """
+
+    def __init__(self, capacity=10000, rate_window=60):
+        self.capacity = capacity
+        self.rate_window = rate_window
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self.clear()
+
+    def clear(self):
+        """Drop all entries and counters. Sequence numbers keep increasing, so existing cursors stay valid."""
+        with self._lock:
+            self._entries = [None] * self.capacity
+            self._first_seq = self._next_seq
+            self.total = 0
+            self.label_counts = {}
+            # One bucket per second of the rate window, tagged with the second it counts
+            self._bucket_second = [-1] * self.rate_window
+            self._bucket_count = [0] * self.rate_window
+
+    def append(self, entry, label=None, ts=None):
+        """Add one result. label feeds the per-label counters; ts defaults to now."""
+        second = int(ts if ts is not None else time.time())
+        bucket = second % self.rate_window
+        with self._lock:
+            self._entries[self._next_seq % self.capacity] = entry
+            self._next_seq += 1
+            self.total += 1
+            if label is not None:
+                self.label_counts[label] = self.label_counts.get(label, 0) + 1
+            if self._bucket_second[bucket] != second:
+                self._bucket_second[bucket] = second
+                self._bucket_count[bucket] = 0
+            self._bucket_count[bucket] += 1
+
+    def cursor(self):
+        """Cursor positioned after the newest entry (read_since() from it returns nothing yet)."""
+        with self._lock:
+            return self._next_seq
+
+    def read_since(self, cursor, limit=None):
+        """
+        Return (entries, new_cursor) for entries added after cursor, oldest first.
+        With limit, only the newest `limit` of them are returned. Entries already
+        overwritten by the ring are skipped.
+        """
+        with self._lock:
+            end = self._next_seq
+            if cursor > end:
+                cursor = 0  # cursor from before a restart of this process
+            start = max(cursor, end - self.capacity, self._first_seq)
+            if limit is not None:
+                start = max(start, end - limit)
+            entries = [self._entries[seq % self.capacity] for seq in range(start, end)]
+        return entries, end
+
+    def latest(self, n):
+        entries, _ = self.read_since(0, limit=n)
+        return entries
+
+    def __len__(self):
+        with self._lock:
+            return min(self._next_seq - self._first_seq, self.capacity)
+
+    def counters(self, now=None):
+        """Snapshot of the aggregate counters, including rates over the last second and the rate window."""
+        current = int(now if now is not None else time.time())
+        with self._lock:
+            in_window = sum(count for second, count in zip(self._bucket_second, self._bucket_count)
+                            if current - self.rate_window < second <= current)
+            last_second = self._bucket_count[(current - 1) % self.rate_window] \
+                if self._bucket_second[(current - 1) % self.rate_window] == current - 1 else 0
+            return {
+                'total': self.total,
+                'by_label': dict(self.label_counts),
+                'rate_last_second': last_second,
+                'rate_per_second': in_window / self.rate_window,
+            }
@@ -0,0 +1,44 @@
+"""
+Port -> NSL-KDD service name table.
+Names are the ones the encoder was fitted on (see encoder.categories_[1]).
+"""
+
+TCP_SERVICES = {
+    5: 'rje', 7: 'echo', 9: 'discard', 11: 'systat', 13: 'daytime', 15: 'netstat',
+    20: 'ftp_data', 21: 'ftp', 22: 'ssh', 23: 'telnet', 25: 'smtp', 37: 'time',
+    42: 'name', 43: 'whois', 53: 'domain', 66: 'sql_net', 70: 'gopher', 71: 'remote_job',
+    79: 'finger', 80: 'http', 84: 'ctf', 95: 'supdup', 101: 'hostnames', 102: 'iso_tsap',
+    105: 'csnet_ns', 109: 'pop_2', 110: 'pop_3', 111: 'sunrpc', 113: 'auth', 117: 'uucp_path',
+    119: 'nntp', 137: 'netbios_ns', 138: 'netbios_dgm', 139: 'netbios_ssn', 143: 'imap4',
+    175: 'vmnet', 179: 'bgp', 194: 'IRC', 210: 'Z39_50', 245: 'link', 389: 'ldap',
+    433: 'nnsp', 443: 'http_443', 512: 'exec', 513: 'login', 514: 'shell', 515: 'printer',
+    520: 'efs', 530: 'courier', 540: 'uucp', 543: 'klogin', 544: 'kshell', 1911: 'mtp',
+    2784: 'http_2784', 5190: 'aol', 6000: 'X11', 6667: 'IRC', 8001: 'http_8001',
+}
+
+UDP_SERVICES = {
+    53: 'domain_u', 69: 'tftp_u', 123: 'ntp_u', 137: 'netbios_ns', 138: 'netbios_dgm',
+}
+
+# ICMP type -> service
+ICMP_SERVICES = {
+    0: 'ecr_i', 3: 'urp_i', 5: 'red_i', 8: 'eco_i', 13: 'tim_i', 14: 'tim_i',
+}
+
+PROTOCOL_NAMES = {1: 'icmp', 6: 'tcp', 17: 'udp'}
+
+
+def lookup_service(protocol_type, sport, dport):
+    """
+    Map a connection to its NSL-KDD service. The responder port decides; the
+    originator port is tried second so replies captured mid-stream still map.
+    For ICMP, sport carries the ICMP type.
+    """
+    if protocol_type == 'icmp':
+        return ICMP_SERVICES.get(sport, 'other')
+    table = TCP_SERVICES if protocol_type == 'tcp' else UDP_SERVICES
+    service = table.get(dport) or table.get(sport)
+    if service:
+        return service
+    # Unknown ephemeral/high ports are 'private' in the dataset, unknown low ports 'other'
+    return 'other' if dport < 1024 else 'private'
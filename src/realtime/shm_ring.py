@@ -0,0 +1,99 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+# Header layout (int64 slots). head and tail sit on separate cache lines so the
+# producer and consumer do not keep invalidating each other's line.
+HEAD = 0
+TAIL = 8
+DROPPED = 16
+HEADER_SLOTS = 24
+HEADER_BYTES = HEADER_SLOTS * 8
+
+
+class ShmRing:
+    """
+    Single-producer / single-consumer ring buffer of fixed-width records living in
+    a multiprocessing.shared_memory block, used to pass packets, feature rows and
+    results between pipeline processes without pickling.
+
+    Records are a NumPy structured dtype. The producer writes a record and then
+    publishes it by advancing head; the consumer copies records out and advances
+    tail. A full ring never blocks the producer: the record is dropped and counted.
+    Create the ring in the parent with ShmRing(dtype, capacity), pass ring.spec()
+    to the child process and re-open it there with ShmRing.attach(spec).
+    """
+
+    def __init__(self, dtype, capacity, name=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        size = HEADER_BYTES + self.dtype.itemsize * capacity
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=self.shm.buf)
+        self.records = np.ndarray((capacity,), dtype=self.dtype, buffer=self.shm.buf, offset=HEADER_BYTES)
+        if self.owner:
+            self.header[:] = 0
+
+    @classmethod
+    def attach(cls, spec):
+        name, dtype, capacity = spec
+        return cls(dtype, capacity, name=name)
+
+    def spec(self):
+        return (self.shm.name, self.dtype, self.capacity)
+
+    def __len__(self):
+        return int(self.header[HEAD] - self.header[TAIL])
+
+    @property
+    def pushed(self):
+        return int(self.header[HEAD])
+
+    @property
+    def dropped(self):
+        return int(self.header[DROPPED])
+
+    def push(self, record):
+        """Append one record (a tuple in dtype field order). Returns False if the ring was full."""
+        head = int(self.header[HEAD])
+        if head - int(self.header[TAIL]) >= self.capacity:
+            self.header[DROPPED] += 1
+            return False
+        self.records[head % self.capacity] = record
+        self.header[HEAD] = head + 1
+        return True
+
+    def push_many(self, records):
+        """Append an array of records; whatever does not fit is dropped. Returns the number written."""
+        head = int(self.header[HEAD])
+        free = self.capacity - (head - int(self.header[TAIL]))
+        n = min(len(records), free)
+        if n < len(records):
+            self.header[DROPPED] += len(records) - n
+        if n:
+            idx = (head + np.arange(n)) % self.capacity
+            self.records[idx] = records[:n]
+            self.header[HEAD] = head + n
+        return n
+
+    def pop_many(self, max_records):
+        """Remove and return up to max_records records as a (copied) structured array."""
+        tail = int(self.header[TAIL])
+        n = min(int(self.header[HEAD]) - tail, max_records)
+        if n <= 0:
+            return self.records[:0].copy()
+        idx = (tail + np.arange(n)) % self.capacity
+        out = self.records[idx]
+        self.header[TAIL] = tail + n
+        return out
+
+    def close(self):
+        self.header = None
+        self.records = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,165 @@
+from collections import deque
+
+# Connection flags counted as SYN errors / REJ errors by the NSL-KDD rate features
+SERROR_FLAGS = frozenset(['S0', 'S1', 'S2', 'S3'])
+RERROR_FLAGS = frozenset(['REJ'])
+
+
+def _inc(counter, key):
+    counter[key] = counter.get(key, 0) + 1
+
+
+def _dec(counter, key):
+    # Keys are dropped as soon as they reach zero, so a counter never holds more
+    # keys than its window holds connections (cold hosts disappear on their own)
+    value = counter[key] - 1
+    if value:
+        counter[key] = value
+    else:
+        del counter[key]
+
+
+def _rate(part, total):
+    return round(part / total, 2) if total else 0.0
+
+
+class TrafficStats:
+    """
+    Incremental NSL-KDD traffic features over completed connections.
+
+    Two windows are maintained, each with running counters keyed by destination
+    host, service and the combinations the features need:
+      - a time window (default 2 s) for count, srv_count and the *_rate features
+      - a count window (default the last 100 connections) for the dst_host_* features
+    Adding a connection expires old entries and adjusts the counters, so each
+    update costs amortized O(1) however much history is in the windows. Memory is
+    bounded by the window sizes (max_time_entries caps the time window during
+    floods), not by the number of distinct addresses seen.
+    """
+
+    def __init__(self, time_window=2.0, host_window=100, max_time_entries=100000):
+        self.time_window = time_window
+        self.host_window = host_window
+        self.max_time_entries = max_time_entries
+
+        # Time window: deque of (ts, host, service, serror, rerror)
+        self.recent = deque()
+        self.t_host = {}
+        self.t_host_serror = {}
+        self.t_host_rerror = {}
+        self.t_host_srv = {}
+        self.t_srv = {}
+        self.t_srv_serror = {}
+        self.t_srv_rerror = {}
+
+        # Count window: ring buffer of (host, service, sport, serror, rerror)
+        self.ring = [None] * host_window
+        self.ring_pos = 0
+        self.h_host = {}
+        self.h_host_serror = {}
+        self.h_host_rerror = {}
+        self.h_host_srv = {}
+        self.h_host_sport = {}
+        self.h_srv = {}
+        self.h_srv_serror = {}
+        self.h_srv_rerror = {}
+
+    def _expire_time_window(self, now):
+        recent = self.recent
+        horizon = now - self.time_window
+        while recent and (recent[0][0] < horizon or len(recent) >= self.max_time_entries):
+            ts, host, service, serror, rerror = recent.popleft()
+            _dec(self.t_host, host)
+            _dec(self.t_host_srv, (host, service))
+            _dec(self.t_srv, service)
+            if serror:
+                _dec(self.t_host_serror, host)
+                _dec(self.t_srv_serror, service)
+            if rerror:
+                _dec(self.t_host_rerror, host)
+                _dec(self.t_srv_rerror, service)
+
+    def _push_host_window(self, entry):
+        old = self.ring[self.ring_pos]
+        if old is not None:
+            host, service, sport, serror, rerror = old
+            _dec(self.h_host, host)
+            _dec(self.h_host_srv, (host, service))
+            _dec(self.h_host_sport, (host, sport))
+            _dec(self.h_srv, service)
+            if serror:
+                _dec(self.h_host_serror, host)
+                _dec(self.h_srv_serror, service)
+            if rerror:
+                _dec(self.h_host_rerror, host)
+                _dec(self.h_srv_rerror, service)
+        self.ring[self.ring_pos] = entry
+        self.ring_pos = (self.ring_pos + 1) % self.host_window
+
+        host, service, sport, serror, rerror = entry
+        _inc(self.h_host, host)
+        _inc(self.h_host_srv, (host, service))
+        _inc(self.h_host_sport, (host, sport))
+        _inc(self.h_srv, service)
+        if serror:
+            _inc(self.h_host_serror, host)
+            _inc(self.h_srv_serror, service)
+        if rerror:
+            _inc(self.h_host_rerror, host)
+            _inc(self.h_srv_rerror, service)
+
+    def update(self, conn):
+        """
+        Add one completed connection (flow_table.Connection) to both windows and
+        return its traffic features as a dict keyed by NSL-KDD feature name.
+        Connections must come in emission order; the time window runs on their
+        emission time, which unlike their end time never goes back.
+        """
+        now = conn.emitted
+        host = conn.dst
+        service = conn.service
+        serror = conn.flag in SERROR_FLAGS
+        rerror = conn.flag in RERROR_FLAGS
+
+        self._expire_time_window(now)
+        self.recent.append((now, host, service, serror, rerror))
+        _inc(self.t_host, host)
+        _inc(self.t_host_srv, (host, service))
+        _inc(self.t_srv, service)
+        if serror:
+            _inc(self.t_host_serror, host)
+            _inc(self.t_srv_serror, service)
+        if rerror:
+            _inc(self.t_host_rerror, host)
+            _inc(self.t_srv_rerror, service)
+
+        self._push_host_window((host, service, conn.sport, serror, rerror))
+
+        count = self.t_host[host]
+        srv_count = self.t_srv[service]
+        same_srv = self.t_host_srv[(host, service)]
+        dst_host_count = self.h_host[host]
+        dst_host_srv_count = self.h_srv[service]
+        dst_host_same_srv = self.h_host_srv[(host, service)]
+
+        return {
+            'count': count,
+            'srv_count': srv_count,
+            'serror_rate': _rate(self.t_host_serror.get(host, 0), count),
+            'srv_serror_rate': _rate(self.t_srv_serror.get(service, 0), srv_count),
+            'rerror_rate': _rate(self.t_host_rerror.get(host, 0), count),
+            'srv_rerror_rate': _rate(self.t_srv_rerror.get(service, 0), srv_count),
+            'same_srv_rate': _rate(same_srv, count),
+            'diff_srv_rate': _rate(count - same_srv, count),
+            'srv_diff_host_rate': _rate(srv_count - same_srv, srv_count),
+            'dst_host_count': dst_host_count,
+            'dst_host_srv_count': dst_host_srv_count,
+            'dst_host_same_srv_rate': _rate(dst_host_same_srv, dst_host_count),
+            'dst_host_diff_srv_rate': _rate(dst_host_count - dst_host_same_srv, dst_host_count),
+            'dst_host_same_src_port_rate': _rate(self.h_host_sport[(host, conn.sport)], dst_host_count),
+            'dst_host_srv_diff_host_rate': _rate(dst_host_srv_count - dst_host_same_srv, dst_host_srv_count),
+            'dst_host_serror_rate': _rate(self.h_host_serror.get(host, 0), dst_host_count),
+            'dst_host_srv_serror_rate': _rate(self.h_srv_serror.get(service, 0), dst_host_srv_count),
+            'dst_host_rerror_rate': _rate(self.h_host_rerror.get(host, 0), dst_host_count),
+            'dst_host_srv_rerror_rate': _rate(self.h_srv_rerror.get(service, 0), dst_host_srv_count),
+        }
@@ -0,0 +1,251 @@
+"""
+Train (or incrementally extend) the intrusion model and write all artifacts.
+
+    python -m src.train                                   # full retrain on data/KDDTrain+.txt
+    python -m src.train --warm-start 20 --train new.txt   # add 20 trees fitted on new data
+
+Parsed datasets are cached under data/cache as plain .npy columns, keyed by the
+sha256 of the source file, so a retrain on an unchanged file skips CSV parsing
+entirely and maps the columns back in milliseconds. The forest is fitted on all
+cores. With --warm-start the existing model, encoder and scaler are kept and only
+the new trees are fitted (RandomForestClassifier warm_start), so the new trees
+see exactly the encoding the old ones were trained on. Wall time is reported per
+phase.
+
+The cascade's first stage (see cascade) is fitted on the same input next to the
+forest, or kept from the current bundle on a warm start. Its threshold is
+calibrated for --max-recall-loss on --calibration-share of the training file,
+held out from both fits, so the test file only ever reports accuracy. With
+--calibration-share 0 the bundle keeps the first stage uncalibrated and serves
+the forest alone.
+"""
+import argparse
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import OrdinalEncoder, StandardScaler
+from src import model_registry
+from src.cascade import DEFAULT_MAX_RECALL_LOSS, calibrate, fit_first_stage
+from src.compiled_forest import CompiledForest
+from src.model_bundle import BUNDLE_PATH, MANIFEST, file_sha256, load_bundle, save_bundle
+from src.preprocessing import CompiledPreprocessor, categorical_cols, column_dtypes, columns, feature_cols
+
+CACHE_DIR = 'data/cache'
+# Bump when the cached layout changes so stale caches are not reused
+CACHE_VERSION = 1
+# Share of the training file held out to calibrate the cascade threshold on
+CALIBRATION_SHARE = 0.1
+
+numeric_cols = [col for col in feature_cols if col not in categorical_cols]
+
+
+class PhaseTimer:
+    """Collects wall time per named phase."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        total = sum(seconds for _, seconds in self.phases)
+        for name, seconds in self.phases:
+            print(f"  {name:<20}{seconds:8.2f}s")
+        print(f"  {'total':<20}{total:8.2f}s")
+
+
+def load_dataset(path, cache_dir=CACHE_DIR):
+    """
+    Parsed columns of an NSL-KDD file as a dict of arrays: 'numeric' (N, 38) float64
+    in feature_cols order, one array per categorical column, and 'label'.
+    Served from the cache when the file's hash has been seen before.
+    """
+    key = hashlib.sha256(f"{CACHE_VERSION}:{file_sha256(path)}".encode()).hexdigest()[:20]
+    entry = os.path.join(cache_dir, key)
+    names = ['numeric', 'label'] + categorical_cols
+    if all(os.path.exists(os.path.join(entry, f"{name}.npy")) for name in names):
+        return {name: np.load(os.path.join(entry, f"{name}.npy"), mmap_mode='r', allow_pickle=False)
+                for name in names}
+
+    df = pd.read_csv(path, names=columns, dtype=column_dtypes)
+    data = {'numeric': df[numeric_cols].to_numpy(dtype=np.float64), 'label': df['label'].to_numpy(dtype=str)}
+    for col in categorical_cols:
+        data[col] = df[col].to_numpy(dtype=str)
+
+    # Written to a temporary directory and renamed, so a crashed run never leaves a partial entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_entry = f"{entry}.{os.getpid()}.tmp"
+    os.makedirs(tmp_entry, exist_ok=True)
+    for name, array in data.items():
+        np.save(os.path.join(tmp_entry, f"{name}.npy"), array, allow_pickle=False)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        pass  # another run cached the same file first
+    return data
+
+
+def fit_preprocessing(data):
+    """Fit the OrdinalEncoder and StandardScaler on a parsed training set."""
+    encoder = OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1)
+    encoder.fit(pd.DataFrame({col: data[col] for col in categorical_cols}))
+    scaler = StandardScaler()
+    scaler.fit(pd.DataFrame(np.asarray(data['numeric']), columns=numeric_cols))
+    return encoder, scaler
+
+
+def encode(data, encoder, scaler):
+    """(N, 41) model input for a parsed dataset, identical to load_preprocess_data's frames."""
+    preprocessor = CompiledPreprocessor(encoder, scaler)
+    return preprocessor.transform_columns(data['numeric'], [data[col] for col in categorical_cols])
+
+
+def make_forest(n_estimators=100, max_depth=None, min_samples_leaf=1, ccp_alpha=0.0, n_jobs=-1):
+    """
+    The intrusion forest for the given size, depth limit and pruning. The seed is
+    fixed, so the first k trees of a forest are the trees of the k-tree forest.
+    """
+    return RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, min_samples_leaf=min_samples_leaf,
+                                  ccp_alpha=ccp_alpha, random_state=42, n_jobs=n_jobs)
+
+
+def mask_features(X, features):
+    """
+    Model input restricted to a subset of feature names: the other columns are
+    set to a constant, so no tree splits on them, yet the model still takes all
+    41 columns like every scorer expects.
+    """
+    if features is None:
+        return X
+    keep = [feature_cols.index(name) for name in features]
+    masked = np.zeros_like(X)
+    masked[:, keep] = X[:, keep]
+    return masked
+
+
+def train(train_path, test_path=None, n_estimators=100, warm_start=0, n_jobs=-1, cache_dir=CACHE_DIR,
+          model_path=model_registry.MODEL_PATH, encoder_path=model_registry.ENCODER_PATH,
+          scaler_path=model_registry.SCALER_PATH, bundle_path=BUNDLE_PATH,
+          max_recall_loss=DEFAULT_MAX_RECALL_LOSS, max_depth=None, min_samples_leaf=1, ccp_alpha=0.0,
+          features=None, calibration_share=CALIBRATION_SHARE):
+    """
+    Fit a new forest of n_estimators trees, or with warm_start > 0 add that many trees
+    to the saved model. A new forest can be limited in depth, pruned (min_samples_leaf,
+    ccp_alpha) and restricted to a subset of features (see src.model_sweep).
+    calibration_share of train_path is held out of the fits to calibrate the cascade on.
+    Writes the joblib artifacts and the bundle; returns
+    (model, accuracy on test_path or None, cascade calibration report or None, PhaseTimer).
+    """
+    timer = PhaseTimer()
+    with timer.phase('load data'):
+        train_data = load_dataset(train_path, cache_dir)
+        test_data = load_dataset(test_path, cache_dir) if test_path else None
+
+    if warm_start:
+        with timer.phase('load model'):
+            model = joblib.load(model_path)
+            encoder = joblib.load(encoder_path)
+            scaler = joblib.load(scaler_path)
+        # New trees must predict over the same classes as the existing ones
+        labels = set(np.unique(train_data['label']))
+        if labels != set(model.classes_):
+            raise ValueError(f"Warm start needs exactly the model's classes in the new data "
+                             f"(missing: {sorted(set(model.classes_) - labels)}, "
+                             f"new: {sorted(labels - set(model.classes_))}); run a full retrain instead.")
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + warm_start, n_jobs=n_jobs)
+        # The new data alone is a poor sample of normal traffic: keep the current first stage
+        first_stage = None
+        if os.path.exists(os.path.join(bundle_path, MANIFEST)):
+            first_stage = load_bundle(bundle_path).first_stage
+    else:
+        with timer.phase('fit preprocessing'):
+            encoder, scaler = fit_preprocessing(train_data)
+        model = make_forest(n_estimators, max_depth, min_samples_leaf, ccp_alpha, n_jobs)
+
+    with timer.phase('encode'):
+        X_train, y_train = encode(train_data, encoder, scaler), np.asarray(train_data['label'])
+        X_test = encode(test_data, encoder, scaler) if test_data is not None else None
+        X_calibrate = None
+        if calibration_share:
+            # Not stratified: some NSL-KDD classes have a single record
+            X_train, X_calibrate, y_train, y_calibrate = train_test_split(X_train, y_train,
+                                                                          test_size=calibration_share, random_state=0)
+    with timer.phase('fit forest'):
+        model.fit(mask_features(X_train, features), y_train)
+        model.warm_start = False
+    if not warm_start:
+        with timer.phase('fit first stage'):
+            first_stage = fit_first_stage(X_train, y_train, n_jobs=n_jobs)
+
+    accuracy = None
+    cascade = None
+    if X_test is not None:
+        with timer.phase('evaluate'):
+            accuracy = float(np.mean(model.predict(X_test) == np.asarray(test_data['label'])))
+    if X_calibrate is not None and first_stage is not None:
+        with timer.phase('calibrate cascade'):
+            cascade = calibrate(first_stage, CompiledForest.from_sklearn(model), X_calibrate, y_calibrate,
+                                max_recall_loss)
+
+    with timer.phase('save'):
+        joblib.dump(model, model_path)
+        joblib.dump(encoder, encoder_path)
+        joblib.dump(scaler, scaler_path)
+        save_bundle(bundle_path, model, encoder, scaler, first_stage, cascade['threshold'] if cascade else None,
+                    model_path=model_path)
+    return model, accuracy, cascade, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the intrusion detection model.")
+    parser.add_argument('--train', default='data/KDDTrain+.txt', help="NSL-KDD training file")
+    parser.add_argument('--test', default='data/KDDTest+.txt', help="NSL-KDD test file ('' to skip evaluation)")
+    parser.add_argument('--trees', type=int, default=100, help="forest size for a full retrain")
+    parser.add_argument('--max-depth', type=int, default=None, help="tree depth limit (default: none)")
+    parser.add_argument('--min-samples-leaf', type=int, default=1, help="pruning: smallest leaf")
+    parser.add_argument('--ccp-alpha', type=float, default=0.0, help="pruning: cost-complexity alpha")
+    parser.add_argument('--features', nargs='+', default=None, metavar='NAME',
+                        help="only split on these features (default: all 41)")
+    parser.add_argument('--warm-start', type=int, default=0, metavar='N',
+                        help="add N trees to the saved model instead of retraining")
+    parser.add_argument('--jobs', type=int, default=-1, help="cores to fit on (default: all)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="parsed dataset cache")
+    parser.add_argument('--max-recall-loss', type=float, default=DEFAULT_MAX_RECALL_LOSS,
+                        help="recall loss the cascade threshold is calibrated for")
+    parser.add_argument('--calibration-share', type=float, default=CALIBRATION_SHARE,
+                        help="share of --train held out to calibrate the cascade on (0: no cascade)")
+    args = parser.parse_args()
+    unknown = [name for name in args.features or [] if name not in feature_cols]
+    if unknown:
+        parser.error(f"unknown features: {', '.join(unknown)}")
+
+    model, accuracy, cascade, timer = train(args.train, args.test or None, args.trees, args.warm_start, args.jobs,
+                                            args.cache_dir, max_recall_loss=args.max_recall_loss,
+                                            max_depth=args.max_depth, min_samples_leaf=args.min_samples_leaf,
+                                            ccp_alpha=args.ccp_alpha, features=args.features,
+                                            calibration_share=args.calibration_share)
+    print(f"Trained {len(model.estimators_)} trees on {model.n_features_in_} features")
+    if accuracy is not None:
+        print(f"Test accuracy: {accuracy:.4f}")
+    if cascade is not None:
+        print(f"Cascade threshold {cascade['threshold']:.4f}: {cascade['escalated_fraction']:.2%} of held-out "
+              f"training rows escalated, recall loss {cascade['recall_loss']:.2%}, "
+              f"accuracy {cascade['cascade_accuracy']:.4f}")
+    print("Wall time per phase:")
+    timer.report()
+
+
+if __name__ == '__main__':
+    main()